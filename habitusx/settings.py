@@ -46,11 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'habitusxapp.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'habitusxapp.middleware.TimeZoneMiddleware',
+    'habitusxapp.middleware.CheckOffBufferMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "django_browser_reload.middleware.BrowserReloadMiddleware",
@@ -88,6 +91,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The per-user habit lists and analytics tables are cached in the backend named by HABITUSX_CACHE_ALIAS.
+# Use a shared backend (e.g. Redis, Memcached or a file-based cache) when running more than one process:
+# the rollover_streaks command refuses to run with a LocMemCache, whose invalidations the web processes would not see
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+HABITUSX_CACHE_ALIAS = 'default'
+
+# Write-behind buffering of the checkoffs (see habitusxapp/buffer.py), for SQLite deployments
+# where concurrent checkoffs fail with "database is locked"
+
+HABITUSX_CHECKOFF_BUFFER = False
+HABITUSX_CHECKOFF_BUFFER_LATENCY = 0.5  # seconds
+HABITUSX_CHECKOFF_BUFFER_BATCH_SIZE = 500
+
+# Number of habits of each leaderboard (see habitusxapp/leaderboards.py)
+HABITUSX_LEADERBOARD_SIZE = 100
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -0,0 +1,49 @@
+"""
+Settings for production deployments, on top of the development ones.
+Use them with DJANGO_SETTINGS_MODULE=habitusx.settings_production
+"""
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+# with DEBUG off, Django wraps the template loaders of TEMPLATES in its cached loader: compiled templates are kept in
+# memory for the lifetime of the process, and templates edited on disk are only picked up after a restart
+
+# persistent connections, so that the pragmas below are applied once per connection rather than once per request
+DATABASES = {
+    'default': {
+        **DATABASES['default'],
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+# a cache shared by the web processes and the management commands (e.g. rollover_streaks), in files next to the database
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    },
+}
+
+# a second connection to the same database, which only serves the reads of the analytics views (see habitusxapp/routers.py)
+DATABASES['analytics'] = {
+    **DATABASES['default'],
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['habitusxapp.routers.ReadOnlyRouter']
+
+HABITUSX_READ_ONLY_DATABASE = 'analytics'
+
+# applied to every new SQLite connection (see habitusxapp/signals.py):
+# in WAL mode readers do not block the writer and the writer does not block readers, synchronous=NORMAL only syncs
+# the WAL at checkpoints, and busy_timeout makes a writer wait for the lock instead of failing right away
+HABITUSX_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # milliseconds
+    'mmap_size': 256 * 1024 * 1024,  # bytes
+    'cache_size': -64 * 1024,  # negative values are KiB: 64 MiB per connection
+    'temp_store': 'MEMORY',
+}
@@ -1,6 +1,137 @@
+from datetime import datetime, time, timedelta
+from functools import lru_cache
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
 from .models import Habit, OccurrenceRate, CheckOff
 
-admin.site.register(Habit)
+# below this number of rows, an unfiltered changelist is counted exactly
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator of the changelists of large tables. Counting all the rows of a table reads the whole table (or one of
+    its indexes), so the number of rows of an unfiltered changelist is estimated from the range of the primary keys
+    instead, with two index seeks. The estimate is exact as long as no row has been deleted, and too high otherwise:
+    the last pages may then be short or empty. Filtered changelists (e.g. by date or by habit) are counted exactly,
+    on the rows their filters select from an index
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return queryset.count()
+        bounds = queryset.aggregate(first=models.Min("pk"), last=models.Max("pk"))
+        if bounds["first"] is None:
+            return 0
+        estimate = bounds["last"] - bounds["first"] + 1
+        return estimate if estimate > ESTIMATED_COUNT_THRESHOLD else queryset.count()
+
+
+class ChangeListQuerySet(models.QuerySet):
+    """
+    QuerySet of the changelists of large tables, whose date hierarchy and estimated count only read a few index
+    entries. Django lists the years, months or days of a date hierarchy with a SELECT DISTINCT of the truncated dates
+    of all the selected rows: here the first date of every non-empty year, month or day is found with a seek on the
+    index of the date column instead, one query per listed choice.
+    SQLite only reads a MIN or a MAX from an index when it is the only aggregate of its query, so the MIN and MAX
+    aggregated together by the date hierarchy and the paginator are read with one query each
+    """
+
+    def aggregate(self, *args, **kwargs):
+        if args or len(kwargs) < 2 or not all(isinstance(aggregate, (models.Min, models.Max)) for aggregate in kwargs.values()):
+            return super().aggregate(*args, **kwargs)
+        results = {}
+        for name, aggregate in kwargs.items():
+            results.update(super().aggregate(**{name: aggregate}))
+        return results
+
+    def get_first_value(self, field_name, start):
+        """
+        Returns the first value of a column from start on among the selected rows, or None if there is none
+        """
+        # SQLite seeks the index from the first lower bound of the column in the WHERE clause, so the one of start
+        # comes before the ones of the filters of the changelist
+        queryset = self.model._base_manager.filter(**{field_name + "__gte": start}) & self
+        return queryset.aggregate(first=models.Min(field_name))["first"]
+
+    def datetimes(self, field_name, kind, order="ASC", tzinfo=None):
+        if kind not in ("year", "month", "day") or order != "ASC":
+            return super().datetimes(field_name, kind, order, tzinfo)
+
+        time_zone = tzinfo or timezone.get_current_timezone()
+        starts = []
+        moment = self.aggregate(first=models.Min(field_name))["first"]
+        while moment is not None:
+            day = timezone.localtime(moment, time_zone).date()
+            if kind == "year":
+                day, next_day = day.replace(month=1, day=1), day.replace(year=day.year + 1, month=1, day=1)
+            elif kind == "month":
+                day = day.replace(day=1)
+                next_day = (day + timedelta(days=31)).replace(day=1)
+            else:
+                next_day = day + timedelta(days=1)
+            starts.append(datetime.combine(day, time.min, tzinfo=time_zone))
+            moment = self.get_first_value(field_name, datetime.combine(next_day, time.min, tzinfo=time_zone))
+        return starts
+
+
+@lru_cache(maxsize=None)
+def get_changelist_queryset_class(queryset_class):
+    """
+    Returns a subclass of ChangeListQuerySet and of the QuerySet class of a model, so that the changelists keep the
+    behaviour of the querysets of the model (e.g. the delete action sends checkoffs_deleted, see CheckOffQuerySet)
+    """
+    return type("ChangeList%s" % queryset_class.__name__, (ChangeListQuerySet, queryset_class), {})
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin of the tables that grow with the number of users and checkoffs: the changelists are paginated without
+    counting the whole table (see EstimatedCountPaginator), and their date hierarchy is built with index seeks
+    (see ChangeListQuerySet). The date hierarchy column should be indexed, and be the first column of ordering,
+    so that every page is read in the order of that index
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # same as ModelAdmin.get_queryset, with a ChangeListQuerySet built on the queryset of the default manager
+        queryset_class = get_changelist_queryset_class(type(self.model._default_manager.all()))
+        queryset = queryset_class(self.model)
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+
+@admin.register(Habit)
+class HabitAdmin(LargeTableAdmin):
+    list_display = ("description", "user", "occurrence", "date_created")
+    list_select_related = ("user", "occurrence")
+    search_fields = ("description",)
+    autocomplete_fields = ("user",)
+    date_hierarchy = "date_created"
+    ordering = ("-date_created",)
+
+
+@admin.register(CheckOff)
+class CheckOffAdmin(LargeTableAdmin):
+    list_display = ("id", "habit", "occurrence", "date_added", "period")
+    # the description of a checkoff reads its habit and the occurrence of the habit
+    list_select_related = ("habit__occurrence",)
+    raw_id_fields = ("habit",)
+    date_hierarchy = "date_added"
+    ordering = ("-date_added",)
+
+    @admin.display(description="Occurrence")
+    def occurrence(self, checkoff):
+        return checkoff.habit.occurrence
+
+
 admin.site.register(OccurrenceRate)
-admin.site.register(CheckOff)
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+Async versions of the home, filter and analytics views, meant to be served through the ASGI entry point (habitusx/asgi.py).
+They use the async ORM, so that no worker thread is held while the queries of a request are waiting on the database.
+They return a TemplateResponse, which the ASGI handler renders in a thread since context processors may lazily read
+the session and the user
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseNotAllowed
+from django.template.response import TemplateResponse
+from .cache import aget_or_compute
+from .models import Habit
+from .views import get_habit_list_context, filter_habits, get_analytics_page, get_analytics_parameters
+
+
+async def alist(queryset):
+    """
+    Evaluates a queryset with the async ORM
+    """
+    return [item async for item in queryset.aiterator()]
+
+
+async def get_authenticated_user(request):
+    """
+    Returns the authenticated user of the request, or None if the user has to log in
+    """
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+async def async_habits_list_view(request):
+    """
+    Async version of HabitsListView
+    """
+    user = await get_authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    async def get_habits():
+        return await alist(Habit.objects.filter(user=user).with_status(request.period_boundaries).order_by("date_created"))
+
+    habits = await aget_or_compute(user.pk, "habits", get_habits, boundaries=request.period_boundaries)
+    return TemplateResponse(request, "habit-list.html", await sync_to_async(get_habit_list_context)(habits, request.period_boundaries))
+
+
+async def async_filtered_habit_list_view(request, occurrence, checkedoffstatus):
+    """
+    Async version of FilteredHabitListView. The habits of any occurrence are read with a single query, as in the sync
+    view: the async ORM runs its queries one after the other in the thread that Django keeps for the database
+    connection (sync_to_async with thread_sensitive=True), so splitting them by occurrence would not run them concurrently
+    """
+    user = await get_authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    habits = Habit.objects.filter(user=user).with_status(request.period_boundaries).order_by("date_created", "pk")
+    habits = filter_habits(habits, occurrence, checkedoffstatus)
+
+    async def get_habits():
+        return await alist(habits)
+
+    habits = await aget_or_compute(user.pk, "filtered-habits", get_habits, "%s:%s" % (occurrence, checkedoffstatus), request.period_boundaries)
+    return TemplateResponse(request, "habit-list.html", await sync_to_async(get_habit_list_context)(habits, request.period_boundaries))
+
+
+async def async_analytics_view(request):
+    """
+    Async version of analytics_function_based_list_view. The page is built in a thread, since the paginator
+    does not support the async ORM
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    user = await get_authenticated_user(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    occurrence, sort_order, page_number = get_analytics_parameters(request)
+    today = request.period_boundaries.day
+
+    async def get_page():
+        return await sync_to_async(get_analytics_page)(user, today, occurrence, sort_order, page_number)
+
+    context = await aget_or_compute(user.pk, "analytics", get_page, "%s:%s:%s" % (occurrence, sort_order, page_number), request.period_boundaries)
+    return TemplateResponse(request, "analytics.html", {**context, "occurrence": occurrence, "sort": sort_order})
@@ -0,0 +1,97 @@
+"""
+Bitmap representation of the checkoff history of a habit, one bit per period (see models.CheckOffBitmap).
+A whole history is handled as a Python integer together with a base period, where bit i stands for the period
+base + i, so that streaks and completion rates are computed with bit operations instead of iterating over checkoffs
+"""
+from datetime import date
+from .periods import get_period_ordinal, get_period_start
+
+
+def get_year_first_period(year, daily_rate):
+    """
+    Returns the ordinal of the first period that starts on or after January 1st of the given year
+    """
+    period = get_period_ordinal(date(year, 1, 1), daily_rate)
+    if get_period_start(period, daily_rate) < date(year, 1, 1):
+        period += 1
+    return period
+
+
+def get_period_year(period, daily_rate):
+    """
+    Returns the year of the bitmap a period belongs to, the year in which the period starts
+    """
+    return get_period_start(period, daily_rate).year
+
+
+def pack_periods(periods, year, daily_rate, bits=b""):
+    """
+    Returns the bitmap of a year with the given periods set, in addition to the ones already set in bits
+    """
+    first_period = get_year_first_period(year, daily_rate)
+    size = get_year_first_period(year + 1, daily_rate) - first_period
+    history = int.from_bytes(bits, "little")
+    for period in periods:
+        history |= 1 << (period - first_period)
+    return history.to_bytes((size + 7) // 8, "little")
+
+
+def build_history(bitmaps, periods, daily_rate):
+    """
+    Merges the bitmaps of a habit, an iterable of (year, bits), and the periods of its checkoff rows into a single
+    history. Returns a tuple with the base period and the history integer
+    """
+    parts = [(get_year_first_period(year, daily_rate), int.from_bytes(bits, "little")) for year, bits in bitmaps]
+    parts += [(period, 1) for period in periods]
+    if not parts:
+        return 0, 0
+
+    base = min(offset for offset, _ in parts)
+    history = 0
+    for offset, bits in parts:
+        history |= bits << (offset - base)
+    return base, history
+
+
+def get_history_periods(base, history):
+    """
+    Returns the ordered list of the periods set in a history
+    """
+    return [base + index for index, bit in enumerate(reversed(bin(history)[2:])) if bit == "1"]
+
+
+def compute_history_streaks(base, history):
+    """
+    Same as periods.compute_streaks, for a history: returns a tuple with the longest streak, the streak that ends
+    in the last checked off period and the last period (None if no period is set)
+    """
+    if not history:
+        return 0, 0, None
+
+    length = history.bit_length()
+    # the current streak is made of the bits above the highest unset one
+    unset = ~history & ((1 << length) - 1)
+    current_streak = length - unset.bit_length()
+
+    # every iteration shortens all the runs of set bits by one, so the longest one disappears last
+    longest_streak = 0
+    runs = history
+    while runs:
+        runs &= runs >> 1
+        longest_streak += 1
+
+    return longest_streak, current_streak, base + length - 1
+
+
+def compute_completion_rate(base, history, first_period, last_period):
+    """
+    Returns the share of the periods from first_period to last_period (both included) that are set in a history
+    """
+    if last_period < first_period:
+        return 0.0
+    if first_period >= base:
+        window = history >> (first_period - base)
+    else:
+        window = history << (base - first_period)
+    window &= (1 << (last_period - first_period + 1)) - 1
+    return window.bit_count() / (last_period - first_period + 1)
@@ -0,0 +1,174 @@
+"""
+Write-behind buffering of the checkoffs created by CheckoffCreateView, enabled by the HABITUSX_CHECKOFF_BUFFER setting.
+SQLite allows a single writer at a time, so concurrent checkoffs wait on each other's transactions and, when a
+transaction that has already read needs to write, fail at once with "database is locked". When the buffer is enabled,
+the view queues its checkoff in memory and answers right away, and a background thread inserts the queued checkoffs
+with one bulk insert per transaction, at most HABITUSX_CHECKOFF_BUFFER_LATENCY seconds after the first of them was
+queued, or as soon as HABITUSX_CHECKOFF_BUFFER_BATCH_SIZE of them are queued.
+The queue belongs to the process: CheckOffBufferMiddleware flushes it before the reads of a user with queued
+checkoffs, so that the user sees them on the next page served by the same process, and it is flushed when the process
+exits. Checkoffs queued in a process that is killed are lost
+"""
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from .cache import bump_user_version
+from .models import Habit, CheckOff
+from .streaks import insert_checkoffs, record_checkoffs
+
+logger = logging.getLogger(__name__)
+
+
+def is_buffer_enabled():
+    return getattr(settings, "HABITUSX_CHECKOFF_BUFFER", False)
+
+
+class CheckOffBuffer:
+    """
+    The in-memory queue of the checkoffs waiting to be inserted, by (habit id, period), and the thread that flushes it
+    """
+
+    def __init__(self):
+        self.pending = {}
+        # the checkoffs taken from the queue by a flush that is still running
+        self.flushing = []
+        self.queued_at = None
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.stopped = False
+
+    @property
+    def max_latency(self):
+        return getattr(settings, "HABITUSX_CHECKOFF_BUFFER_LATENCY", 0.5)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, "HABITUSX_CHECKOFF_BUFFER_BATCH_SIZE", 500)
+
+    def get_or_add(self, habit, period, date_added):
+        """
+        Same as CheckOff.objects.get_or_create for the checkoff of a habit in a period, where the new checkoff is queued
+        instead of being inserted. Returns a tuple with the checkoff and whether it has been queued
+        """
+        key = (habit.pk, period)
+        with self.condition:
+            if key in self.pending:
+                return self.pending[key], False
+        checkoff = CheckOff.objects.filter(habit=habit, period=period).first()
+        if checkoff is not None:
+            return checkoff, False
+
+        checkoff = CheckOff(habit=habit, period=period, date_added=date_added)
+        with self.condition:
+            if key in self.pending:
+                return self.pending[key], False
+            self.pending[key] = checkoff
+            if self.queued_at is None:
+                self.queued_at = time.monotonic()
+            self.condition.notify()
+        self.start()
+        return checkoff, True
+
+    def has_pending(self, user_id=None):
+        """
+        Tells if checkoffs (of the given user, by default of any user) are waiting to be inserted or being inserted
+        """
+        with self.condition:
+            checkoffs = [*self.pending.values(), *self.flushing]
+        return any(user_id is None or checkoff.habit.user_id == user_id for checkoff in checkoffs)
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="checkoff-buffer", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.stopped)
+                if self.stopped:
+                    return
+                deadline = self.queued_at + self.max_latency
+                self.condition.wait_for(
+                    lambda: len(self.pending) >= self.batch_size or self.stopped,
+                    timeout=max(0, deadline - time.monotonic()),
+                )
+            # the thread keeps its own connection, which is closed if it has become unusable
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                # the thread must keep running, or nothing would be flushed in the background anymore
+                logger.exception("Could not flush the checkoff buffer")
+
+    def flush(self):
+        """
+        Inserts the queued checkoffs, in batches of HABITUSX_CHECKOFF_BUFFER_BATCH_SIZE, and updates the streak states
+        of their habits. Checkoffs of habits deleted in the meantime are dropped. If the database stays locked, or
+        the insert fails for any other reason, the checkoffs that could not be inserted are queued again and False
+        is returned: they have already been acknowledged to their users.
+        A flush waits for the one that is running, if any, so that all the checkoffs queued before it are inserted
+        when it returns
+        """
+        with self.flush_lock:
+            with self.condition:
+                self.flushing = list(self.pending.values())
+                self.pending.clear()
+                self.queued_at = None
+            try:
+                for start in range(0, len(self.flushing), self.batch_size):
+                    try:
+                        self.write(self.flushing[start:start + self.batch_size])
+                    except OperationalError as error:
+                        logger.warning("Could not flush %s checkoffs: %s", len(self.flushing) - start, error)
+                        self.requeue(self.flushing[start:])
+                        return False
+                    except Exception:
+                        logger.exception("Could not flush %s checkoffs", len(self.flushing) - start)
+                        self.requeue(self.flushing[start:])
+                        return False
+            finally:
+                with self.condition:
+                    self.flushing = []
+        return True
+
+    def write(self, checkoffs):
+        existing_ids = set(Habit.objects.filter(pk__in={checkoff.habit_id for checkoff in checkoffs}).values_list("pk", flat=True))
+        checkoffs = [checkoff for checkoff in checkoffs if checkoff.habit_id in existing_ids]
+        # the insert comes first, so that the transaction takes the write lock before reading anything
+        with transaction.atomic():
+            # a checkoff may have been inserted by another process since it was queued
+            checkoffs = insert_checkoffs(checkoffs)
+            record_checkoffs(checkoffs)
+        # bulk inserts do not send the post_save signal
+        for user_id in {checkoff.habit.user_id for checkoff in checkoffs}:
+            bump_user_version(user_id)
+
+    def requeue(self, checkoffs):
+        with self.condition:
+            for checkoff in checkoffs:
+                # the insert of a transaction that has been rolled back may have set the primary key
+                checkoff.pk = None
+                self.pending.setdefault((checkoff.habit_id, checkoff.period), checkoff)
+            # the next attempt waits for a whole latency period
+            self.queued_at = time.monotonic()
+
+    def stop(self):
+        """
+        Stops the thread and flushes the remaining checkoffs
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+checkoff_buffer = CheckOffBuffer()
+atexit.register(checkoff_buffer.stop)
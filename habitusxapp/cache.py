@@ -0,0 +1,137 @@
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+from .periods import get_period_boundaries
+
+VERSION_KEY = "habitusx:version:%s"
+VALUE_KEY = "habitusx:%s:%s:%s:%s:%s"
+STATS_KEY = "habitusx:stats:%s"
+MISSING = object()
+
+
+def get_cache():
+    """
+    Returns the Django cache backend used by the application, configured by the HABITUSX_CACHE_ALIAS setting
+    """
+    return caches[getattr(settings, "HABITUSX_CACHE_ALIAS", "default")]
+
+
+def is_cache_shared():
+    """
+    Tells if the cache backend of the application is shared by all the processes, so that the cached values
+    invalidated by a management command or a worker process (see bump_user_version) are invalidated for the web
+    processes too. A LocMemCache is local to each process
+    """
+    return not isinstance(get_cache(), LocMemCache)
+
+
+def get_user_version(user_id):
+    """
+    Returns the current cache version of a user. Every cached value of the user embeds the version in its key,
+    so that bumping the version invalidates all of them at once.
+    A version that is missing (e.g. evicted) is recreated from the clock, so that it never matches an older one
+    """
+    cache = get_cache()
+    version = cache.get(VERSION_KEY % user_id)
+    if version is None:
+        cache.add(VERSION_KEY % user_id, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY % user_id)
+    return version
+
+
+def bump_user_version(user_id):
+    """
+    Invalidates all the cached values of a user
+    """
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY % user_id)
+    except ValueError:
+        cache.set(VERSION_KEY % user_id, time.time_ns(), timeout=None)
+
+
+def record_cache_access(outcome):
+    """
+    Increments the shared counter of cache hits or misses
+    """
+    cache = get_cache()
+    try:
+        cache.incr(STATS_KEY % outcome)
+    except ValueError:
+        # the first access, or a backend that does not store anything such as DummyCache
+        cache.add(STATS_KEY % outcome, 1, timeout=None)
+
+
+def get_cache_stats():
+    """
+    Returns the number of cache hits and misses recorded so far (across all processes sharing the cache backend)
+    """
+    cache = get_cache()
+    hits = cache.get(STATS_KEY % "hits", 0)
+    misses = cache.get(STATS_KEY % "misses", 0)
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+
+
+def lookup(user_id, name, variant, boundaries, now):
+    """
+    Looks up the value cached for the given user, name and variant. Returns its key, the value (or MISSING)
+    and the number of seconds until the next day rollover of the user (which also covers the weekly rollover),
+    when habit statuses and streaks change even if no habit or checkoff has been written.
+    boundaries are the PeriodBoundaries of the user
+    """
+    key = VALUE_KEY % (name, user_id, get_user_version(user_id), boundaries.today.isoformat(), variant)
+    value = get_cache().get(key, MISSING)
+    if value is not MISSING:
+        record_cache_access("hits")
+    timeout = (boundaries.tomorrow - now).total_seconds()
+    return key, value, min(timeout, getattr(settings, "HABITUSX_CACHE_TIMEOUT", timeout))
+
+
+def store(key, value, timeout):
+    """
+    Caches a value that was missing (see lookup)
+    """
+    get_cache().set(key, value, timeout=timeout)
+    record_cache_access("misses")
+
+
+def get_many_or_compute(items, compute, timeout):
+    """
+    Returns a dictionary with the values cached for the keys of items, a dictionary of cache keys to items, where the
+    missing values are computed with compute(item) and cached for timeout seconds. The cache is read and written with
+    a single call each, rather than once per key
+    """
+    cache = get_cache()
+    values = cache.get_many(items.keys())
+    missing = {key: compute(item) for key, item in items.items() if key not in values}
+    if missing:
+        cache.set_many(missing, timeout=timeout)
+    return {**values, **missing}
+
+
+def get_or_compute(user_id, name, compute, variant="", boundaries=None):
+    """
+    Returns the value cached for the given user, name and variant, or computes it with compute() and caches it
+    until the next day rollover of the user, whose PeriodBoundaries are passed as boundaries (by default the UTC ones)
+    """
+    now = timezone.now()
+    key, value, timeout = lookup(user_id, name, variant, boundaries or get_period_boundaries(now), now)
+    if value is MISSING:
+        value = compute()
+        store(key, value, timeout)
+    return value
+
+
+async def aget_or_compute(user_id, name, compute, variant="", boundaries=None):
+    """
+    Async version of get_or_compute, where compute is a coroutine function. Cache backend calls run in a thread
+    """
+    now = timezone.now()
+    key, value, timeout = await sync_to_async(lookup)(user_id, name, variant, boundaries or get_period_boundaries(now), now)
+    if value is MISSING:
+        value = await compute()
+        await sync_to_async(store)(key, value, timeout)
+    return value
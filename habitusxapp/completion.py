@@ -0,0 +1,175 @@
+"""
+Completion heatmaps and rates over the last year.
+The heatmap of a user is read from the daily rollup of the checkoffs of the user (see models.DailyCheckOffCount),
+with a single grouped query over at most one row per day, whatever the number of habits. The rollup is updated
+in bulk as checkoffs are recorded (see streaks.record_checkoffs) or imported, and as checkoffs and habits are
+deleted (see signals.py). Checkoffs folded into bitmaps by compact_checkoffs keep being counted, since the command
+deletes their rows without signals.
+The heatmap and the completion rates of a single habit are computed from its own history (at most one period per day),
+merging its checkoff rows and its bitmaps (see bitmaps.py)
+"""
+from collections import Counter
+from datetime import timedelta
+from django.db import connection
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+from .bitmaps import build_history, compute_completion_rate, get_history_periods, get_period_year
+from .models import CheckOff, CheckOffBitmap, DailyCheckOffCount
+from .periods import get_period_ordinal, get_period_start, get_week_monday_from_day
+
+HEATMAP_BUCKETS = ["day", "week", "month"]
+HEATMAP_DAYS = 365
+COMPLETION_RATE_DAYS = [7, 30, 365]
+
+ADD_SQL = """
+    INSERT INTO {table} (user_id, day, checkoffs) VALUES (%s, %s, %s)
+    ON CONFLICT (user_id, day) DO UPDATE SET checkoffs = {table}.checkoffs + excluded.checkoffs
+"""
+SUBTRACT_SQL = "UPDATE {table} SET checkoffs = checkoffs - %s WHERE user_id = %s AND day = %s"
+
+
+def count_checkoff_days(checkoffs):
+    """
+    Returns a Counter of the given checkoffs by user id and first day of their period
+    """
+    return Counter(
+        (checkoff.habit.user_id, get_period_start(checkoff.period, checkoff.habit.occurrence.daily_rate))
+        for checkoff in checkoffs
+    )
+
+
+def count_history_days(habits):
+    """
+    Same as count_checkoff_days for the whole history of the given habits (a Habit queryset): the checkoff rows
+    are counted with a single grouped query, and the periods of the bitmaps are expanded
+    """
+    counts = Counter()
+    rows = (
+        CheckOff.objects.filter(habit__in=habits).values("habit__user_id", "habit__occurrence__daily_rate", "period")
+        .annotate(checkoffs=Count("pk")).order_by()
+        .values_list("habit__user_id", "habit__occurrence__daily_rate", "period", "checkoffs")
+    )
+    for user_id, daily_rate, period, checkoffs in rows:
+        counts[(user_id, get_period_start(period, daily_rate))] += checkoffs
+    bitmaps = CheckOffBitmap.objects.filter(habit__in=habits).values_list("habit__user_id", "habit__occurrence__daily_rate", "year", "bits")
+    for user_id, daily_rate, year, bits in bitmaps:
+        for period in get_history_periods(*build_history([(year, bytes(bits))], [], daily_rate)):
+            counts[(user_id, get_period_start(period, daily_rate))] += 1
+    return counts
+
+
+def add_daily_checkoffs(counts):
+    """
+    Adds a Counter like the ones of count_checkoff_days to the daily rollup, with a single upsert statement
+    """
+    rows = [(user_id, connection.ops.adapt_datefield_value(day), checkoffs) for (user_id, day), checkoffs in counts.items() if checkoffs]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(ADD_SQL.format(table=DailyCheckOffCount._meta.db_table), rows)
+
+
+def remove_daily_checkoffs(counts):
+    """
+    Subtracts a Counter like the ones of count_checkoff_days from the daily rollup, and deletes the days left without
+    checkoffs. Missing days are not created, so that nothing is written for the users being deleted
+    """
+    rows = [(checkoffs, user_id, connection.ops.adapt_datefield_value(day)) for (user_id, day), checkoffs in counts.items() if checkoffs]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(SUBTRACT_SQL.format(table=DailyCheckOffCount._meta.db_table), rows)
+        DailyCheckOffCount.objects.filter(user_id__in={user_id for user_id, _ in counts}, checkoffs__lte=0).delete()
+
+
+def get_bucket_start(day, bucket):
+    """
+    Returns the first day of the heatmap bucket (one of HEATMAP_BUCKETS) a day belongs to
+    """
+    if bucket == "week":
+        return get_week_monday_from_day(day)
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def get_heatmap_start(today, bucket):
+    """
+    Returns the first day of the heatmap ending today, which starts with the bucket of the day HEATMAP_DAYS days ago
+    """
+    return get_bucket_start(today - timedelta(days=HEATMAP_DAYS - 1), bucket)
+
+
+def build_heatmap(counts, start, today, bucket):
+    """
+    Returns the list of the buckets from start to today, as dictionaries with the first day of the bucket (date)
+    and its number of checkoffs in counts (a dictionary of bucket starts), 0 for the buckets missing from counts
+    """
+    heatmap = []
+    day = start
+    while day <= today:
+        heatmap.append({"date": day, "checkoffs": counts.get(day, 0)})
+        # a month is at most 31 days long, and the start of the next bucket is the start of the bucket of that day
+        day = get_bucket_start(day + timedelta(days={"day": 1, "week": 7, "month": 31}[bucket]), bucket)
+    return heatmap
+
+
+def get_user_heatmap(user, today, bucket):
+    """
+    Returns the heatmap (see build_heatmap) of the number of checkoffs of all the habits of a user over the last year.
+    today is the current local date of the user
+    """
+    start = get_heatmap_start(today, bucket)
+    days = DailyCheckOffCount.objects.filter(user=user, day__gte=start, day__lte=today)
+    if bucket == "day":
+        days = days.annotate(bucket=F("day"))
+    else:
+        days = days.annotate(bucket=Trunc("day", bucket, output_field=DateField()))
+    counts = dict(days.values("bucket").annotate(total=Sum("checkoffs")).order_by().values_list("bucket", "total"))
+    return build_heatmap(counts, start, today, bucket)
+
+
+def get_habit_history(habit, first_period):
+    """
+    Returns the history (see bitmaps.build_history) of a habit from first_period on, read from its checkoff rows
+    and the bitmaps of the years the periods belong to
+    """
+    daily_rate = habit.occurrence.daily_rate
+    periods = CheckOff.objects.filter(habit=habit, period__gte=first_period).values_list("period", flat=True)
+    bitmaps = CheckOffBitmap.objects.filter(habit=habit, year__gte=get_period_year(first_period, daily_rate)).values_list("year", "bits")
+    return build_history([(year, bytes(bits)) for year, bits in bitmaps], periods, daily_rate)
+
+
+def get_habit_completion(habit, today, time_zone, bucket):
+    """
+    Returns the completion of a habit over the last year as a dictionary with:
+        - heatmap: the heatmap (see build_heatmap) of the checked off periods of the habit by first day of period,
+          where every bucket also has the number of periods of the habit since it was created (periods)
+        - rates: the completion rate of the habit over the last 7, 30 and 365 days (see COMPLETION_RATE_DAYS),
+          the share of its periods in the window that have been checked off, or None if no period of the window
+          is over yet. The current period only counts once it is checked off
+    today is the current local date of the owner of the habit, and time_zone their time zone
+    """
+    daily_rate = habit.occurrence.daily_rate
+    start = get_heatmap_start(today, bucket)
+    current_period = get_period_ordinal(today, daily_rate)
+    created_period = get_period_ordinal(habit.date_created, daily_rate, time_zone)
+    # the heatmap reaches further back than the longest window
+    first_period = max(get_period_ordinal(start, daily_rate), created_period)
+    base, history = get_habit_history(habit, first_period)
+    checked_periods = set(get_history_periods(base, history))
+
+    checkoffs, periods = Counter(), Counter()
+    for period in range(first_period, current_period + 1):
+        day = get_period_start(period, daily_rate)
+        if day >= start:
+            checkoffs[get_bucket_start(day, bucket)] += period in checked_periods
+            periods[get_bucket_start(day, bucket)] += 1
+    heatmap = build_heatmap(checkoffs, start, today, bucket)
+    for item in heatmap:
+        item["periods"] = periods.get(item["date"], 0)
+
+    last_period = current_period if current_period in checked_periods else current_period - 1
+    rates = {}
+    for days in COMPLETION_RATE_DAYS:
+        window_first_period = max(get_period_ordinal(today - timedelta(days=days - 1), daily_rate), created_period)
+        rates[days] = compute_completion_rate(base, history, window_first_period, last_period) if last_period >= window_first_period else None
+    return {"heatmap": heatmap, "rates": rates}
@@ -0,0 +1,18 @@
+from django import forms
+from .models import Profile, get_time_zone_names
+
+
+def get_time_zone_choices():
+    return [(name, name) for name in get_time_zone_names()]
+
+
+class TimeZoneForm(forms.ModelForm):
+    """
+    Lets a user choose the time zone of their profile among the IANA time zones
+    """
+
+    time_zone = forms.ChoiceField(choices=get_time_zone_choices, label="Time zone")
+
+    class Meta:
+        model = Profile
+        fields = ["time_zone"]
@@ -0,0 +1,185 @@
+"""
+Export and import of the whole history of a user, as CSV or NDJSON (one JSON object per line).
+Both formats contain the same records, with the fields of RECORD_FIELDS: first one "habit" record per habit
+(with its description, daily_rate and creation date), then one "checkoff" record per checkoff (with the habit_id of
+its habit and its date). Habit ids are only used to link the checkoffs to their habit within the file, so a history
+can be imported by any user, and files from other trackers can be converted to this format
+"""
+import csv
+import json
+from datetime import datetime, time, timezone as dt_timezone
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .bitmaps import build_history, get_history_periods
+from .cache import bump_user_version
+from .completion import add_daily_checkoffs, count_history_days
+from .models import Habit, CheckOff, CheckOffBitmap, OccurrenceRate, get_user_time_zone
+from .periods import get_local_midnight, get_period_ordinal, get_period_start, to_local_date
+from .streaks import rebuild_streak_states
+
+FORMATS = ["csv", "ndjson"]
+RECORD_FIELDS = ["record", "habit_id", "description", "daily_rate", "date"]
+
+
+class Echo:
+    """
+    A file-like object whose write method returns the written value, so that csv.writer can produce the lines
+    of a streaming response one at a time
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_history_records(user, chunk_size=2000):
+    """
+    Yields the records of the history of a user, reading the database in chunks of chunk_size rows.
+    The checkoffs compacted into bitmaps are exported with the start of their period in the time zone of the user as date,
+    so that they are imported back into the same period
+    """
+    time_zone = get_user_time_zone(user)
+    habits = Habit.objects.filter(user=user).select_related("occurrence").order_by("pk")
+    for habit in habits.iterator(chunk_size=chunk_size):
+        yield {"record": "habit", "habit_id": habit.pk, "description": habit.description, "daily_rate": habit.occurrence.daily_rate, "date": habit.date_created.isoformat()}
+
+    bitmaps = CheckOffBitmap.objects.filter(habit__in=habits.values("pk")).order_by("habit_id", "year")
+    for habit_id, daily_rate, year, bits in bitmaps.values_list("habit_id", "habit__occurrence__daily_rate", "year", "bits").iterator(chunk_size=chunk_size):
+        for period in get_history_periods(*build_history([(year, bytes(bits))], [], daily_rate)):
+            date_added = get_local_midnight(get_period_start(period, daily_rate), time_zone)
+            yield {"record": "checkoff", "habit_id": habit_id, "date": date_added.isoformat()}
+
+    # filtering on a habit subquery, rather than joining the habits, lets the database read the checkoffs in index order
+    checkoffs = CheckOff.objects.filter(habit__in=habits.values("pk")).order_by("habit_id", "date_added")
+    for habit_id, date_added in checkoffs.values_list("habit_id", "date_added").iterator(chunk_size=chunk_size):
+        yield {"record": "checkoff", "habit_id": habit_id, "date": date_added.isoformat()}
+
+
+def iter_history_lines(user, format, chunk_size=2000):
+    """
+    Yields the lines of the history of a user in the given format (see FORMATS)
+    """
+    records = iter_history_records(user, chunk_size)
+    if format == "csv":
+        writer = csv.DictWriter(Echo(), fieldnames=RECORD_FIELDS)
+        yield writer.writeheader()
+        for record in records:
+            yield writer.writerow(record)
+    else:
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+
+def parse_history_date(value):
+    """
+    Parses an ISO date or datetime, naive values being UTC. Raises ValueError for invalid values
+    """
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError("invalid date %r" % value)
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment
+
+
+def iter_import_records(stream, format, occurrences, now):
+    """
+    Parses and validates the records of a history file, a text stream in the given format.
+    Yields tuples of (line number, record type, file habit id, values), where values are the fields of the habit
+    or of the checkoff to create. Raises ValueError, with the line number, for the first invalid record
+    """
+    if format == "csv":
+        lines = enumerate(csv.DictReader(stream), start=2)
+    else:
+        lines = ((number, json.loads(line)) for number, line in enumerate(stream, start=1) if line.strip())
+
+    habit_ids = set()
+    try:
+        for number, record in lines:
+            try:
+                habit_id = int(record["habit_id"])
+                moment = parse_history_date(record["date"])
+                if moment > now:
+                    raise ValueError("the date is in the future")
+                if record["record"] == "habit":
+                    if habit_id in habit_ids:
+                        raise ValueError("duplicate habit_id %s" % habit_id)
+                    if int(record["daily_rate"]) not in occurrences:
+                        raise ValueError("unsupported daily_rate %r" % record["daily_rate"])
+                    if not str(record["description"] or "").strip():
+                        raise ValueError("the description is empty")
+                    habit_ids.add(habit_id)
+                    yield number, "habit", habit_id, {"description": record["description"], "occurrence": occurrences[int(record["daily_rate"])], "date_created": moment}
+                elif record["record"] == "checkoff":
+                    if habit_id not in habit_ids:
+                        raise ValueError("unknown habit_id %s" % habit_id)
+                    yield number, "checkoff", habit_id, {"date_added": moment}
+                else:
+                    raise ValueError("unknown record %r" % record["record"])
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError("line %s: %s" % (number, error))
+    except (csv.Error, UnicodeDecodeError) as error:
+        raise ValueError("the file is not valid %s: %s" % (format, error))
+
+
+def import_history(user, stream, format, batch_size=1000, progress=None):
+    """
+    Imports a history file (see iter_import_records) as new habits and checkoffs of the user.
+    The whole file is validated first, so that an invalid file imports nothing, then it is read again and imported
+    with bulk inserts, in one transaction per batch of batch_size records. progress is called with the number
+    of records imported after each batch. Checkoffs are assigned to the periods of the time zone of the user,
+    and checkoffs falling in an already checked off period are skipped.
+    Finally the streak states of the new habits are built, and their checkoffs are added to the daily rollup of the user.
+    Returns a dictionary with the number of imported habits and checkoffs, and of skipped checkoffs
+    """
+    now = timezone.now()
+    time_zone = get_user_time_zone(user)
+    occurrences = {occurrence.daily_rate: occurrence for occurrence in OccurrenceRate.objects.filter(daily_rate__in=[1, 7])}
+    for _ in iter_import_records(stream, format, occurrences, now):
+        pass
+    stream.seek(0)
+
+    habits = {}
+    batch = []
+    processed = 0
+
+    def flush():
+        new_habits = [item for kind, item in batch if kind == "habit"]
+        checkoffs = [item for kind, item in batch if kind == "checkoff"]
+        with transaction.atomic():
+            Habit.objects.bulk_create(new_habits)
+            for checkoff in checkoffs:
+                # the habits of the batch have their primary key now
+                checkoff.habit_id = checkoff.habit.pk
+            CheckOff.objects.bulk_create(checkoffs, ignore_conflicts=True)
+        if progress:
+            progress(processed)
+        batch.clear()
+
+    for number, kind, habit_id, values in iter_import_records(stream, format, occurrences, now):
+        if kind == "habit":
+            habits[habit_id] = Habit(user=user, **values)
+            batch.append(("habit", habits[habit_id]))
+        else:
+            habit = habits[habit_id]
+            batch.append(("checkoff", CheckOff(habit=habit, period=get_period_ordinal(values["date_added"], habit.occurrence.daily_rate, time_zone), **values)))
+        processed += 1
+        if len(batch) == batch_size:
+            flush()
+    flush()
+
+    habit_ids = [habit.pk for habit in habits.values()]
+    for start in range(0, len(habit_ids), 500):
+        new_habits = Habit.objects.filter(pk__in=habit_ids[start:start + 500])
+        rebuild_streak_states(new_habits, to_local_date(now, time_zone))
+        # the checkoffs skipped by ignore_conflicts are not counted
+        add_daily_checkoffs(count_history_days(new_habits))
+    # bulk inserts do not send the post_save signal
+    bump_user_version(user.pk)
+
+    # ignore_conflicts does not tell which checkoffs have been inserted
+    checkoffs = CheckOff.objects.filter(habit_id__in=habit_ids).count()
+    return {"habits": len(habits), "checkoffs": checkoffs, "skipped": processed - len(habits) - checkoffs}
@@ -0,0 +1,103 @@
+"""
+Leaderboards of the habits with the longest streaks across all users: one per occurrence, and one for all the
+occurrences together. Each leaderboard is a bounded table of LeaderboardEntry rows, which is updated as the streak
+states change instead of being computed from the streak states (or the checkoffs) of every habit. A leaderboard is
+only rebuilt from the streak states when it loses an entry, i.e. when a habit of the leaderboard is deleted or its
+longest streak is rebuilt shorter (when some of its checkoffs are deleted, see signals.py). The rank of a habit in a leaderboard is counted on its entries, and the rank of
+a habit that is not in a leaderboard is counted on the index of the longest streaks
+"""
+from django.conf import settings
+from django.db import transaction
+from .models import LeaderboardEntry, OccurrenceRate, StreakState
+
+
+def get_leaderboard_size():
+    return getattr(settings, "HABITUSX_LEADERBOARD_SIZE", 100)
+
+
+def rebuild_leaderboard(occurrence_id=None):
+    """
+    Replaces the entries of the leaderboard of an occurrence (by default of all the occurrences) with the habits
+    having the longest streaks
+    """
+    states = StreakState.objects.filter(longest_streak__gt=0)
+    if occurrence_id is not None:
+        states = states.filter(occurrence_id=occurrence_id)
+    top = states.order_by("-longest_streak", "habit_id").values_list("habit_id", "longest_streak")[:get_leaderboard_size()]
+    with transaction.atomic():
+        LeaderboardEntry.objects.filter(occurrence_id=occurrence_id).delete()
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(habit_id=habit_id, occurrence_id=occurrence_id, longest_streak=longest_streak)
+            for habit_id, longest_streak in top
+        ])
+
+
+def rebuild_leaderboards():
+    """
+    Rebuilds all the leaderboards
+    """
+    for occurrence_id in [None, *OccurrenceRate.objects.values_list("pk", flat=True)]:
+        rebuild_leaderboard(occurrence_id)
+
+
+def merge_into_leaderboard(states, occurrence_id=None):
+    """
+    Merges the longest streaks of the given StreakStates into the leaderboard of an occurrence (by default of all the
+    occurrences): the entries are read (at most HABITUSX_LEADERBOARD_SIZE of them), and only the ones whose habit
+    enters, leaves or moves in the leaderboard are written.
+    A habit of the leaderboard whose streak is now shorter may have been overtaken by habits that are not in the
+    leaderboard, so the leaderboard is rebuilt in that case
+    """
+    entries = dict(LeaderboardEntry.objects.filter(occurrence_id=occurrence_id).values_list("habit_id", "longest_streak"))
+    streaks = dict(entries)
+    for state in states:
+        if state.habit_id in entries and state.longest_streak < entries[state.habit_id]:
+            rebuild_leaderboard(occurrence_id)
+            return
+        if state.longest_streak > 0:
+            streaks[state.habit_id] = state.longest_streak
+
+    top = dict(sorted(streaks.items(), key=lambda item: (-item[1], item[0]))[:get_leaderboard_size()])
+    stale_ids = [habit_id for habit_id, longest_streak in entries.items() if top.get(habit_id) != longest_streak]
+    new_entries = [
+        LeaderboardEntry(habit_id=habit_id, occurrence_id=occurrence_id, longest_streak=longest_streak)
+        for habit_id, longest_streak in top.items() if entries.get(habit_id) != longest_streak
+    ]
+    if stale_ids:
+        LeaderboardEntry.objects.filter(occurrence_id=occurrence_id, habit_id__in=stale_ids).delete()
+    if new_entries:
+        LeaderboardEntry.objects.bulk_create(new_entries)
+
+
+def update_leaderboards(states):
+    """
+    Merges the given new or updated StreakStates into the leaderboard of their occurrence and into the leaderboard
+    of all the occurrences
+    """
+    if not states:
+        return
+    occurrence_ids = {state.occurrence_id for state in states}
+    with transaction.atomic():
+        merge_into_leaderboard(states)
+        for occurrence_id in occurrence_ids:
+            merge_into_leaderboard([state for state in states if state.occurrence_id == occurrence_id], occurrence_id)
+
+
+def get_leaderboard_rank(state, occurrence_id=None):
+    """
+    Returns the rank of the habit of a StreakState in the leaderboard of an occurrence (by default of all the
+    occurrences), which is 1 plus the number of habits with a strictly longer streak, or None if the habit has never
+    been checked off. Every habit with a longer streak than a habit of the leaderboard is in the leaderboard as well,
+    so the habits of the leaderboard are ranked among its (at most HABITUSX_LEADERBOARD_SIZE) entries. The other
+    habits are ranked with a count over a range of an index of the streak states, which does not join the habits
+    """
+    if state.longest_streak == 0:
+        return None
+    entries = LeaderboardEntry.objects.filter(occurrence_id=occurrence_id)
+    if entries.filter(habit_id=state.habit_id, longest_streak=state.longest_streak).exists():
+        longer = entries.filter(longest_streak__gt=state.longest_streak)
+    else:
+        longer = StreakState.objects.filter(longest_streak__gt=state.longest_streak)
+        if occurrence_id is not None:
+            longer = longer.filter(occurrence_id=occurrence_id)
+    return longer.count() + 1
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from habitusxapp.models import Habit
+from habitusxapp.streaks import rebuild_streak_states
+
+
+class Command(BaseCommand):
+    """
+    Builds the StreakState of every habit from the existing checkoffs. 
+    It needs to be run once after the streak state table is created, and it is safe to run it again at any time
+    """
+
+    help = "Builds the persisted streak state of every habit from its checkoff history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of habits processed per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        habit_ids = list(Habit.objects.order_by("pk").values_list("pk", flat=True))
+
+        for start in range(0, len(habit_ids), batch_size):
+            rebuild_streak_states(Habit.objects.filter(pk__in=habit_ids[start:start + batch_size]))
+
+        self.stdout.write(self.style.SUCCESS("Built the streak state of %s habits" % len(habit_ids)))
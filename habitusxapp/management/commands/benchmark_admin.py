@@ -0,0 +1,70 @@
+import statistics
+import time
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from habitusxapp.models import Habit, CheckOff
+
+
+class Command(BaseCommand):
+    """
+    Measures the time to load the admin changelists of checkoffs and habits, with the admin classes of admin.py and
+    with the default ModelAdmin: the unfiltered list, its second page, the years, months and days of the date
+    hierarchy of the latest rows, and the rows of a single habit or user. The views are called directly with an unsaved
+    superuser, so the command does not write anything. Run it against a database filled by generate_synthetic_data,
+    e.g. --users 1500 --habits 12 --years 3 for about 10 million checkoffs.
+    The default date hierarchy reads all the rows of the table, which takes seconds on such a table: --skip-default
+    only measures the admin classes of admin.py
+    """
+
+    help = "Benchmarks the admin changelists of checkoffs and habits against the default ModelAdmin"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5, help="Number of measured loads of every page")
+        parser.add_argument("--skip-default", action="store_true", help="Do not measure the default ModelAdmin")
+
+    def handle(self, *args, **options):
+        checkoff = CheckOff.objects.order_by("-date_added").first()
+        if checkoff is None:
+            raise CommandError("There is no checkoff to list")
+        self.user = User(username="benchmark-admin", is_staff=True, is_superuser=True)
+        self.repeat = options["repeat"]
+        self.stdout.write("%s checkoffs, %s habits\n" % (CheckOff.objects.count(), Habit.objects.count()))
+
+        pages = [
+            (CheckOff, "date_added", checkoff.date_added, {"habit__id__exact": checkoff.habit_id}),
+            (Habit, "date_created", Habit.objects.order_by("-date_created").first().date_created, {"user__id__exact": checkoff.habit.user_id}),
+        ]
+        self.stdout.write("%-10s %-16s %20s %20s" % ("model", "page", "default ms (queries)", "admin.py ms (queries)"))
+        for model, field_name, moment, owner_filter in pages:
+            queries = [
+                ("all", {}),
+                ("page 2", {"p": "2"}),
+                ("year", {field_name + "__year": moment.year}),
+                ("month", {field_name + "__year": moment.year, field_name + "__month": moment.month}),
+                ("day", {field_name + "__year": moment.year, field_name + "__month": moment.month, field_name + "__day": moment.day}),
+                ("owner", owner_filter),
+            ]
+            for name, params in queries:
+                default = "skipped" if options["skip_default"] else "%8.1f (%d)" % self.measure(admin.ModelAdmin(model, admin.site), params)
+                self.stdout.write("%-10s %-16s %20s %20s" % (
+                    model.__name__, name, default, "%8.1f (%d)" % self.measure(admin.site._registry[model], params),
+                ))
+
+    def measure(self, model_admin, params):
+        """
+        Loads a changelist once to warm up, then repeat times, and returns the median duration in milliseconds
+        and the number of queries of a load
+        """
+        durations = []
+        for _ in range(self.repeat + 1):
+            request = RequestFactory().get("/admin/", params)
+            request.user = self.user
+            started_at = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                model_admin.changelist_view(request).render()
+            durations.append((time.perf_counter() - started_at) * 1000)
+        return statistics.median(durations[1:]), len(queries)
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+from django.urls import reverse
+
+VIEWS = [
+    ("home", "async-home", {}),
+    ("filtered", "async-filtered", {"occurrence": "any-occurrence", "checkedoffstatus": "streak-broken"}),
+    ("analytics", "async-analytics", {}),
+]
+
+NO_CACHE = {
+    "CACHES": {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "benchmark": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    },
+    "HABITUSX_CACHE_ALIAS": "benchmark",
+}
+
+
+class Command(BaseCommand):
+    """
+    Compares the throughput (requests/sec) of the sync views served through the WSGI handler with the one of
+    their async versions served through the ASGI handler, under a number of concurrent clients.
+    Both handlers are driven in-process by Django's test clients (Client and AsyncClient), so no server is needed.
+    Sync clients run in a thread pool, async clients are tasks on a single event loop. The queries of the async
+    clients do not run concurrently: the async ORM runs all of them, one at a time, in the thread that Django keeps for
+    the database connection (sync_to_async with thread_sensitive=True)
+    """
+
+    help = "Benchmarks the sync (WSGI) and async (ASGI) versions of the home, filter and analytics views"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User whose pages are requested")
+        parser.add_argument("--clients", type=int, default=8, help="Number of concurrent clients")
+        parser.add_argument("--requests", type=int, default=25, help="Number of requests per client")
+        parser.add_argument("--no-cache", action="store_true", help="Disable the per-user cache during the benchmark")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError("User %s does not exist" % options["username"])
+
+        clients, requests = options["clients"], options["requests"]
+        self.stdout.write("%d clients x %d requests per view\n" % (clients, requests))
+        self.stdout.write("%-12s %14s %14s" % ("view", "sync req/s", "async req/s"))
+
+        with override_settings(**NO_CACHE) if options["no_cache"] else override_settings():
+            for sync_name, async_name, kwargs in VIEWS:
+                sync_rate = self.run_sync(reverse(sync_name, kwargs=kwargs), user, clients, requests)
+                async_rate = asyncio.run(self.run_async(reverse(async_name, kwargs=kwargs), user, clients, requests))
+                self.stdout.write("%-12s %14.1f %14.1f" % (sync_name, sync_rate, async_rate))
+
+    def run_sync(self, url, user, clients, requests):
+        def run_client(client):
+            try:
+                for _ in range(requests):
+                    self.check_response(client.get(url), url)
+            finally:
+                connections.close_all()
+
+        sync_clients = [self.logged_in(Client(), user) for _ in range(clients)]
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(run_client, sync_clients))
+        return clients * requests / (time.perf_counter() - started_at)
+
+    async def run_async(self, url, user, clients, requests):
+        async def run_client(client):
+            for _ in range(requests):
+                self.check_response(await client.get(url), url)
+
+        async_clients = [AsyncClient() for _ in range(clients)]
+        for client in async_clients:
+            await client.aforce_login(user)
+        started_at = time.perf_counter()
+        await asyncio.gather(*[run_client(client) for client in async_clients])
+        return clients * requests / (time.perf_counter() - started_at)
+
+    def logged_in(self, client, user):
+        client.force_login(user)
+        return client
+
+    def check_response(self, response, url):
+        if response.status_code != 200:
+            raise CommandError("%s returned status %s" % (url, response.status_code))
@@ -0,0 +1,146 @@
+import logging
+import multiprocessing
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from habitusxapp.models import Habit, OccurrenceRate
+from .benchmark_async import NO_CACHE
+from .stress_checkoffs import create_stress_users
+
+
+class Command(BaseCommand):
+    """
+    Measures the throughput of concurrent checkoffs (writes) and analytics pages (reads) with two database profiles:
+    the default one (rollback journal, no pragmas, analytics read on the default connection) and the production one
+    of the current settings (HABITUSX_SQLITE_PRAGMAS and the read-only connection of HABITUSX_READ_ONLY_DATABASE,
+    see settings_production.py). Every client is a separate process: writers check off the habits of their own user
+    while readers load the analytics page of the given user, with the cache disabled, until the writers are done.
+    Run it with the production settings, against a copy of the database: it creates users, and deletes them at the end
+    """
+
+    help = "Benchmarks concurrent reads and writes with the default and the production database profiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User whose analytics page is read")
+        parser.add_argument("--writers", type=int, default=4, help="Number of writer processes")
+        parser.add_argument("--readers", type=int, default=4, help="Number of reader processes")
+        parser.add_argument("--checkoffs", type=int, default=50, help="Number of checkoffs per writer")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The benchmark compares SQLite profiles")
+        if not getattr(settings, "HABITUSX_READ_ONLY_DATABASE", None) or not getattr(settings, "HABITUSX_SQLITE_PRAGMAS", None):
+            raise CommandError("Run the benchmark with the production settings (DJANGO_SETTINGS_MODULE=habitusx.settings_production)")
+        try:
+            reader = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError("User %s does not exist" % options["username"])
+        daily = OccurrenceRate.objects.filter(daily_rate=1).first()
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            journal_mode = cursor.fetchone()[0]
+
+        profiles = [
+            ("default", {"HABITUSX_SQLITE_PRAGMAS": {}, "DATABASE_ROUTERS": []}, "DELETE"),
+            ("production", {}, settings.HABITUSX_SQLITE_PRAGMAS.get("journal_mode", journal_mode)),
+        ]
+        self.stdout.write("%d writers x %d checkoffs, %d readers\n" % (options["writers"], options["checkoffs"], options["readers"]))
+        self.stdout.write("%-12s %10s %10s %12s" % ("profile", "writes/s", "reads/s", "lock errors"))
+        try:
+            for name, overrides, profile_journal_mode in profiles:
+                users = create_stress_users(options["writers"], options["checkoffs"], daily)
+                try:
+                    with override_settings(**NO_CACHE, **overrides):
+                        self.set_journal_mode(profile_journal_mode)
+                        writes, reads, errors = self.run(users, reader, options["readers"])
+                    self.stdout.write("%-12s %10.1f %10.1f %12d" % (name, writes, reads, errors))
+                finally:
+                    User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        finally:
+            self.set_journal_mode(journal_mode)
+
+    def set_journal_mode(self, journal_mode):
+        # the journal mode is stored in the database file, and can only be changed without other connections
+        connections.close_all()
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode = %s" % journal_mode)
+        connections.close_all()
+
+    def run(self, writers, reader, readers):
+        """
+        Runs the writer and reader processes, and returns the number of checkoffs and of analytics pages per second
+        and the number of requests that failed with a locked database
+        """
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        done = context.Event()
+        processes = []
+        for user in writers:
+            client = Client()
+            # logging in writes the session, which is done before the clients start
+            client.force_login(user)
+            habit_ids = list(Habit.objects.filter(user=user).values_list("pk", flat=True))
+            processes.append(context.Process(target=run_writer, args=(client, habit_ids, results)))
+        for _ in range(readers):
+            client = Client()
+            client.force_login(reader)
+            processes.append(context.Process(target=run_reader, args=(client, done, results)))
+
+        # the processes must not share the connections of the parent
+        connections.close_all()
+        started_at = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in writers]
+        duration = time.perf_counter() - started_at
+        done.set()
+        outcomes += [results.get() for _ in range(readers)]
+        for process in processes:
+            process.join()
+
+        writes = sum(count for kind, count, _ in outcomes if kind == "write")
+        reads = sum(count for kind, count, _ in outcomes if kind == "read")
+        return writes / duration, reads / duration, sum(errors for _, _, errors in outcomes)
+
+
+def run_writer(client, habit_ids, results):
+    """
+    Checks off the given habits one after the other
+    """
+    # the failed requests are counted rather than logged
+    logging.disable(logging.CRITICAL)
+    writes, errors = 0, 0
+    try:
+        for habit_id in habit_ids:
+            try:
+                client.post(reverse("checkoff-habit", kwargs={"pk": habit_id}), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+                writes += 1
+            except OperationalError:
+                errors += 1
+    finally:
+        results.put(("write", writes, errors))
+        connections.close_all()
+
+
+def run_reader(client, done, results):
+    """
+    Loads the analytics page until the writers are done
+    """
+    logging.disable(logging.CRITICAL)
+    reads, errors = 0, 0
+    try:
+        while not done.is_set():
+            try:
+                client.get(reverse("analytics"))
+                reads += 1
+            except OperationalError:
+                errors += 1
+    finally:
+        results.put(("read", reads, errors))
+        connections.close_all()
@@ -0,0 +1,65 @@
+import statistics
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from habitusxapp.cache import get_cache
+from habitusxapp.models import Habit, OccurrenceRate, HABIT_STATUSES
+from habitusxapp.periods import get_period_boundaries
+from habitusxapp.views import get_habit_list_context
+
+RENDER_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "render-benchmark": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "render-benchmark"},
+    "no-cache": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+class Command(BaseCommand):
+    """
+    Measures the time to build the context of the habit list template (see views.get_habit_list_context) and to render
+    the template with --habits habits, which are built in memory so that the queries are not measured.
+    The habits alternate between daily and weekly and between the statuses of HABIT_STATUSES.
+    The page is rendered without card cache, right after the card cache has been cleared (cold) and with every card
+    already cached (warm). The median duration of the renders is reported
+    """
+
+    help = "Benchmarks the rendering of the habit list template"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--habits", type=int, default=500, help="Number of habits in the list")
+        parser.add_argument("--repeat", type=int, default=20, help="Number of renders per measurement")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        boundaries = get_period_boundaries(now)
+        occurrences = [OccurrenceRate(pk=1, description="Daily", daily_rate=1), OccurrenceRate(pk=2, description="Weekly", daily_rate=7)]
+        habits = []
+        for index in range(options["habits"]):
+            habit = Habit(pk=index + 1, description="Habit %s" % index, occurrence=occurrences[index % 2], date_created=now - timedelta(days=30))
+            habit.status = HABIT_STATUSES[index % len(HABIT_STATUSES)]
+            habit.latest_checkoff_date = now - timedelta(days=index % 4)
+            habits.append(habit)
+
+        request = RequestFactory().get("/")
+        request.user = User(username="benchmark")
+
+        self.stdout.write("%d habits, %d renders per measurement\n" % (len(habits), options["repeat"]))
+        self.stdout.write("%-20s %14s" % ("card cache", "median ms"))
+        with override_settings(CACHES=RENDER_CACHES):
+            for label, alias, clear in [("disabled", "no-cache", False), ("cold", "render-benchmark", True), ("warm", "render-benchmark", False)]:
+                with override_settings(HABITUSX_CACHE_ALIAS=alias):
+                    # one render to compile the templates, and to fill the card cache for the warm measurement
+                    render_to_string("habit-list.html", get_habit_list_context(habits, boundaries), request)
+                    durations = []
+                    for _ in range(options["repeat"]):
+                        if clear:
+                            get_cache().clear()
+                        started_at = time.perf_counter()
+                        render_to_string("habit-list.html", get_habit_list_context(habits, boundaries), request)
+                        durations.append(time.perf_counter() - started_at)
+                self.stdout.write("%-20s %14.1f" % (label, statistics.median(durations) * 1000))
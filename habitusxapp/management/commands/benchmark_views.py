@@ -0,0 +1,146 @@
+import json
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, reverse
+from habitusxapp import urls
+from habitusxapp.models import Habit
+from .benchmark_async import NO_CACHE
+
+# views that change data are requested with POST, inside a transaction that is rolled back,
+# with the data returned for the benchmarked habit
+POST_DATA = {
+    "delete-habit": lambda habit: {},
+    "checkoff-habit": lambda habit: {},
+    "checkoff-habits": lambda habit: {"habit_ids": [habit.pk]},
+}
+
+# values of the URL parameters that are not primary keys
+PARAMETERS = {
+    "occurrence": "any-occurrence",
+    "checkedoffstatus": "streak-broken",
+    "format": "ndjson",
+}
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values falls (nearest rank)
+    """
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+class Command(BaseCommand):
+    """
+    Requests every URL of habitusxapp/urls.py as the given user with Django's test client, and reports the p50 and p95
+    latency and the number of SQL queries of each one. <int:pk> parameters are filled with the user's oldest habit.
+    The results can be saved as a JSON baseline, and compared with a previous baseline: the command fails when the p95
+    latency of a URL grows by more than --threshold, or when it runs more queries than in the baseline.
+    Generate a realistic dataset first with the generate_synthetic_data command
+    """
+
+    help = "Benchmarks the latency and the number of queries of every view of the application"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User whose pages are requested")
+        parser.add_argument("--requests", type=int, default=20, help="Number of requests per URL")
+        parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to a JSON baseline file")
+        parser.add_argument("--compare", metavar="PATH", help="Fail if the results regressed compared to a JSON baseline file")
+        parser.add_argument("--threshold", type=float, default=0.25, help="Tolerated relative growth of the p95 latency (default 0.25)")
+        parser.add_argument("--no-cache", action="store_true", help="Disable the per-user cache during the benchmark")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError("User %s does not exist" % options["username"])
+        habit = Habit.objects.filter(user=user).order_by("date_created", "pk").first()
+        if habit is None:
+            raise CommandError("User %s has no habits" % options["username"])
+
+        client = Client()
+        client.force_login(user)
+        results = {}
+
+        self.stdout.write("%-22s %-6s %6s %10s %10s %8s" % ("url", "method", "status", "p50 ms", "p95 ms", "queries"))
+        with override_settings(**NO_CACHE) if options["no_cache"] else override_settings():
+            for pattern in urls.urlpatterns:
+                if not isinstance(pattern, URLPattern):
+                    continue
+                path = self.build_path(pattern, habit)
+                if path is None:
+                    self.stderr.write("Skipping %s: unknown URL parameters" % pattern.name)
+                    continue
+                results[pattern.name] = self.measure(client, pattern.name, path, habit, options["requests"])
+                self.stdout.write("%-22s %-6s %6s %10.2f %10.2f %8s" % (
+                    pattern.name, results[pattern.name]["method"], results[pattern.name]["status"],
+                    results[pattern.name]["p50_ms"], results[pattern.name]["p95_ms"], results[pattern.name]["queries"],
+                ))
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as baseline:
+                json.dump(results, baseline, indent=2, sort_keys=True)
+            self.stdout.write("Baseline saved to %s" % options["save_baseline"])
+
+        if options["compare"]:
+            with open(options["compare"]) as baseline:
+                regressions = self.compare(json.load(baseline), results, options["threshold"])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions compared to %s" % options["compare"]))
+
+    def build_path(self, pattern, habit):
+        """
+        Returns the path of a URL pattern with its parameters filled in, or None if a parameter is unknown
+        """
+        kwargs = {name: habit.pk if name == "pk" else PARAMETERS.get(name) for name in pattern.pattern.converters}
+        if None in kwargs.values():
+            return None
+        return reverse(pattern.name, kwargs=kwargs)
+
+    def measure(self, client, name, path, habit, requests):
+        """
+        Requests a path the given number of times, returning its status code, latency percentiles and number of queries
+        """
+        durations = []
+        queries = []
+        for _ in range(requests):
+            with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+                started_at = time.perf_counter()
+                if name in POST_DATA:
+                    response = client.post(path, POST_DATA[name](habit), HTTP_REFERER="/")
+                else:
+                    response = client.get(path)
+                if response.streaming:
+                    # streaming responses are produced while they are consumed
+                    b"".join(response.streaming_content)
+                durations.append((time.perf_counter() - started_at) * 1000)
+                queries.append(len(captured))
+                # changes made by the requests are discarded, so that every request sees the same data
+                transaction.set_rollback(True)
+        durations.sort()
+        return {
+            "method": "POST" if name in POST_DATA else "GET",
+            "path": path,
+            "status": response.status_code,
+            "p50_ms": round(percentile(durations, 0.5), 3),
+            "p95_ms": round(percentile(durations, 0.95), 3),
+            "queries": max(queries),
+        }
+
+    def compare(self, baseline, results, threshold):
+        """
+        Returns a description of every URL whose p95 latency or number of queries regressed compared to the baseline
+        """
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            if result["p95_ms"] > baseline[name]["p95_ms"] * (1 + threshold):
+                regressions.append("%s: p95 %.2fms, baseline %.2fms" % (name, result["p95_ms"], baseline[name]["p95_ms"]))
+            if result["queries"] > baseline[name]["queries"]:
+                regressions.append("%s: %s queries, baseline %s" % (name, result["queries"], baseline[name]["queries"]))
+        return regressions
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from habitusxapp.cache import get_cache_stats
+
+
+class Command(BaseCommand):
+    """
+    Prints the number of hits and misses of the per-user cache, which is useful to size the cache backend
+    """
+
+    help = "Prints the hit and miss counters of the per-user cache"
+
+    def handle(self, *args, **options):
+        stats = get_cache_stats()
+        self.stdout.write("hits: %s\nmisses: %s\nhit rate: %.1f%%" % (stats["hits"], stats["misses"], stats["hit_rate"] * 100))
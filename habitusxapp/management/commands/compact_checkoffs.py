@@ -0,0 +1,80 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from habitusxapp.bitmaps import get_period_year, pack_periods
+from habitusxapp.cache import bump_user_version
+from habitusxapp.models import Habit, CheckOff, CheckOffBitmap, OccurrenceRate
+from habitusxapp.periods import get_period_ordinal
+
+# the status of a habit depends on the checkoffs of the current and of the previous period, which have to stay rows
+MIN_KEEP_DAYS = 14
+
+DELETE_SQL = "DELETE FROM {checkoff} WHERE habit_id IN ({habits}) AND period < %s"
+
+
+class Command(BaseCommand):
+    """
+    Folds the checkoffs older than --keep-days into the yearly bitmaps of their habit (see models.CheckOffBitmap)
+    and deletes their rows. The streak states are not affected, since they are computed from both representations.
+    Compacted checkoffs are no longer listed individually (e.g. by the checkoffs API).
+    The rows are deleted with a single statement per batch, without sending a delete signal per checkoff:
+    the cache of the affected users is invalidated once per batch instead
+    """
+
+    help = "Compacts the old checkoffs of every habit into one bitmap per habit and year"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-days", type=int, default=90, help="Checkoffs of the last KEEP_DAYS days are kept as rows")
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of habits compacted per transaction")
+
+    def handle(self, *args, **options):
+        if options["keep_days"] < MIN_KEEP_DAYS:
+            raise CommandError("--keep-days must be at least %s" % MIN_KEEP_DAYS)
+
+        cutoff = timezone.now() - timedelta(days=options["keep_days"])
+        batch_size = options["batch_size"]
+        compacted_rows = 0
+
+        for daily_rate in OccurrenceRate.objects.order_by("daily_rate").values_list("daily_rate", flat=True).distinct():
+            # the periods of the checkoffs are the local ones of their owner, which start less than a day away from the
+            # UTC ones: one more period is kept, so that no checkoff added after the cutoff is compacted, in any time zone
+            cutoff_period = get_period_ordinal(cutoff, daily_rate) - 1
+            habit_ids = list(
+                CheckOff.objects.filter(habit__occurrence__daily_rate=daily_rate, period__lt=cutoff_period)
+                .order_by("habit_id").values_list("habit_id", flat=True).distinct()
+            )
+            for start in range(0, len(habit_ids), batch_size):
+                compacted_rows += self.compact(habit_ids[start:start + batch_size], daily_rate, cutoff_period)
+
+        self.stdout.write(self.style.SUCCESS("Compacted %s checkoffs" % compacted_rows))
+
+    def compact(self, habit_ids, daily_rate, cutoff_period):
+        """
+        Folds the checkoffs of the given habits older than cutoff_period into their bitmaps.
+        Returns the number of compacted checkoffs
+        """
+        with transaction.atomic():
+            periods = {}
+            for habit_id, period in CheckOff.objects.filter(habit_id__in=habit_ids, period__lt=cutoff_period).values_list("habit_id", "period"):
+                periods.setdefault((habit_id, get_period_year(period, daily_rate)), []).append(period)
+
+            bitmaps = {(bitmap.habit_id, bitmap.year): bitmap for bitmap in CheckOffBitmap.objects.filter(habit_id__in=habit_ids)}
+            created, updated = [], []
+            for (habit_id, year), year_periods in periods.items():
+                if (habit_id, year) in bitmaps:
+                    bitmap = bitmaps[(habit_id, year)]
+                    bitmap.bits = pack_periods(year_periods, year, daily_rate, bytes(bitmap.bits))
+                    updated.append(bitmap)
+                else:
+                    created.append(CheckOffBitmap(habit_id=habit_id, year=year, bits=pack_periods(year_periods, year, daily_rate)))
+            CheckOffBitmap.objects.bulk_create(created)
+            CheckOffBitmap.objects.bulk_update(updated, ["bits"])
+
+            sql = DELETE_SQL.format(checkoff=CheckOff._meta.db_table, habits=", ".join(["%s"] * len(habit_ids)))
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [*habit_ids, cutoff_period])
+
+        for user_id in Habit.objects.filter(pk__in=habit_ids).values_list("user_id", flat=True).distinct():
+            bump_user_version(user_id)
+        return sum(len(year_periods) for year_periods in periods.values())
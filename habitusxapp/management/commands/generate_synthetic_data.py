@@ -0,0 +1,100 @@
+import random
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from habitusxapp.completion import add_daily_checkoffs, count_history_days
+from habitusxapp.models import Habit, CheckOff, OccurrenceRate
+from habitusxapp.periods import get_period_ordinal, get_period_start
+from habitusxapp.streaks import rebuild_streak_states
+
+# probability of checking off a habit in a period, after a checked off period and after a missed one
+KEEP_STREAK_PROBABILITY = 0.85
+RESUME_PROBABILITY = 0.35
+
+
+class Command(BaseCommand):
+    """
+    Generates users, habits and years of checkoffs with realistic gaps, to measure how the views scale.
+    Each habit alternates streaks and gaps: a checked off period is followed by another one with probability
+    KEEP_STREAK_PROBABILITY, a missed period is followed by a checked off one with probability RESUME_PROBABILITY.
+    Rows are inserted with bulk_create in batches, then the streak states and the daily rollups of the new habits are built.
+    Generated users have the password "password"
+    """
+
+    help = "Generates N users x M habits x K years of checkoffs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10, help="Number of users to create")
+        parser.add_argument("--habits", type=int, default=20, help="Number of habits per user")
+        parser.add_argument("--years", type=float, default=2, help="Years of checkoff history per habit")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Number of rows inserted per query")
+        parser.add_argument("--seed", type=int, default=None, help="Seed of the random generator, for reproducible datasets")
+        parser.add_argument("--prefix", default="synthetic", help="Prefix of the usernames")
+
+    def handle(self, *args, **options):
+        generator = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        history_start = now - timedelta(days=int(365 * options["years"]))
+
+        daily, _ = OccurrenceRate.objects.get_or_create(daily_rate=1, defaults={"description": "Daily"})
+        weekly, _ = OccurrenceRate.objects.get_or_create(daily_rate=7, defaults={"description": "Weekly"})
+
+        first_index = User.objects.filter(username__startswith=options["prefix"] + "-").count()
+        password = make_password("password")
+        users = User.objects.bulk_create([
+            User(username="%s-%s" % (options["prefix"], first_index + index), password=password)
+            for index in range(options["users"])
+        ], batch_size=batch_size)
+        # not every backend returns the primary keys of bulk inserted rows
+        users = list(User.objects.filter(username__in=[user.username for user in users]))
+
+        habits = Habit.objects.bulk_create([
+            Habit(
+                description="Habit %s of %s" % (index, user.username),
+                user=user,
+                occurrence=daily if generator.random() < 0.7 else weekly,
+                date_created=history_start + timedelta(days=generator.randint(0, 60), seconds=generator.randint(0, 86399)),
+            )
+            for user in users for index in range(options["habits"])
+        ], batch_size=batch_size)
+        habits = list(Habit.objects.filter(user__in=users).select_related("occurrence"))
+
+        checkoffs = []
+        checkoffs_count = 0
+        for habit in habits:
+            for checkoff in self.generate_checkoffs(habit, now, generator):
+                checkoffs.append(checkoff)
+                if len(checkoffs) == batch_size:
+                    self.insert(checkoffs)
+                    checkoffs_count += len(checkoffs)
+                    checkoffs = []
+        self.insert(checkoffs)
+        checkoffs_count += len(checkoffs)
+
+        for start in range(0, len(habits), 500):
+            batch = Habit.objects.filter(pk__in=[habit.pk for habit in habits[start:start + 500]])
+            rebuild_streak_states(batch)
+            add_daily_checkoffs(count_history_days(batch))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Created %s users, %s habits and %s checkoffs" % (len(users), len(habits), checkoffs_count)
+        ))
+
+    def generate_checkoffs(self, habit, now, generator):
+        daily_rate = habit.occurrence.daily_rate
+        checked = True
+        for period in range(get_period_ordinal(habit.date_created, daily_rate), get_period_ordinal(now, daily_rate) + 1):
+            checked = generator.random() < (KEEP_STREAK_PROBABILITY if checked else RESUME_PROBABILITY)
+            if checked:
+                day = get_period_start(period, daily_rate) + timedelta(days=generator.randint(0, daily_rate - 1))
+                date_added = datetime.combine(day, time(generator.randint(6, 22), generator.randint(0, 59)), tzinfo=dt_timezone.utc)
+                if habit.date_created <= date_added <= now:
+                    yield CheckOff(habit=habit, date_added=date_added, period=period)
+
+    def insert(self, checkoffs):
+        with transaction.atomic():
+            CheckOff.objects.bulk_create(checkoffs)
@@ -0,0 +1,43 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from habitusxapp.history import FORMATS, import_history
+
+
+class Command(BaseCommand):
+    """
+    Imports a CSV or NDJSON history file (see habitusxapp/history.py) as new habits and checkoffs of a user,
+    with bulk inserts in batched transactions. The whole file is validated before anything is imported
+    """
+
+    help = "Imports the habits and checkoffs of a history file for a user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User the history is imported for")
+        parser.add_argument("path", help="Path of the history file")
+        parser.add_argument("--format", choices=FORMATS, help="Format of the file, by default its extension")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of records imported per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError("User %s does not exist" % options["username"])
+        format = options["format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if format not in FORMATS:
+            raise CommandError("Unknown format %s, use --format" % format)
+
+        started_at = time.perf_counter()
+
+        def progress(records):
+            self.stdout.write("%s records imported (%.1fs)" % (records, time.perf_counter() - started_at))
+
+        try:
+            with open(options["path"], newline="", encoding="utf-8") as stream:
+                counts = import_history(user, stream, format, options["batch_size"], progress)
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %(habits)s habits and %(checkoffs)s checkoffs, skipped %(skipped)s checkoffs of already checked off periods" % counts
+        ))
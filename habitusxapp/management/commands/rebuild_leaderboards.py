@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from habitusxapp.leaderboards import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the leaderboards from the streak states of all the habits. The leaderboards are kept up to date
+    as habits are checked off and deleted, so it is only needed after the streak states have been changed by hand
+    """
+
+    help = "Rebuilds the leaderboards of the longest streaks"
+
+    def handle(self, *args, **options):
+        rebuild_leaderboards()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the leaderboards"))
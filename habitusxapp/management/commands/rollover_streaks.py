@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils import timezone
+from habitusxapp.cache import is_cache_shared
+from habitusxapp.models import StreakState
+from habitusxapp.streaks import mark_broken_streaks
+
+
+class Command(BaseCommand):
+    """
+    Marks the streaks broken by the end of a period as inactive (see streaks.mark_broken_streaks), so that the
+    streak-broken filter reads StreakState.is_active instead of recomputing the status of every habit.
+    It should run at every rollover: since every user has a time zone, local midnights happen every quarter of an hour,
+    e.g. with a cron job like "*/15 * * * * python manage.py rollover_streaks". Streaks broken since the last run
+    are listed among the unchecked habits until the next one.
+    The habits are scanned in chunks of consecutive ids, by a pool of --workers processes. Only the active streaks are read.
+    The cached pages of the users whose streaks are broken are invalidated from this process and its workers, so the
+    command requires a cache shared with the web processes (see cache.is_cache_shared)
+    """
+
+    help = "Marks the streaks broken by the end of the previous day or week"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes (1 to run in this process)")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Number of habit ids scanned per chunk")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--workers and --chunk-size must be positive")
+        if not is_cache_shared():
+            raise CommandError(
+                "The cache of HABITUSX_CACHE_ALIAS is local to each process, so the web processes would keep showing "
+                "the broken streaks as unchecked: configure a shared cache backend (see CACHES)"
+            )
+
+        bounds = StreakState.objects.filter(is_active=True).aggregate(first=Min("habit_id"), last=Max("habit_id"))
+        if bounds["first"] is None:
+            self.stdout.write(self.style.SUCCESS("No active streak"))
+            return
+        # every chunk uses the same instant, whatever the time it is processed
+        now = timezone.now()
+        chunk_size = options["chunk_size"]
+        chunks = [(start, start + chunk_size, now) for start in range(bounds["first"], bounds["last"] + 1, chunk_size)]
+
+        started_at = time.perf_counter()
+        if options["workers"] == 1:
+            results = [mark_chunk(chunk) for chunk in chunks]
+        else:
+            # the workers must not share the connection of this process
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(options["workers"]) as pool:
+                results = pool.map(mark_chunk, chunks)
+        duration = time.perf_counter() - started_at
+
+        examined = sum(examined for examined, _ in results)
+        marked = sum(marked for _, marked in results)
+        self.stdout.write(self.style.SUCCESS(
+            "Checked %s active streaks in %.2f s (%.0f habits/s) with %s workers: %s streaks were broken"
+            % (examined, duration, examined / duration if duration else 0, options["workers"], marked)
+        ))
+
+
+def mark_chunk(chunk):
+    """
+    Marks the broken streaks of a chunk of habit ids, in a worker process
+    """
+    start, end, now = chunk
+    try:
+        return mark_broken_streaks(start, end, now)
+    finally:
+        if multiprocessing.parent_process() is not None:
+            connections.close_all()
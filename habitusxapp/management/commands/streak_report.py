@@ -0,0 +1,207 @@
+import csv
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from habitusxapp.bitmaps import build_history, get_history_periods
+from habitusxapp.models import Habit, CheckOff, CheckOffBitmap, OccurrenceRate, Profile, get_time_zone, get_user_time_zone
+from habitusxapp.periods import EPOCH, to_local_date
+from habitusxapp.streaks import is_new_habit_pending
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS = ["habit_id", "user_id", "daily_rate", "checkoffs", "longest_streak", "current_streak", "last_period", "is_streak_active"]
+# the last_period of the habits that have never been checked off, which is left empty in CSV reports
+NO_PERIOD = -1
+
+# checkoffs are streamed as plain integer tuples, using the period ordinal stored with each checkoff.
+# Habits with a compacted history are processed separately (see compacted_rows)
+CHECKOFFS_SQL = """
+    SELECT c.habit_id, h.user_id, o.daily_rate, c.period
+    FROM {checkoff} c
+    JOIN {habit} h ON h.id = c.habit_id
+    JOIN {occurrence} o ON o.id = h.occurrence_id
+    WHERE c.habit_id NOT IN (SELECT habit_id FROM {bitmap})
+    ORDER BY c.habit_id, c.period
+"""
+
+
+def get_local_days(now):
+    """
+    Returns a function that maps an array of user ids to the date of now in the time zone of each user, as numbers
+    of days since the epoch. The date is computed once per time zone, and users without a profile use UTC
+    """
+    days = {}
+    user_ids, user_days = [], []
+    for user_id, time_zone in Profile.objects.order_by("user_id").values_list("user_id", "time_zone"):
+        if time_zone not in days:
+            days[time_zone] = (to_local_date(now, get_time_zone(time_zone)) - EPOCH).days
+        user_ids.append(user_id)
+        user_days.append(days[time_zone])
+    user_ids = np.array(user_ids, dtype=np.int64)
+    user_days = np.array(user_days, dtype=np.int64)
+    utc_day = (to_local_date(now) - EPOCH).days
+
+    def get_days(ids):
+        if not len(user_ids):
+            return np.full(len(ids), utc_day, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(user_ids, ids), len(user_ids) - 1)
+        return np.where(user_ids[positions] == ids, user_days[positions], utc_day)
+    return get_days
+
+
+def summarize_checkoffs(rows, get_today):
+    """
+    Computes the streak statistics of every habit contained in rows, a (n, 4) array of (habit_id, user_id, daily_rate, period)
+    sorted by habit and period. get_today maps user ids to their current local date (see get_local_days).
+    Returns a dictionary of equally long column arrays, one entry per habit (see COLUMNS)
+    """
+    habit_ids, user_ids, rates, periods = rows.T
+    habit_starts = np.flatnonzero(np.r_[True, habit_ids[1:] != habit_ids[:-1]])
+    checkoffs = np.diff(np.r_[habit_starts, len(habit_ids)])
+
+    # a run starts at the first period of every habit and after every gap
+    run_starts = np.flatnonzero(np.r_[True, (habit_ids[1:] != habit_ids[:-1]) | (periods[1:] != periods[:-1] + 1)])
+    run_lengths = np.diff(np.r_[run_starts, len(periods)])
+    run_habit_starts = np.flatnonzero(np.r_[True, habit_ids[run_starts][1:] != habit_ids[run_starts][:-1]])
+    last_runs = np.r_[run_habit_starts[1:], len(run_starts)] - 1
+    last_periods = periods[np.r_[run_starts[run_habit_starts[1:]], len(periods)] - 1]
+
+    rates = rates[habit_starts]
+    today = get_today(user_ids[habit_starts])
+    today_periods = np.where(rates == 7, (today + 3) // 7, today // rates)
+
+    return {
+        "habit_id": habit_ids[run_starts][run_habit_starts],
+        "user_id": user_ids[habit_starts],
+        "daily_rate": rates,
+        "checkoffs": checkoffs,
+        "longest_streak": np.maximum.reduceat(run_lengths, run_habit_starts),
+        "current_streak": run_lengths[last_runs],
+        "last_period": last_periods,
+        "is_streak_active": (last_periods >= today_periods - 1).astype(np.int64),
+    }
+
+
+def compacted_rows(habit_ids):
+    """
+    Returns the rows (see summarize_checkoffs) of the given habits with a compacted history, expanding their bitmaps
+    """
+    bitmaps = {}
+    for habit_id, year, bits in CheckOffBitmap.objects.filter(habit_id__in=habit_ids).values_list("habit_id", "year", "bits"):
+        bitmaps.setdefault(habit_id, []).append((year, bytes(bits)))
+    periods = {}
+    for habit_id, period in CheckOff.objects.filter(habit_id__in=habit_ids).values_list("habit_id", "period"):
+        periods.setdefault(habit_id, []).append(period)
+
+    rows = []
+    for habit_id, user_id, daily_rate in Habit.objects.filter(pk__in=habit_ids).order_by("pk").values_list("pk", "user_id", "occurrence__daily_rate"):
+        history = build_history(bitmaps.get(habit_id, []), periods.get(habit_id, []), daily_rate)
+        rows.extend((habit_id, user_id, daily_rate, period) for period in get_history_periods(*history))
+    return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+
+def unchecked_columns(now, chunk_size):
+    """
+    Returns the columns (see COLUMNS) of the habits that have never been checked off, without checkoffs nor bitmaps.
+    Their streak is active only during the period of now they were created in, in the time zone of their owner
+    (see streaks.is_new_habit_pending)
+    """
+    habits = Habit.objects.filter(
+        ~Exists(CheckOff.objects.filter(habit=OuterRef("pk"))), ~Exists(CheckOffBitmap.objects.filter(habit=OuterRef("pk"))),
+    ).select_related("occurrence", "user__profile").order_by("pk")
+    rows = [
+        (habit.pk, habit.user_id, habit.occurrence.daily_rate, 0, 0, 0, NO_PERIOD, int(is_new_habit_pending(habit, to_local_date(now, get_user_time_zone(habit.user)))))
+        for habit in habits.iterator(chunk_size=chunk_size)
+    ]
+    rows = np.array(rows, dtype=np.int64).reshape(-1, len(COLUMNS))
+    return dict(zip(COLUMNS, rows.T))
+
+
+class Command(BaseCommand):
+    """
+    Computes the streak statistics of every habit of every user, streaming the whole checkoff table in chunks
+    into NumPy arrays. Streaks are active or not according to the current date in the time zone of the owner
+    of each habit, and the habits that have never been checked off are reported with no checkoff and no streak. Each chunk is processed with vectorized operations, and the rows of the last habit of a chunk
+    are carried over to the next one, so that memory usage only depends on the chunk size.
+    The histories of the habits with compacted checkoffs are expanded from their bitmaps, 1000 habits at a time.
+    Requires numpy to be installed
+    """
+
+    help = "Writes the streak statistics of all habits of all users to a CSV file or to a columnar .npz file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Path of the report file")
+        parser.add_argument("--format", choices=["csv", "npz"], default="csv", help="csv (default) or npz, one array per column")
+        parser.add_argument("--chunk-size", type=int, default=100000, help="Number of checkoffs fetched per round trip")
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError("The streak report requires numpy. Install it with: pip install numpy")
+
+        now = timezone.now()
+        get_today = get_local_days(now)
+        chunk_size = options["chunk_size"]
+        sql = CHECKOFFS_SQL.format(
+            checkoff=CheckOff._meta.db_table,
+            habit=Habit._meta.db_table,
+            occurrence=OccurrenceRate._meta.db_table,
+            bitmap=CheckOffBitmap._meta.db_table,
+        )
+
+        columns = {column: [] for column in COLUMNS}
+        carry = np.empty((0, 4), dtype=np.int64)
+        processed_rows = 0
+        started_at = time.perf_counter()
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            while True:
+                fetched = cursor.fetchmany(chunk_size)
+                processed_rows += len(fetched)
+                rows = np.concatenate([carry, np.array(fetched, dtype=np.int64).reshape(-1, 4)])
+                if not len(rows):
+                    break
+                if fetched:
+                    # the last habit of the chunk may continue in the next one
+                    last_habit_start = np.searchsorted(rows[:, 0], rows[-1, 0])
+                    rows, carry = rows[:last_habit_start], rows[last_habit_start:]
+                else:
+                    carry = carry[:0]
+                if len(rows):
+                    for column, values in summarize_checkoffs(rows, get_today).items():
+                        columns[column].append(values)
+
+        compacted_habit_ids = list(CheckOffBitmap.objects.order_by("habit_id").values_list("habit_id", flat=True).distinct())
+        for start in range(0, len(compacted_habit_ids), 1000):
+            rows = compacted_rows(compacted_habit_ids[start:start + 1000])
+            processed_rows += len(rows)
+            if len(rows):
+                for column, values in summarize_checkoffs(rows, get_today).items():
+                    columns[column].append(values)
+
+        for column, values in unchecked_columns(now, chunk_size).items():
+            columns[column].append(values)
+
+        columns = {column: np.concatenate(values) for column, values in columns.items()}
+        elapsed = time.perf_counter() - started_at
+
+        if options["format"] == "npz":
+            np.savez(options["output"], **columns)
+        else:
+            with open(options["output"], "w", newline="") as report:
+                writer = csv.writer(report)
+                writer.writerow(COLUMNS)
+                values = {column: columns[column].tolist() for column in COLUMNS}
+                values["last_period"] = ["" if period == NO_PERIOD else period for period in values["last_period"]]
+                writer.writerows(zip(*(values[column] for column in COLUMNS)))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Processed %s checkoffs of %s habits in %.2fs (%s rows/sec)" % (
+                processed_rows, len(columns["habit_id"]), elapsed, int(processed_rows / elapsed) if elapsed else processed_rows
+            )
+        ))
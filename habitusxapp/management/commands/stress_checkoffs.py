@@ -0,0 +1,116 @@
+import logging
+import multiprocessing
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from habitusxapp.buffer import checkoff_buffer
+from habitusxapp.models import Habit, CheckOff, OccurrenceRate
+
+STRESS_PREFIX = "stress-checkoffs-"
+
+
+def create_stress_users(count, habits, occurrence):
+    """
+    Creates count users, each one with the given number of habits of the given occurrence.
+    The users left by a previous run are deleted first
+    """
+    User.objects.filter(username__startswith=STRESS_PREFIX).delete()
+    users = User.objects.bulk_create([User(username="%s%d" % (STRESS_PREFIX, index)) for index in range(count)])
+    Habit.objects.bulk_create([
+        Habit(description="Stress habit %d" % index, user=user, occurrence=occurrence)
+        for user in users for index in range(habits)
+    ])
+    return users
+
+
+class Command(BaseCommand):
+    """
+    Stresses the checkoff view with concurrent client processes, each one checking off all the habits of its own
+    user as fast as it can and then reading its habits from the API, first with direct inserts and then with the
+    write-behind buffer (see buffer.py). It reports the number of checkoffs that failed because the database was locked, and the number
+    of habits a client did not see as checked off right after checking them off.
+    The command creates its users and deletes them at the end, so it should not be run against the production database
+    """
+
+    help = "Stresses the checkoff view with concurrent clients, with and without the write-behind buffer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=16, help="Number of concurrent clients")
+        parser.add_argument("--habits", type=int, default=25, help="Number of habits checked off by each client (at most 200)")
+
+    def handle(self, *args, **options):
+        if not 1 <= options["habits"] <= 200:
+            raise CommandError("--habits must be between 1 and 200")
+        daily = OccurrenceRate.objects.filter(daily_rate=1).first()
+        if daily is None:
+            raise CommandError("The daily occurrence rate does not exist")
+
+        self.stdout.write("%d clients x %d checkoffs\n" % (options["clients"], options["habits"]))
+        self.stdout.write("%-10s %10s %12s %10s %14s" % ("mode", "checkoffs", "lock errors", "req/s", "unseen habits"))
+        for mode, enabled in [("direct", False), ("buffered", True)]:
+            users = create_stress_users(options["clients"], options["habits"], daily)
+            try:
+                with override_settings(HABITUSX_CHECKOFF_BUFFER=enabled):
+                    checkoffs, errors, rate, unseen = self.run(users)
+                    checkoff_buffer.flush()
+                stored = CheckOff.objects.filter(habit__user__in=users).count()
+                if stored != checkoffs:
+                    raise CommandError("%s checkoffs were accepted but %s were stored" % (checkoffs, stored))
+                self.stdout.write("%-10s %10d %12d %10.1f %14d" % (mode, checkoffs, errors, rate, unseen))
+            finally:
+                User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, users):
+        """
+        Runs one client process per user, and returns the number of accepted checkoffs, of checkoffs that failed with
+        a locked database, the number of checkoff requests per second and the number of habits not seen as checked off
+        """
+        processes = []
+        results = multiprocessing.get_context("fork").Queue()
+        for user in users:
+            client = Client()
+            # logging in writes the session, which is done before the clients start
+            client.force_login(user)
+            habit_ids = list(Habit.objects.filter(user=user).values_list("pk", flat=True))
+            processes.append(multiprocessing.get_context("fork").Process(target=run_client, args=(client, habit_ids, results)))
+
+        # the processes must not share the connection of the parent
+        connections.close_all()
+        started_at = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        duration = time.perf_counter() - started_at
+        for process in processes:
+            process.join()
+
+        accepted = sum(outcome[0] for outcome in outcomes)
+        errors = sum(outcome[1] for outcome in outcomes)
+        return accepted, errors, (accepted + errors) / duration, sum(outcome[2] for outcome in outcomes)
+
+
+def run_client(client, habit_ids, results):
+    """
+    Checks off the given habits one after the other, like the habit list page does, then reads them from the API.
+    The buffer is stopped at the end, as it would be when the process exits
+    """
+    # the failed requests and flushes are counted rather than logged
+    logging.disable(logging.CRITICAL)
+    accepted, errors, unseen = 0, 0, 0
+    try:
+        for habit_id in habit_ids:
+            try:
+                response = client.post(reverse("checkoff-habit", kwargs={"pk": habit_id}), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+                accepted += response.status_code == 200
+            except OperationalError:
+                errors += 1
+        statuses = [habit["status"] for habit in client.get(reverse("api-habits"), {"limit": 200}).json()["results"]]
+        unseen = accepted - statuses.count("checked")
+        checkoff_buffer.stop()
+    finally:
+        results.put((accepted, errors, unseen))
+        connections.close_all()
@@ -0,0 +1,88 @@
+"""
+In-process histograms of the request metrics recorded by middleware.ServerTimingMiddleware, exposed in the
+Prometheus text format by the metrics view. Every worker process keeps its own histograms, which Prometheus
+aggregates across the scraped instances
+"""
+import threading
+from bisect import bisect_left
+from .cache import get_cache_stats
+
+# upper bounds of the buckets, in seconds for the durations and in number of queries for the query counts
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+HISTOGRAMS = {
+    "habitusx_request_duration_seconds": ("Total time spent serving the request", DURATION_BUCKETS),
+    "habitusx_db_duration_seconds": ("Time spent executing SQL queries", DURATION_BUCKETS),
+    "habitusx_db_queries": ("Number of SQL queries executed", QUERY_BUCKETS),
+    "habitusx_template_duration_seconds": ("Time spent rendering templates", DURATION_BUCKETS),
+}
+
+
+class Histogram:
+    """
+    A Prometheus histogram for a single label value: a count per bucket (non cumulative), the sum and the count
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    The histograms of every metric in HISTOGRAMS, one per view name
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def observe(self, view, values):
+        """
+        Records a value of each metric (a dictionary of metric name to value) for the given view name
+        """
+        with self.lock:
+            for name, value in values.items():
+                histograms = self.histograms[name]
+                if view not in histograms:
+                    histograms[view] = Histogram(HISTOGRAMS[name][1])
+                histograms[view].observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {name: {} for name in HISTOGRAMS}
+
+    def render(self):
+        """
+        Returns the histograms and the cache statistics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for name, (description, buckets) in HISTOGRAMS.items():
+                lines.append("# HELP %s %s" % (name, description))
+                lines.append("# TYPE %s histogram" % name)
+                for view, histogram in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{view="%s",le="%s"} %s' % (name, view, bound, cumulative))
+                    lines.append('%s_sum{view="%s"} %s' % (name, view, histogram.sum))
+                    lines.append('%s_count{view="%s"} %s' % (name, view, histogram.count))
+
+        stats = get_cache_stats()
+        for outcome in ["hits", "misses"]:
+            lines.append("# HELP habitusx_cache_%s_total Cache %s of the per-user cache" % (outcome, outcome))
+            lines.append("# TYPE habitusx_cache_%s_total counter" % outcome)
+            lines.append("habitusx_cache_%s_total %s" % (outcome, stats[outcome]))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
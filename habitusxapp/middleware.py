@@ -0,0 +1,186 @@
+import time
+from datetime import timezone as dt_timezone
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from contextlib import ExitStack
+from django.db import connections
+from django.utils import timezone
+from .buffer import checkoff_buffer
+from .metrics import registry
+from .models import get_time_zone, get_user_time_zone
+from .periods import get_period_boundaries
+
+TIME_ZONE_SESSION_KEY = "habitusx_time_zone"
+CHECKOFF_FLUSH_ATTEMPTS = 3
+
+
+class RequestTimings:
+    """
+    The durations measured while serving a single request
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_duration = 0
+        self.template_duration = 0
+        self.template_started_at = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute wrapper of the database connections (see django.db.backends.base.base.BaseDatabaseWrapper.execute_wrapper)
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_duration += time.perf_counter() - started_at
+            self.queries += 1
+
+    def template_rendered(self, response):
+        self.template_duration += time.perf_counter() - self.template_started_at
+
+
+class ServerTimingMiddleware:
+    """
+    Measures the total time of every request, the number and the duration of its SQL queries, and the time spent
+    rendering its template response. The timings are returned in the Server-Timing header of the response
+    (displayed by the network panel of the browsers) and recorded in histograms per URL name, which are served by
+    the metrics view.
+    It should be the first middleware, so that the time spent in the other middlewares is included.
+    Only templates rendered through a TemplateResponse are timed
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        request.timings = timings
+        started_at = time.perf_counter()
+        with self.wrap_connections(timings):
+            response = self.get_response(request)
+        return self.record(request, response, timings, time.perf_counter() - started_at)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        request.timings = timings
+        started_at = time.perf_counter()
+        # the connections are shared with the threads that run the queries of async views
+        with self.wrap_connections(timings):
+            response = await self.get_response(request)
+        return self.record(request, response, timings, time.perf_counter() - started_at)
+
+    def wrap_connections(self, timings):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timings))
+        return stack
+
+    def record(self, request, response, timings, duration):
+        """
+        Adds the Server-Timing header to the response, and records the timings in the histograms of the view
+        """
+        response["Server-Timing"] = 'total;dur=%.1f, db;dur=%.1f;desc="%s queries", template;dur=%.1f' % (
+            duration * 1000, timings.db_duration * 1000, timings.queries, timings.template_duration * 1000
+        )
+        view = request.resolver_match.view_name if request.resolver_match else "unresolved"
+        registry.observe(view, {
+            "habitusx_request_duration_seconds": duration,
+            "habitusx_db_duration_seconds": timings.db_duration,
+            "habitusx_db_queries": timings.queries,
+            "habitusx_template_duration_seconds": timings.template_duration,
+        })
+        return response
+
+    def process_template_response(self, request, response):
+        # called right before the response is rendered, the callback right after
+        request.timings.template_started_at = time.perf_counter()
+        response.add_post_render_callback(request.timings.template_rendered)
+        return response
+
+
+class TimeZoneMiddleware:
+    """
+    Computes once per request the time zone of the user (request.time_zone) and the boundaries of the current periods
+    in that time zone (request.period_boundaries, a periods.PeriodBoundaries), which the views use to filter
+    checkoffs with range predicates. The time zone is also activated, so that templates display local times.
+    The name of the time zone is kept in the session when the user logs in (see signals.py), and read from the profile
+    only for sessions that do not have it.
+    It needs to come after the authentication middleware
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.set_time_zone(request)
+        try:
+            return self.get_response(request)
+        finally:
+            timezone.deactivate()
+
+    async def __acall__(self, request):
+        # the user and the session are loaded lazily with synchronous queries
+        await sync_to_async(self.set_time_zone)(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            timezone.deactivate()
+
+    def set_time_zone(self, request):
+        time_zone = dt_timezone.utc
+        if request.user.is_authenticated:
+            if TIME_ZONE_SESSION_KEY not in request.session:
+                request.session[TIME_ZONE_SESSION_KEY] = str(get_user_time_zone(request.user))
+            time_zone = get_time_zone(request.session[TIME_ZONE_SESSION_KEY])
+        request.time_zone = time_zone
+        request.period_boundaries = get_period_boundaries(timezone.now(), time_zone)
+        timezone.activate(time_zone)
+
+
+class CheckOffBufferMiddleware:
+    """
+    Flushes the checkoffs waiting in the write-behind buffer (see buffer.py) before any request of a user who has queued
+    checkoffs, so that the user always sees their own checkoffs and the other views work on the inserted rows.
+    The requests of the views that queue checkoffs (with a true buffers_checkoffs attribute) do not flush the buffer,
+    neither do the requests of the other users. If the database stays locked, the request goes on without the queued
+    checkoffs after CHECKOFF_FLUSH_ATTEMPTS attempts.
+    It needs to come after the authentication middleware
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not checkoff_buffer.has_pending() or getattr(getattr(view_func, "view_class", None), "buffers_checkoffs", False):
+            return None
+        if request.user.is_authenticated and checkoff_buffer.has_pending(request.user.pk):
+            # every attempt waits for the lock of the database up to its timeout
+            for _ in range(CHECKOFF_FLUSH_ATTEMPTS):
+                if checkoff_buffer.flush():
+                    break
+        return None
@@ -0,0 +1,26 @@
+# Generated by Django 5.0 on 2026-10-18 10:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreakState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_streak', models.IntegerField(default=0)),
+                ('longest_streak', models.IntegerField(default=0)),
+                ('last_period', models.IntegerField(blank=True, null=True)),
+                ('last_checkoff_date', models.DateTimeField(blank=True, null=True)),
+                ('is_active', models.BooleanField(default=False)),
+                ('habit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='streak_state', to='habitusxapp.habit')),
+            ],
+        ),
+    ]
@@ -0,0 +1,83 @@
+import logging
+from datetime import date, timezone as dt_timezone
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+# the period ordinals of periods.get_period_ordinal when this migration was written, which must not change with it:
+# days since the 1st of January 1970, and weeks starting on monday (the 1st of January 1970 was a thursday).
+# The existing checkoffs predate the time zones of the users, so their periods are the UTC ones
+EPOCH = date(1970, 1, 1)
+WEEK_OFFSET = 3
+
+
+def get_period_ordinal(moment, daily_rate):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=dt_timezone.utc)
+    days = (moment.astimezone(dt_timezone.utc).date() - EPOCH).days
+    if daily_rate == 7:
+        return (days + WEEK_OFFSET) // 7
+    return days // daily_rate
+
+
+def fill_checkoff_periods(apps, schema_editor):
+    """
+    Computes the period of the existing checkoffs. When a habit has been checked off more than once in the same period,
+    only the earliest checkoff is kept, so that the unique constraint can be added: every deleted checkoff is logged
+    as a warning, with the one that is kept
+    """
+    CheckOff = apps.get_model("habitusxapp", "CheckOff")
+    # the checkoffs kept in each period of the current habit
+    habit_id, kept_checkoffs = None, {}
+    duplicate_ids = []
+    batch = []
+
+    checkoffs = CheckOff.objects.select_related("habit__occurrence").order_by("habit_id", "date_added", "id")
+    for checkoff in checkoffs.iterator(chunk_size=2000):
+        if checkoff.habit_id != habit_id:
+            habit_id, kept_checkoffs = checkoff.habit_id, {}
+        checkoff.period = get_period_ordinal(checkoff.date_added, checkoff.habit.occurrence.daily_rate)
+        if checkoff.period in kept_checkoffs:
+            kept = kept_checkoffs[checkoff.period]
+            logger.warning(
+                "Deleting checkoff %s of habit %s added at %s: the habit was already checked off in that period by checkoff %s added at %s",
+                checkoff.id, checkoff.habit_id, checkoff.date_added.isoformat(), kept.id, kept.date_added.isoformat(),
+            )
+            duplicate_ids.append(checkoff.id)
+            continue
+        kept_checkoffs[checkoff.period] = checkoff
+        batch.append(checkoff)
+        if len(batch) == 2000:
+            CheckOff.objects.bulk_update(batch, ["period"])
+            batch = []
+
+    CheckOff.objects.bulk_update(batch, ["period"])
+    for start in range(0, len(duplicate_ids), 500):
+        CheckOff.objects.filter(id__in=duplicate_ids[start:start + 500]).delete()
+    if duplicate_ids:
+        logger.warning("Deleted %s checkoffs of periods already checked off", len(duplicate_ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0002_streakstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkoff',
+            name='period',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(fill_checkoff_periods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='checkoff',
+            name='period',
+            field=models.IntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='checkoff',
+            constraint=models.UniqueConstraint(fields=('habit', 'period'), name='unique_checkoff_per_period'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0 on 2026-10-18 10:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0003_checkoff_period'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkoff',
+            index=models.Index(fields=['habit', 'date_added'], name='checkoff_habit_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(fields=['user', 'date_created'], name='habit_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(fields=['user', 'occurrence', 'date_created'], name='habit_user_occurrence_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0 on 2026-10-18 11:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckOffBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('bits', models.BinaryField()),
+                ('habit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkoff_bitmaps', to='habitusxapp.habit')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='checkoffbitmap',
+            constraint=models.UniqueConstraint(fields=('habit', 'year'), name='unique_bitmap_per_habit_year'),
+        ),
+    ]
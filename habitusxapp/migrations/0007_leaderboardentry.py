@@ -0,0 +1,78 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+LEADERBOARD_SIZE = 100
+
+
+def fill_streak_state_occurrences(apps, schema_editor):
+    """
+    Copies the occurrence of every habit in its streak state
+    """
+    Habit = apps.get_model("habitusxapp", "Habit")
+    StreakState = apps.get_model("habitusxapp", "StreakState")
+    StreakState.objects.update(occurrence_id=models.Subquery(Habit.objects.filter(pk=models.OuterRef("habit_id")).values("occurrence_id")[:1]))
+
+
+def fill_leaderboards(apps, schema_editor):
+    """
+    Builds the leaderboards from the existing streak states (see leaderboards.rebuild_leaderboards)
+    """
+    LeaderboardEntry = apps.get_model("habitusxapp", "LeaderboardEntry")
+    OccurrenceRate = apps.get_model("habitusxapp", "OccurrenceRate")
+    StreakState = apps.get_model("habitusxapp", "StreakState")
+
+    for occurrence_id in [None, *OccurrenceRate.objects.values_list("pk", flat=True)]:
+        states = StreakState.objects.filter(longest_streak__gt=0)
+        if occurrence_id is not None:
+            states = states.filter(occurrence_id=occurrence_id)
+        top = states.order_by("-longest_streak", "habit_id").values_list("habit_id", "longest_streak")[:LEADERBOARD_SIZE]
+        LeaderboardEntry.objects.bulk_create([
+            LeaderboardEntry(habit_id=habit_id, occurrence_id=occurrence_id, longest_streak=longest_streak)
+            for habit_id, longest_streak in top
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0006_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streakstate',
+            name='occurrence',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='habitusxapp.occurrencerate'),
+        ),
+        migrations.RunPython(fill_streak_state_occurrences, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='streakstate',
+            name='occurrence',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='habitusxapp.occurrencerate'),
+        ),
+        migrations.AddIndex(
+            model_name='streakstate',
+            index=models.Index(fields=['-longest_streak', 'habit'], name='streak_state_longest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streakstate',
+            index=models.Index(fields=['occurrence', '-longest_streak', 'habit'], name='streak_state_occurrence_idx'),
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('longest_streak', models.IntegerField()),
+                ('habit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='habitusxapp.habit')),
+                ('occurrence', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='habitusxapp.occurrencerate')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['occurrence', '-longest_streak', 'habit'], name='leaderboard_order_idx')],
+                'constraints': [
+                    models.UniqueConstraint(fields=('occurrence', 'habit'), name='unique_leaderboard_entry'),
+                    models.UniqueConstraint(condition=models.Q(('occurrence__isnull', True)), fields=('habit',), name='unique_global_leaderboard_entry'),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_leaderboards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0007_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='streakstate',
+            index=models.Index(fields=['is_active', 'habit'], name='streak_state_active_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.0 on 2026-10-18 12:33
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import Counter
+from datetime import date, timedelta
+from django.db import migrations, models
+
+# the periods of periods.py and the bitmaps of bitmaps.py when this migration was written, which must not change with it:
+# days since the 1st of January 1970, and weeks starting on monday (the 1st of January 1970 was a thursday)
+EPOCH = date(1970, 1, 1)
+WEEK_OFFSET = 3
+
+
+def get_period_start(ordinal, daily_rate):
+    if daily_rate == 7:
+        return EPOCH + timedelta(days=ordinal * 7 - WEEK_OFFSET)
+    return EPOCH + timedelta(days=ordinal * daily_rate)
+
+
+def get_bitmap_periods(year, bits, daily_rate):
+    """
+    Returns the periods set in the bitmap of a year, whose bit i (little-endian) is the i-th period starting in the year
+    """
+    days = (date(year, 1, 1) - EPOCH).days
+    # the first period that starts on or after January 1st
+    first_period = -(-(days + WEEK_OFFSET) // 7) if daily_rate == 7 else -(-days // daily_rate)
+    history = int.from_bytes(bits, "little")
+    return [first_period + index for index in range(history.bit_length()) if history >> index & 1]
+
+
+def fill_daily_checkoff_counts(apps, schema_editor):
+    """
+    Counts the existing checkoffs, rows and bitmaps, by user and first day of their period (see completion.count_history_days)
+    """
+    CheckOff = apps.get_model("habitusxapp", "CheckOff")
+    CheckOffBitmap = apps.get_model("habitusxapp", "CheckOffBitmap")
+    DailyCheckOffCount = apps.get_model("habitusxapp", "DailyCheckOffCount")
+
+    counts = Counter()
+    rows = (
+        CheckOff.objects.values("habit__user_id", "habit__occurrence__daily_rate", "period")
+        .annotate(checkoffs=models.Count("pk")).order_by()
+        .values_list("habit__user_id", "habit__occurrence__daily_rate", "period", "checkoffs")
+    )
+    for user_id, daily_rate, period, checkoffs in rows.iterator():
+        counts[(user_id, get_period_start(period, daily_rate))] += checkoffs
+    for user_id, daily_rate, year, bits in CheckOffBitmap.objects.values_list("habit__user_id", "habit__occurrence__daily_rate", "year", "bits").iterator():
+        for period in get_bitmap_periods(year, bytes(bits), daily_rate):
+            counts[(user_id, get_period_start(period, daily_rate))] += 1
+    DailyCheckOffCount.objects.bulk_create(
+        [DailyCheckOffCount(user_id=user_id, day=day, checkoffs=checkoffs) for (user_id, day), checkoffs in counts.items()],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0008_streakstate_active_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCheckOffCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('checkoffs', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_checkoff_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailycheckoffcount',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='unique_daily_checkoff_count'),
+        ),
+        migrations.RunPython(fill_daily_checkoff_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 12:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0009_dailycheckoffcount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkoff',
+            index=models.Index(fields=['date_added'], name='checkoff_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(fields=['date_created'], name='habit_created_idx'),
+        ),
+    ]
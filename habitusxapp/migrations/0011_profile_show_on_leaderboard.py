@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0010_admin_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='show_on_leaderboard',
+            field=models.BooleanField(default=False),
+        ),
+    ]
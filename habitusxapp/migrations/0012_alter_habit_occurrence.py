@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-18 15:10
+
+# The related_name of Habit.occurrence was changed in the model without a migration: this records it in the
+# migration state. A related_name is not stored in the database, so no SQL is run
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habitusxapp', '0011_profile_show_on_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='habit',
+            name='occurrence',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrence', to='habitusxapp.occurrencerate'),
+        ),
+    ]
@@ -1,6 +1,65 @@
+from datetime import timezone as dt_timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.dispatch import Signal
 from django.contrib.auth.models import User
 from django.utils import timezone
+from .periods import get_period_boundaries, get_period_ordinal
+
+HABIT_STATUSES = ["checked", "unchecked", "streak-broken"]
+
+
+@lru_cache(maxsize=None)
+def get_time_zone_names():
+    """
+    Returns the sorted IANA names of the available time zones. Listing them reads the time zone database,
+    so they are computed once per process
+    """
+    return sorted(available_timezones())
+
+
+def validate_time_zone(value):
+    if value not in get_time_zone_names():
+        raise ValidationError('%(value)s is not a valid time zone', params={'value': value})
+
+
+class Profile(models.Model):
+    """
+    The Profile model holds the preferences of a user. The time_zone attribute is the IANA name of the time zone
+    in which the days and weeks of the habits of the user start. Users without a profile use UTC.
+    The username and the habit descriptions of a user are only shown to the other users on the leaderboards if the user
+    has opted in with show_on_leaderboard
+    """
+
+    user = models.OneToOneField(User, related_name="profile", on_delete=models.CASCADE)
+    time_zone = models.CharField(max_length=64, default="UTC", validators=[validate_time_zone])
+    show_on_leaderboard = models.BooleanField(default=False)
+
+    def __str__(self):
+        return '%s (%s)' % (self.user, self.time_zone)
+
+
+def get_time_zone(name):
+    """
+    Returns the time zone (a tzinfo) with the given IANA name, or UTC if the name is unknown
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return dt_timezone.utc
+
+
+def get_user_time_zone(user):
+    """
+    Returns the time zone (a tzinfo) of a user, which is UTC for users without a profile
+    """
+    try:
+        return get_time_zone(user.profile.time_zone)
+    except Profile.DoesNotExist:
+        return dt_timezone.utc
+
 
 class OccurrenceRate(models.Model):
     """
@@ -16,6 +75,45 @@ class OccurrenceRate(models.Model):
         return '%s' % (self.description)
 
 
+class HabitQuerySet(models.QuerySet):
+    """
+    Custom queryset for the Habit model, exposing chainable helpers that are shared by the views
+    """
+
+    def with_latest_checkoff(self):
+        """
+        Joins the occurrence of each habit and annotates the date of its most recent checkoff as latest_checkoff_date.
+        This way a list of habits can be displayed with a fixed number of queries, regardless of how many habits it contains
+        """
+        latest_checkoffs = CheckOff.objects.filter(habit=models.OuterRef('pk')).order_by('-date_added')
+        return self.select_related('occurrence').annotate(
+            latest_checkoff_date=models.Subquery(latest_checkoffs.values('date_added')[:1])
+        )
+
+    def with_status(self, boundaries=None):
+        """
+        Annotates the checked off status of each habit as status, which is one of HABIT_STATUSES:
+            - checked: the habit has been checked off in the current period
+            - unchecked: the streak of the habit is still active (see StreakState.is_active), i.e. the habit has been
+              checked off in the previous period, or it was created in the current one
+            - streak-broken: any other habit, including the habits without a StreakState, which have no running streak
+        The checked off period is computed in the database from the latest checkoff and the boundaries of the periods
+        (a PeriodBoundaries, by default the UTC ones), while broken streaks are the ones marked by the rollover_streaks
+        command: a streak broken at the last rollover stays unchecked until the next run. Every habit has exactly one
+        status, and filtering by status is a plain WHERE clause with range predicates
+        """
+        boundaries = boundaries or get_period_boundaries(timezone.now())
+        weekly = models.Q(occurrence__daily_rate=7)
+        daily = ~weekly
+        return self.with_latest_checkoff().annotate(status=models.Case(
+            models.When(daily & models.Q(latest_checkoff_date__gte=boundaries.today), then=models.Value("checked")),
+            models.When(weekly & models.Q(latest_checkoff_date__gte=boundaries.monday), then=models.Value("checked")),
+            models.When(streak_state__is_active=True, then=models.Value("unchecked")),
+            default=models.Value("streak-broken"),
+            output_field=models.CharField(),
+        ))
+
+
 class Habit(models.Model):
     """
     The Habit model represent a habit of a given user. 
@@ -28,20 +126,180 @@ class Habit(models.Model):
     occurrence = models.ForeignKey(OccurrenceRate, related_name="occurrence", on_delete=models.CASCADE)
     date_created = models.DateTimeField(default=timezone.now)
 
+    objects = HabitQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "date_created"], name="habit_user_created_idx"),
+            models.Index(fields=["user", "occurrence", "date_created"], name="habit_user_occurrence_idx"),
+            # the order and the date hierarchy of the admin changelist (see admin.py)
+            models.Index(fields=["date_created"], name="habit_created_idx"),
+        ]
+
     def __str__(self):
         return '%s' % (self.description)
 
 
+# sent after checkoffs have been deleted directly (not along with their habit or user), with rows, a list of tuples of
+# (habit id, user id, daily rate, period) of the deleted checkoffs. CheckOff has no pre_delete or post_delete receiver, so that
+# Django deletes the checkoffs of a habit or of a user being deleted with a single statement, without loading them
+checkoffs_deleted = Signal()
+
+
+class CheckOffQuerySet(models.QuerySet):
+    """
+    Custom queryset for the CheckOff model, whose deletion sends checkoffs_deleted
+    """
+
+    def delete(self):
+        rows = list(self.values_list("habit_id", "habit__user_id", "habit__occurrence__daily_rate", "period"))
+        deleted = super().delete()
+        checkoffs_deleted.send(sender=CheckOff, rows=rows)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class CheckOff(models.Model):
     """
     The CheckOff model represent a date and time when a given habit has been checked off.
-    It is completely independent of the occurrence of the habit. Hence, the application logic needs to make sure that
-    CheckOff entities are not inserted at a frequency that is not in line with the occurrence value of the habit.
+    The period attribute is the ordinal of the occurrence period (day or week) of date_added, according to the occurrence
+    of the habit (see periods.get_period_ordinal), in the time zone of the owner of the habit when the checkoff was created.
+    It is filled in automatically on save, and a habit can be checked off only once per period.
+    Code that inserts checkoffs without calling save (e.g. bulk_create) needs to set it explicitly.
     """
     
     habit = models.ForeignKey(Habit, related_name="checkoffs", on_delete=models.CASCADE)
     date_added = models.DateTimeField(default=timezone.now)
+    period = models.IntegerField()
+
+    objects = CheckOffQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["habit", "period"], name="unique_checkoff_per_period"),
+        ]
+        indexes = [
+            models.Index(fields=["habit", "date_added"], name="checkoff_habit_added_idx"),
+            # the order and the date hierarchy of the admin changelist (see admin.py)
+            models.Index(fields=["date_added"], name="checkoff_added_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.period is None:
+            self.period = get_period_ordinal(self.date_added, self.habit.occurrence.daily_rate, get_user_time_zone(self.habit.user))
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        rows = [(self.habit_id, self.habit.user_id, self.habit.occurrence.daily_rate, self.period)]
+        deleted = super().delete(*args, **kwargs)
+        checkoffs_deleted.send(sender=CheckOff, rows=rows)
+        return deleted
 
     def __str__(self):
         return 'Habit %s (%s) (%s) checkoff date %s' % (self.habit.id,self.habit.description, self.habit.occurrence.description, self.date_added.strftime("%d-%m-%Y"))
-    
+
+
+class CheckOffBitmap(models.Model):
+    """
+    The CheckOffBitmap model is the compacted checkoff history of a habit over a calendar year: bit i of bits
+    (little-endian) is set if the i-th period starting in that year has been checked off (see bitmaps.py).
+    Old checkoffs are folded into bitmaps by the compact_checkoffs command, which deletes their rows: a year of a daily
+    habit takes 46 bytes instead of 365 rows. Recent checkoffs are always kept as CheckOff rows
+    """
+
+    habit = models.ForeignKey(Habit, related_name="checkoff_bitmaps", on_delete=models.CASCADE)
+    year = models.IntegerField()
+    bits = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["habit", "year"], name="unique_bitmap_per_habit_year"),
+        ]
+
+    def __str__(self):
+        return 'Habit %s checkoff bitmap of %s' % (self.habit_id, self.year)
+
+
+class StreakState(models.Model):
+    """
+    The StreakState model persists the streak statistics of a habit, so that they do not need to be recomputed
+    by replaying the whole checkoff history of the habit.
+    The last_period attribute is the ordinal of the last checked off period (see periods.get_period_ordinal), while
+    is_active tells if the streak was still running the last time the state was updated: it is set when a checkoff is
+    recorded, and cleared when the streak is broken by the rollover_streaks command, which runs at every period rollover.
+    The checked off status of the habits reads it instead of recomputing it (see HabitQuerySet.with_status).
+    The occurrence of the habit is copied in the state, so that the leaderboards of an occurrence are read from
+    the indexes of the state alone (see leaderboards.py).
+    The state is updated incrementally whenever a checkoff is created, rebuilt from the history of the habit whenever
+    a checkoff is deleted, and deleted along with its habit.
+    """
+
+    habit = models.OneToOneField(Habit, related_name="streak_state", on_delete=models.CASCADE)
+    occurrence = models.ForeignKey(OccurrenceRate, on_delete=models.CASCADE)
+    current_streak = models.IntegerField(default=0)
+    longest_streak = models.IntegerField(default=0)
+    last_period = models.IntegerField(null=True, blank=True)
+    last_checkoff_date = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # the order of the leaderboards (see leaderboards.py)
+            models.Index(fields=["-longest_streak", "habit"], name="streak_state_longest_idx"),
+            models.Index(fields=["occurrence", "-longest_streak", "habit"], name="streak_state_occurrence_idx"),
+            # the habits scanned by the rollover_streaks command
+            models.Index(fields=["is_active", "habit"], name="streak_state_active_idx"),
+        ]
+
+    def __str__(self):
+        return 'Habit %s streak state (current %s, longest %s)' % (self.habit_id, self.current_streak, self.longest_streak)
+
+
+class LeaderboardEntry(models.Model):
+    """
+    The LeaderboardEntry model holds the habits with the longest streaks across all users: the top
+    HABITUSX_LEADERBOARD_SIZE habits of every occurrence, and of all the occurrences together (the entries without
+    an occurrence). Habits are ranked by longest streak, and habits with the same streak by id.
+    The entries are updated as checkoffs are recorded (see leaderboards.py), so that a leaderboard is read
+    without looking at the streak state of every habit
+    """
+
+    habit = models.ForeignKey(Habit, related_name="leaderboard_entries", on_delete=models.CASCADE)
+    occurrence = models.ForeignKey(OccurrenceRate, null=True, blank=True, on_delete=models.CASCADE)
+    longest_streak = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["occurrence", "habit"], name="unique_leaderboard_entry"),
+            models.UniqueConstraint(fields=["habit"], condition=models.Q(occurrence__isnull=True), name="unique_global_leaderboard_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["occurrence", "-longest_streak", "habit"], name="leaderboard_order_idx"),
+        ]
+
+    def __str__(self):
+        return 'Habit %s leaderboard entry (occurrence %s, longest %s)' % (self.habit_id, self.occurrence_id, self.longest_streak)
+
+
+class DailyCheckOffCount(models.Model):
+    """
+    The DailyCheckOffCount model is the daily rollup of the checkoffs of a user: checkoffs is the number of checkoffs
+    of all the habits of the user whose period starts on day (the day of a daily habit, the monday of a weekly one).
+    Counting a checkoff on the first day of its period, rather than on the day it was created, lets the counts be
+    derived from the compacted history too (see models.CheckOffBitmap). The counts are updated as checkoffs are
+    recorded and deleted (see completion.py), and read by the completion heatmap of the user
+    """
+
+    user = models.ForeignKey(User, related_name="daily_checkoff_counts", on_delete=models.CASCADE)
+    day = models.DateField()
+    checkoffs = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "day"], name="unique_daily_checkoff_count"),
+        ]
+
+    def __str__(self):
+        return 'User %s checkoffs of %s (%s)' % (self.user_id, self.day, self.checkoffs)
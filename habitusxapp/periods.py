@@ -0,0 +1,101 @@
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+# the 1st of January 1970 was a thursday: weekly ordinals are shifted by 3 days so that weeks start on monday
+EPOCH = date(1970, 1, 1)
+WEEK_OFFSET = 3
+
+
+def get_week_monday_from_day(day):
+    """
+    A utility function that returns the monday of the week in which parameter day belongs to
+    """
+    return day - timedelta(days=day.weekday())
+
+
+def to_local_date(moment, time_zone=dt_timezone.utc):
+    """
+    Returns the date of a date or datetime in the given time zone (UTC by default).
+    Naive datetimes are considered to be in UTC time, dates are returned unchanged
+    """
+    if isinstance(moment, datetime):
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=dt_timezone.utc)
+        return moment.astimezone(time_zone).date()
+    return moment
+
+
+def get_local_midnight(day, time_zone):
+    """
+    Returns the instant (an aware UTC datetime) at which a day starts in the given time zone
+    """
+    return datetime.combine(day, time.min, tzinfo=time_zone).astimezone(dt_timezone.utc)
+
+
+# day is the current local date, the other values are the instants (aware UTC datetimes) at which the current,
+# previous and next day, and the current and previous week start in the local time zone
+PeriodBoundaries = namedtuple("PeriodBoundaries", ["day", "today", "yesterday", "tomorrow", "monday", "previous_monday"])
+
+
+def get_period_boundaries(now, time_zone=dt_timezone.utc):
+    """
+    Returns the PeriodBoundaries of the periods around now in the given time zone (UTC by default), so that
+    queries can compare datetime columns with plain range predicates
+    """
+    day = to_local_date(now, time_zone)
+    monday = get_week_monday_from_day(day)
+    return PeriodBoundaries(day, *(
+        get_local_midnight(boundary, time_zone)
+        for boundary in [day, day - timedelta(days=1), day + timedelta(days=1), monday, monday - timedelta(weeks=1)]
+    ))
+
+
+def get_period_ordinal(moment, daily_rate, time_zone=dt_timezone.utc):
+    """
+    Returns the integer ordinal of the occurrence period (a day, or a week starting on monday) in which moment falls,
+    according to the local date of moment in the given time zone (UTC by default).
+    Consecutive periods have consecutive ordinals, hence a streak is a run of ordinals that increase by one
+    """
+    days = (to_local_date(moment, time_zone) - EPOCH).days
+    if daily_rate == 7:
+        return (days + WEEK_OFFSET) // 7
+    return days // daily_rate
+
+
+def get_period_start(ordinal, daily_rate):
+    """
+    Returns the first day of the occurrence period identified by ordinal (the inverse of get_period_ordinal)
+    """
+    if daily_rate == 7:
+        return EPOCH + timedelta(days=ordinal * 7 - WEEK_OFFSET)
+    return EPOCH + timedelta(days=ordinal * daily_rate)
+
+
+def is_period_active(period, daily_rate, today):
+    """
+    A streak is active if its last checked off period is the current period or the one before it.
+    today is the current local date of the owner of the habit (or a UTC datetime)
+    """
+    return period is not None and period >= get_period_ordinal(today, daily_rate) - 1
+
+
+def compute_streaks(periods):
+    """
+    Given the ordered period ordinals in which a habit has been checked off (duplicates are allowed), returns
+    a tuple with the longest streak, the streak that ends in the last checked off period and the last period
+    """
+    longest_streak = 0
+    current_streak = 0
+    last_period = None
+
+    for period in periods:
+        if period == last_period:
+            continue
+        if last_period is not None and period == last_period + 1:
+            current_streak += 1
+        else:
+            current_streak = 1
+        longest_streak = max(longest_streak, current_streak)
+        last_period = period
+
+    return longest_streak, current_streak, last_period
@@ -0,0 +1,53 @@
+"""
+Routing of the read-only queries to a separate connection. The analytics views only read, and can be served by the
+database alias named by the HABITUSX_READ_ONLY_DATABASE setting: with SQLite in WAL mode, its connection (opened
+with query_only, see signals.py) reads a snapshot of the database without ever blocking the checkoff writes
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+read_only = ContextVar("habitusx_read_only", default=False)
+
+
+@contextmanager
+def read_only_queries():
+    """
+    Sends the reads run within the block to the read-only database, when ReadOnlyRouter is installed
+    """
+    token = read_only.set(True)
+    try:
+        yield
+    finally:
+        read_only.reset(token)
+
+
+class ReadOnlyRouter:
+    """
+    Routes the reads run within read_only_queries to the HABITUSX_READ_ONLY_DATABASE alias, and every write to the
+    default database, including the writes of objects that have been read from the read-only alias
+    """
+
+    def get_read_only_alias(self):
+        return getattr(settings, "HABITUSX_READ_ONLY_DATABASE", None)
+
+    def db_for_read(self, model, **hints):
+        if read_only.get():
+            return self.get_read_only_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases are connections to the same database
+        aliases = {DEFAULT_DB_ALIAS, self.get_read_only_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == self.get_read_only_alias():
+            return False
+        return None
@@ -0,0 +1,123 @@
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .cache import bump_user_version
+from .completion import count_history_days, remove_daily_checkoffs
+from .middleware import TIME_ZONE_SESSION_KEY
+from .periods import get_period_start
+from .leaderboards import rebuild_leaderboard
+from .models import Habit, CheckOff, LeaderboardEntry, StreakState, checkoffs_deleted, get_user_time_zone
+from .streaks import get_local_today, is_new_habit_pending, rebuild_streak_states, record_checkoff
+
+
+@receiver(post_save, sender=Habit)
+def create_streak_state(sender, instance, created, **kwargs):
+    """
+    Every new habit starts with an empty streak, which is pending if the habit was created in the current period
+    """
+    if created:
+        StreakState.objects.create(habit=instance, occurrence_id=instance.occurrence_id, is_active=is_new_habit_pending(instance, get_local_today(instance.user)))
+
+
+@receiver(post_save, sender=CheckOff)
+def update_streak_state(sender, instance, created, **kwargs):
+    """
+    Keeps the StreakState of a habit up to date as checkoffs are written
+    """
+    if created:
+        record_checkoff(instance)
+
+
+@receiver(pre_delete, sender=Habit)
+def find_leaderboard_entries(sender, instance, **kwargs):
+    """
+    Remembers the leaderboards a habit about to be deleted belongs to (see refill_leaderboards)
+    """
+    instance.leaderboard_occurrence_ids = list(LeaderboardEntry.objects.filter(habit=instance).values_list("occurrence_id", flat=True))
+
+
+@receiver(post_delete, sender=Habit)
+def refill_leaderboards(sender, instance, **kwargs):
+    """
+    The entries of a deleted habit are deleted along with it, so its leaderboards are rebuilt to take in the next habits
+    """
+    for occurrence_id in getattr(instance, "leaderboard_occurrence_ids", []):
+        rebuild_leaderboard(occurrence_id)
+
+
+@receiver(pre_delete, sender=Habit)
+def count_deleted_checkoffs(sender, instance, origin=None, **kwargs):
+    """
+    Counts the checkoffs of a habit about to be deleted by day (see remove_deleted_checkoffs).
+    The daily rollup of a user is deleted along with the user, so the habits deleted with their owner are skipped
+    """
+    if not isinstance(origin, User):
+        instance.daily_checkoff_counts = count_history_days(Habit.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Habit)
+def remove_deleted_checkoffs(sender, instance, **kwargs):
+    """
+    Removes the checkoffs of a deleted habit from the daily rollup of its owner (see completion.py)
+    """
+    remove_daily_checkoffs(getattr(instance, "daily_checkoff_counts", {}))
+
+
+@receiver(checkoffs_deleted, sender=CheckOff)
+def remove_deleted_checkoffs_of_users(sender, rows, **kwargs):
+    """
+    Removes checkoffs deleted directly (see models.checkoffs_deleted) from the daily rollup of their owners, rebuilds
+    the streak states of their habits, which cannot be rolled back incrementally, and invalidates the cached pages
+    of the owners. The ones deleted along with their habit are removed with the habit (see remove_deleted_checkoffs)
+    """
+    if not rows:
+        return
+    remove_daily_checkoffs(Counter((user_id, get_period_start(period, daily_rate)) for _, user_id, daily_rate, period in rows))
+    rebuild_streak_states(Habit.objects.filter(pk__in={habit_id for habit_id, _, _, _ in rows}))
+    for user_id in {user_id for _, user_id, _, _ in rows}:
+        bump_user_version(user_id)
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def invalidate_habit_cache(sender, instance, **kwargs):
+    """
+    Invalidates the cached pages of the owner of a habit that has been written or deleted
+    """
+    bump_user_version(instance.user_id)
+
+
+@receiver(post_save, sender=CheckOff)
+def invalidate_checkoff_cache(sender, instance, **kwargs):
+    """
+    Invalidates the cached pages of the owner of a checkoff that has been written. The deleted checkoffs are handled
+    by remove_deleted_checkoffs_of_users, and the ones deleted along with their habit by the deletion of the habit
+    """
+    bump_user_version(instance.habit.user_id)
+
+
+@receiver(user_logged_in)
+def store_time_zone(sender, request, user, **kwargs):
+    """
+    Keeps the time zone of the user in the session, so that TimeZoneMiddleware does not read the profile on every request
+    """
+    request.session[TIME_ZONE_SESSION_KEY] = str(get_user_time_zone(user))
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Applies the pragmas of the HABITUSX_SQLITE_PRAGMAS setting to every new SQLite connection (see settings_production.py),
+    and opens the connection of the HABITUSX_READ_ONLY_DATABASE alias in read-only mode (see routers.py)
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, "HABITUSX_SQLITE_PRAGMAS", {}).items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+        if connection.alias == getattr(settings, "HABITUSX_READ_ONLY_DATABASE", None):
+            cursor.execute("PRAGMA query_only = ON")
@@ -0,0 +1,273 @@
+from datetime import timezone as dt_timezone
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .bitmaps import build_history, compute_history_streaks
+from .cache import bump_user_version
+from .completion import add_daily_checkoffs, count_checkoff_days
+from .leaderboards import update_leaderboards
+from .models import Habit, CheckOff, CheckOffBitmap, StreakState, get_time_zone, get_user_time_zone
+from .periods import get_local_midnight, get_period_ordinal, get_period_start, is_period_active, to_local_date
+
+# gaps-and-islands: since a habit has at most one checkoff per period, consecutive periods of a habit
+# share the same value of period - ROW_NUMBER()
+STREAKS_SQL = """
+    WITH islands AS (
+        SELECT habit_id, period, date_added AS last_checkoff_date,
+               period - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY period) AS island
+        FROM {checkoff}
+        WHERE habit_id IN ({habits})
+    ), runs AS (
+        SELECT habit_id, COUNT(*) AS length, MAX(period) AS last_period, MAX(last_checkoff_date) AS last_checkoff_date,
+               ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY MAX(period) DESC) AS recency
+        FROM islands
+        GROUP BY habit_id, island
+    )
+    SELECT habit_id, MAX(length), MAX(CASE WHEN recency = 1 THEN length END), MAX(last_period), MAX(last_checkoff_date)
+    FROM runs
+    GROUP BY habit_id
+"""
+
+
+def get_local_today(user):
+    """
+    Returns the current date in the time zone of a user
+    """
+    return to_local_date(timezone.now(), get_user_time_zone(user))
+
+
+def is_new_habit_pending(habit, today):
+    """
+    A habit that has never been checked off is still pending (and not broken) only during the period it was created in.
+    today is the current local date of the owner of the habit
+    """
+    daily_rate = habit.occurrence.daily_rate
+    return get_period_ordinal(habit.date_created, daily_rate, get_user_time_zone(habit.user)) >= get_period_ordinal(today, daily_rate)
+
+
+def query_streaks(habits):
+    """
+    Computes the streaks of the given habits (a Habit queryset) in the database, with a single query.
+    Returns a dictionary that maps the id of each habit having at least one checkoff to a tuple with
+    its longest streak, its latest streak, the ordinal of its last checked off period and the date of its last checkoff
+    """
+    habits_sql, params = habits.values('pk').query.sql_with_params()
+    sql = STREAKS_SQL.format(checkoff=CheckOff._meta.db_table, habits=habits_sql)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    streaks = {}
+    for habit_id, longest_streak, current_streak, last_period, last_checkoff_date in rows:
+        last_checkoff_date = parse_datetime(last_checkoff_date)
+        if timezone.is_naive(last_checkoff_date):
+            last_checkoff_date = timezone.make_aware(last_checkoff_date, dt_timezone.utc)
+        streaks[habit_id] = (longest_streak, current_streak, last_period, last_checkoff_date)
+    return streaks
+
+
+def query_bitmap_streaks(habits):
+    """
+    Computes the streaks of the habits with a compacted history (see models.CheckOffBitmap) among the given ones,
+    merging their bitmaps and their remaining checkoff rows. Returns a dictionary like query_streaks.
+    When the last checked off period has been compacted, the start of the period in the time zone of the owner of the habit
+    is used as the date of the last checkoff
+    """
+    bitmaps = {}
+    rows = CheckOffBitmap.objects.filter(habit__in=habits).values_list("habit_id", "habit__occurrence__daily_rate", "habit__user__profile__time_zone", "year", "bits")
+    for habit_id, daily_rate, time_zone, year, bits in rows:
+        # users without a profile use UTC
+        bitmaps.setdefault((habit_id, daily_rate, time_zone or "UTC"), []).append((year, bytes(bits)))
+    if not bitmaps:
+        return {}
+
+    checkoff_dates = {}
+    for habit_id, period, date_added in CheckOff.objects.filter(habit_id__in=[habit_id for habit_id, _, _ in bitmaps]).values_list("habit_id", "period", "date_added"):
+        checkoff_dates.setdefault(habit_id, {})[period] = date_added
+
+    streaks = {}
+    for (habit_id, daily_rate, time_zone), habit_bitmaps in bitmaps.items():
+        dates = checkoff_dates.get(habit_id, {})
+        longest_streak, current_streak, last_period = compute_history_streaks(*build_history(habit_bitmaps, dates, daily_rate))
+        if last_period is None:
+            continue
+        last_checkoff_date = dates.get(last_period) or get_local_midnight(get_period_start(last_period, daily_rate), get_time_zone(time_zone))
+        streaks[habit_id] = (longest_streak, current_streak, last_period, last_checkoff_date)
+    return streaks
+
+
+def build_streak_states(habits, today=None):
+    """
+    Computes (without saving them) the StreakState entities of the given habits from their checkoff history.
+    The streaks of all habits are computed in the database with a single query (see query_streaks), except the ones
+    of the habits with a compacted history, which are computed from their bitmaps (see query_bitmap_streaks).
+    today is the current local date of the owner of the habits, by default the one of the owner of each habit
+    """
+    streaks = query_streaks(habits)
+    streaks.update(query_bitmap_streaks(habits))
+
+    states = []
+    for habit in habits.select_related('occurrence', 'user__profile'):
+        daily_rate = habit.occurrence.daily_rate
+        habit_today = today or get_local_today(habit.user)
+        if habit.pk in streaks:
+            longest_streak, current_streak, last_period, last_checkoff_date = streaks[habit.pk]
+            is_active = is_period_active(last_period, daily_rate, habit_today)
+        else:
+            longest_streak, current_streak, last_period, last_checkoff_date = 0, 0, None, None
+            is_active = is_new_habit_pending(habit, habit_today)
+        states.append(StreakState(
+            habit=habit,
+            occurrence_id=habit.occurrence_id,
+            current_streak=current_streak,
+            longest_streak=longest_streak,
+            last_period=last_period,
+            last_checkoff_date=last_checkoff_date,
+            is_active=is_active,
+        ))
+    return states
+
+
+def rebuild_streak_states(habits, today=None):
+    """
+    Replaces the StreakState entities of the given habits with freshly computed ones, updates the leaderboards
+    (see leaderboards.py) and returns them
+    """
+    states = build_streak_states(habits, today)
+    with transaction.atomic():
+        StreakState.objects.filter(habit__in=[state.habit for state in states]).delete()
+        StreakState.objects.bulk_create(states)
+        update_leaderboards(states)
+    return states
+
+
+def advance_streak_state(state, period, checkoff_date, daily_rate, today):
+    """
+    Moves a StreakState forward to a newly checked off period, without saving it.
+    Returns False, leaving the state untouched, if the period is older than the last checked off one
+    """
+    if state.last_period is not None and period < state.last_period:
+        return False
+
+    if period != state.last_period:
+        if state.last_period is not None and period == state.last_period + 1:
+            state.current_streak += 1
+        else:
+            state.current_streak = 1
+        state.longest_streak = max(state.longest_streak, state.current_streak)
+        state.last_period = period
+
+    state.last_checkoff_date = checkoff_date
+    state.is_active = is_period_active(period, daily_rate, today)
+    return True
+
+
+def insert_checkoffs(checkoffs):
+    """
+    Inserts new checkoffs in bulk, and returns the ones that have been inserted: the checkoffs of a period in which
+    their habit has already been checked off (e.g. by a concurrent request) are skipped, so that only the returned ones
+    are recorded (see record_checkoffs). It must run in a transaction
+    """
+    try:
+        with transaction.atomic():
+            return CheckOff.objects.bulk_create(checkoffs)
+    except IntegrityError:
+        # the failed insert has taken the write lock of the database, so no other checkoff is inserted before this
+        # transaction ends
+        existing = set(CheckOff.objects.filter(
+            habit_id__in={checkoff.habit_id for checkoff in checkoffs}, period__in={checkoff.period for checkoff in checkoffs},
+        ).values_list("habit_id", "period"))
+        return CheckOff.objects.bulk_create([checkoff for checkoff in checkoffs if (checkoff.habit_id, checkoff.period) not in existing])
+
+
+def record_checkoffs(checkoffs, today=None):
+    """
+    Updates the StreakState of the habits the given new checkoffs belong to, without replaying their history.
+    The states are read and written in bulk, so the number of queries does not depend on the number of checkoffs.
+    Checkoffs older than the last checked off period of their habit (e.g. imported history) trigger a full rebuild
+    of the state of that habit instead. The habits whose longest streak grows are merged into the leaderboards
+    (see leaderboards.py).
+    today is the current local date of the owner of the habits, by default the one of the owner of each habit
+    """
+    checkoffs = sorted(checkoffs, key=lambda checkoff: (checkoff.habit_id, checkoff.period))
+    states = {state.habit_id: state for state in StreakState.objects.filter(habit_id__in={checkoff.habit_id for checkoff in checkoffs})}
+    longest_streaks = {habit_id: state.longest_streak for habit_id, state in states.items()}
+    created_ids, updated_ids, rebuilt_ids = set(), set(), set()
+
+    for checkoff in checkoffs:
+        if checkoff.habit_id not in states:
+            states[checkoff.habit_id] = StreakState(habit_id=checkoff.habit_id, occurrence_id=checkoff.habit.occurrence_id)
+            created_ids.add(checkoff.habit_id)
+        habit_today = today or get_local_today(checkoff.habit.user)
+        if advance_streak_state(states[checkoff.habit_id], checkoff.period, checkoff.date_added, checkoff.habit.occurrence.daily_rate, habit_today):
+            updated_ids.add(checkoff.habit_id)
+        else:
+            rebuilt_ids.add(checkoff.habit_id)
+
+    with transaction.atomic():
+        StreakState.objects.bulk_create([states[habit_id] for habit_id in created_ids - rebuilt_ids])
+        StreakState.objects.bulk_update(
+            [states[habit_id] for habit_id in updated_ids - created_ids - rebuilt_ids],
+            ["current_streak", "longest_streak", "last_period", "last_checkoff_date", "is_active"],
+        )
+        update_leaderboards([
+            states[habit_id] for habit_id in updated_ids - rebuilt_ids
+            if states[habit_id].longest_streak != longest_streaks.get(habit_id, 0)
+        ])
+        add_daily_checkoffs(count_checkoff_days(checkoffs))
+    if rebuilt_ids:
+        rebuild_streak_states(Habit.objects.filter(pk__in=rebuilt_ids), today)
+
+
+def record_checkoff(checkoff, today=None):
+    """
+    Updates the StreakState of the habit a new checkoff belongs to (see record_checkoffs)
+    """
+    record_checkoffs([checkoff], today)
+
+
+def mark_broken_streaks(start, end, now=None):
+    """
+    Marks as inactive the active StreakStates of the habits with an id in [start, end) whose streak is broken at now
+    (by default the current time), in the time zone of the owner of each habit: the last checked off period is older
+    than the previous one, or the habit has never been checked off and the period it was created in is over.
+    Only the active states are read, with the index on is_active, and the states are updated only if they have not been
+    checked off in the meantime. The cached pages of the owners of the broken streaks are invalidated.
+    Returns the number of active states examined and the number of states marked as inactive
+    """
+    now = now or timezone.now()
+    rows = StreakState.objects.filter(is_active=True, habit_id__gte=start, habit_id__lt=end).values_list(
+        "pk", "last_period", "occurrence__daily_rate", "habit__date_created", "habit__user_id", "habit__user__profile__time_zone",
+    )
+    time_zones = {}
+    # the states broken at the same period ordinal are updated together
+    broken_ids = {}
+    user_ids = set()
+    examined = 0
+
+    for pk, last_period, daily_rate, date_created, user_id, time_zone_name in rows:
+        examined += 1
+        if time_zone_name not in time_zones:
+            time_zone = get_time_zone(time_zone_name or "UTC")
+            time_zones[time_zone_name] = (time_zone, to_local_date(now, time_zone))
+        time_zone, today = time_zones[time_zone_name]
+        current_period = get_period_ordinal(today, daily_rate)
+        if last_period is None:
+            # see is_new_habit_pending
+            broken = get_period_ordinal(date_created, daily_rate, time_zone) < current_period
+        else:
+            broken = not is_period_active(last_period, daily_rate, today)
+        if broken:
+            broken_ids.setdefault((daily_rate, current_period), []).append(pk)
+            user_ids.add(user_id)
+
+    marked = 0
+    for (daily_rate, current_period), ids in broken_ids.items():
+        marked += StreakState.objects.filter(pk__in=ids, is_active=True).filter(
+            Q(last_period__isnull=True) | Q(last_period__lt=current_period - 1)
+        ).update(is_active=False)
+    for user_id in user_ids:
+        bump_user_version(user_id)
+    return examined, marked
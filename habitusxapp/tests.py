@@ -1,12 +1,47 @@
-from django.test import TestCase
+from django.test import Client, TestCase, TransactionTestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth.models import User
-from .models import Habit, CheckOff, OccurrenceRate
-from datetime import date
+from .models import Habit, CheckOff, CheckOffBitmap, DailyCheckOffCount, LeaderboardEntry, OccurrenceRate, Profile, StreakState
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+from unittest.mock import patch
+from django.utils import timezone
 from django.urls import reverse
+from unittest import skipIf
+from django.db import connection, connections, transaction, IntegrityError, OperationalError
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from .periods import get_period_boundaries, get_period_ordinal, compute_streaks
+from .streaks import insert_checkoffs, mark_broken_streaks, query_streaks, rebuild_streak_states
+from .bitmaps import build_history, compute_completion_rate, compute_history_streaks, get_history_periods, get_period_year, pack_periods
+from .buffer import CheckOffBuffer, checkoff_buffer
+from .leaderboards import rebuild_leaderboards
+from .completion import count_history_days
+from .cache import bump_user_version, get_cache, get_cache_stats, get_user_version
+from .views import encode_cursor
+from .admin import CheckOffAdmin
+from django.contrib import admin
+from .urls import urlpatterns
+from .metrics import registry
+from .routers import ReadOnlyRouter, read_only_queries
+from .management.commands.streak_report import np
+import csv
+import json
+import random
+import re
+import os
+import tempfile
+import threading
+import time
 
 class BaseTestSetup(TestCase):
     
     def setUp(self):
+        get_cache().clear()
+
         # ======= setup users
         self.user1 = User.objects.create_user(username="John", password="password1")
         self.user2 = User.objects.create_user(username="Jane", password="password2")
@@ -37,9 +72,10 @@ class BaseTestSetup(TestCase):
         # ========================= jane
         CheckOff.objects.create(habit=self.habit1Jane, date_added=date(2024, 9, 15))
         CheckOff.objects.create(habit=self.habit1Jane, date_added=date(2024, 9, 16))
-        CheckOff.objects.create(habit=self.habit1Jane, date_added=date(2024, 9, 20))
-        CheckOff.objects.create(habit=self.habit1Jane, date_added=date(2024, 9, 21))
-        CheckOff.objects.create(habit=self.habit1Jane, date_added=date(2024, 9, 22))
+        # the same week as the 16th: like the checkoff view, only the first checkoff of a period is kept
+        # (see CheckOffPeriodMigrationTest for the checkoffs stored before periods)
+        for value in range(20, 23):
+            CheckOff.objects.get_or_create(habit=self.habit1Jane, period=get_period_ordinal(date(2024, 9, value), 7), defaults={"date_added": date(2024, 9, value)})
 
         CheckOff.objects.create(habit=self.habit2Jane, date_added=date(2024, 9, 17))
         CheckOff.objects.create(habit=self.habit2Jane, date_added=date(2024, 9, 25))
@@ -82,6 +118,186 @@ class FilteredViewTest(BaseTestSetup):
         self.assertEqual(habits[0].description, "Jane Habit 2")
         self.assertEqual(habits[0].occurrence.description, "Daily")
 
+class FilteredViewStatusTest(BaseTestSetup):
+
+    def filtered_ids(self, occurrence, status):
+        response = self.client.get(reverse("filtered", kwargs={"occurrence": occurrence, "checkedoffstatus": status}))
+        return sorted(habit.pk for habit in response.context["habits"])
+
+    def test_every_habit_has_exactly_one_status(self):
+        today = timezone.now()
+        Habit.objects.create(description="Jane old weekly habit", user=self.user2, date_created=today - timedelta(weeks=5), occurrence=self.weeklyOccurrence)
+        Habit.objects.create(description="Jane new daily habit", user=self.user2, occurrence=self.dalyOccurrence)
+        checked = Habit.objects.create(description="Jane checked daily habit", user=self.user2, date_created=today - timedelta(days=3), occurrence=self.dalyOccurrence)
+        CheckOff.objects.create(habit=checked, date_added=today - timedelta(days=1))
+        CheckOff.objects.create(habit=checked, date_added=today)
+
+        self.client.login(username="Jane", password="password2")
+        for occurrence in ["daily", "weekly", "any-occurrence"]:
+            buckets = [self.filtered_ids(occurrence, status) for status in ["checked", "unchecked", "streak-broken"]]
+            self.assertEqual(sorted(sum(buckets, [])), self.filtered_ids(occurrence, "any-status"))
+
+    def test_filters_match_the_cards_until_the_next_rollover(self):
+        # a streak broken since the last run of rollover_streaks is still active
+        stale = Habit.objects.create(description="Jane stale daily habit", user=self.user2, date_created=timezone.now() - timedelta(days=5), occurrence=self.dalyOccurrence)
+        CheckOff.objects.create(habit=stale, date_added=timezone.now() - timedelta(days=3))
+        StreakState.objects.filter(habit=stale).update(is_active=True)
+        missing = Habit.objects.create(description="Jane daily habit without state", user=self.user2, occurrence=self.dalyOccurrence)
+        StreakState.objects.filter(habit=missing).delete()
+
+        self.client.login(username="Jane", password="password2")
+        cards = {habit.pk: habit.status for habit in self.client.get(reverse("home")).context["habits"]}
+        self.assertEqual((cards[stale.pk], cards[missing.pk]), ("unchecked", "streak-broken"))
+        for status in ["checked", "unchecked", "streak-broken"]:
+            self.assertEqual(self.filtered_ids("any-occurrence", status), sorted(pk for pk, card_status in cards.items() if card_status == status))
+
+        CheckOff.objects.create(habit=missing, date_added=timezone.now())
+        self.assertEqual(self.filtered_ids("daily", "checked"), [missing.pk])
+
+    def test_filtered_view_statuses(self):
+        today = timezone.now()
+        pending = Habit.objects.create(description="Jane pending weekly habit", user=self.user2, date_created=today - timedelta(weeks=3), occurrence=self.weeklyOccurrence)
+        CheckOff.objects.create(habit=pending, date_added=today - timedelta(weeks=1))
+        checked = Habit.objects.create(description="Jane checked daily habit", user=self.user2, occurrence=self.dalyOccurrence)
+        CheckOff.objects.create(habit=checked, date_added=today)
+
+        self.client.login(username="Jane", password="password2")
+        self.assertEqual(self.filtered_ids("any-occurrence", "checked"), [checked.pk])
+        self.assertEqual(self.filtered_ids("weekly", "unchecked"), [pending.pk])
+        self.assertEqual(self.filtered_ids("any-occurrence", "streak-broken"), [self.habit1Jane.pk, self.habit2Jane.pk])
+
+
+class HabitCardTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        self.client.login(username="Jane", password="password2")
+        self.checked = Habit.objects.create(description="Jane checked daily habit", user=self.user2, occurrence=self.dalyOccurrence)
+        CheckOff.objects.create(habit=self.checked, date_added=timezone.now())
+
+    def test_cards_render_the_status(self):
+        response = self.client.get(reverse("home"))
+        self.assertContains(response, "checked-off", count=1)
+        self.assertContains(response, "streak broken", count=2)
+        self.assertNotContains(response, reverse("checkoff-habit", kwargs={"pk": self.checked.pk}))
+        self.assertContains(response, reverse("checkoff-habit", kwargs={"pk": self.habit2Jane.pk}))
+        self.assertContains(response, reverse("delete-habit", kwargs={"pk": self.checked.pk}))
+
+    def test_cards_are_cached_until_the_habits_change(self):
+        self.client.get(reverse("home"))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("home"))
+        self.assertFalse([query for query in queries if "habitusxapp_habit" in query["sql"]])
+
+        self.habit2Jane.description = "Jane renamed habit"
+        self.habit2Jane.save()
+        self.assertContains(self.client.get(reverse("home")), "Jane renamed habit")
+
+        # a queryset update sends no signal, so the cards change with the new version of the user
+        Habit.objects.filter(pk=self.habit2Jane.pk).update(description="Jane renamed habit again")
+        bump_user_version(self.user2.pk)
+        self.assertContains(self.client.get(reverse("home")), "Jane renamed habit again")
+
+        self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit2Jane.pk}))
+        self.assertContains(self.client.get(reverse("home")), "checked-off", count=2)
+
+    def test_benchmark_render(self):
+        out = StringIO()
+        call_command("benchmark_render", habits=30, repeat=2, stdout=out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()[2:]], ["disabled", "cold", "warm"])
+
+
+class HabitListQueryCountTest(BaseTestSetup):
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def add_habits(self, amount):
+        for value in range(amount):
+            occurrence = self.dalyOccurrence if value % 2 == 0 else self.weeklyOccurrence
+            habit = Habit.objects.create(description="Jane Extra Habit %s" % value, user=self.user2, occurrence=occurrence)
+            CheckOff.objects.create(habit=habit)
+
+    def test_home_view_query_count_is_constant(self):
+        self.client.login(username="Jane", password="password2")
+        url = reverse("home")
+        queries_before = self.count_queries(url)
+        self.add_habits(20)
+        self.assertEqual(self.count_queries(url), queries_before)
+
+    def test_filtered_view_query_count_is_constant(self):
+        self.client.login(username="Jane", password="password2")
+        for occurrence in ["daily", "weekly", "any-occurrence"]:
+            for status in ["checked", "unchecked", "streak-broken", "any-status"]:
+                url = reverse("filtered", kwargs={"occurrence": occurrence, "checkedoffstatus": status})
+                queries_before = self.count_queries(url)
+                self.add_habits(4)
+                self.assertEqual(self.count_queries(url), queries_before)
+
+
+class TimeZoneTest(BaseTestSetup):
+
+    # 23:30 UTC on the 11th of November is already the 12th in Rome
+    now = datetime(2024, 11, 11, 23, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        Profile.objects.create(user=self.user1, time_zone="Europe/Rome")
+        self.client.login(username="John", password="password1")
+        # the streak state is recorded as of now, as it would be if the habit had been checked off on the 11th
+        with patch("django.utils.timezone.now", return_value=self.now):
+            self.habit = Habit.objects.create(description="John Rome Habit", user=self.user1, occurrence=self.dalyOccurrence, date_created=datetime(2024, 11, 1, tzinfo=dt_timezone.utc))
+            CheckOff.objects.create(habit=self.habit, date_added=datetime(2024, 11, 11, 12, 0, tzinfo=dt_timezone.utc))
+
+    def get_status(self):
+        with patch("django.utils.timezone.now", return_value=self.now):
+            results = self.client.get(reverse("api-habits")).json()["results"]
+        return {habit["id"]: habit["status"] for habit in results}[self.habit.pk]
+
+    def test_period_boundaries(self):
+        boundaries = get_period_boundaries(self.now, ZoneInfo("Europe/Rome"))
+        self.assertEqual(boundaries.day, date(2024, 11, 12))
+        self.assertEqual(boundaries.today, datetime(2024, 11, 11, 23, tzinfo=dt_timezone.utc))
+        self.assertEqual(boundaries.tomorrow, datetime(2024, 11, 12, 23, tzinfo=dt_timezone.utc))
+        self.assertEqual(boundaries.monday, datetime(2024, 11, 10, 23, tzinfo=dt_timezone.utc))
+        self.assertEqual(get_period_boundaries(self.now).day, date(2024, 11, 11))
+
+    def test_checkoff_period_uses_the_time_zone_of_the_user(self):
+        checkoff = CheckOff.objects.create(habit=self.habit, date_added=self.now)
+        self.assertEqual(checkoff.period, get_period_ordinal(date(2024, 11, 12), 1))
+
+    def test_status_follows_local_midnight(self):
+        self.assertEqual(self.get_status(), "unchecked")
+        Profile.objects.filter(user=self.user1).update(time_zone="UTC")
+        self.client.login(username="John", password="password1")
+        self.assertEqual(self.get_status(), "checked")
+
+    def test_checkoff_after_local_midnight(self):
+        with patch("django.utils.timezone.now", return_value=self.now):
+            self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit.pk}))
+        self.assertEqual(self.habit.checkoffs.count(), 2)
+        state = StreakState.objects.get(habit=self.habit)
+        self.assertEqual((state.current_streak, state.last_period, state.is_active), (2, get_period_ordinal(date(2024, 11, 12), 1), True))
+
+    def test_filters_use_range_predicates(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("filtered", kwargs={"occurrence": "daily", "checkedoffstatus": "checked"}))
+        self.assertFalse([query for query in queries if "django_datetime_cast_date" in query["sql"]])
+
+    def test_update_time_zone(self):
+        self.assertEqual(self.client.get(reverse("time-zone")).status_code, 200)
+        response = self.client.post(reverse("time-zone"), {"time_zone": "America/New_York"})
+        self.assertRedirects(response, "/", fetch_redirect_response=False)
+        self.assertEqual(Profile.objects.get(user=self.user1).time_zone, "America/New_York")
+        self.assertEqual(self.client.session["habitusx_time_zone"], "America/New_York")
+        response = self.client.post(reverse("time-zone"), {"time_zone": "Mars/Olympus"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Profile.objects.get(user=self.user1).time_zone, "America/New_York")
+
+
 class CreateHabitViewTest(BaseTestSetup):
 
     def test_habit_create_view(self):
@@ -105,19 +321,308 @@ class HabitDeleteViewTest(BaseTestSetup):
         self.assertFalse(Habit.objects.filter(id=habit_id).exists())
         self.assertRedirects(response, reverse("home"))
 
+    def test_delete_habit_view_from_the_page(self):
+        self.client.login(username="John", password="password1")
+        response = self.client.post(reverse("delete-habit", kwargs={"pk": self.habit1Jane.pk}), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        self.assertEqual(response.json(), {"id": self.habit1Jane.pk, "deleted": False})
+        response = self.client.post(reverse("delete-habit", kwargs={"pk": self.habit1John.pk}), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        self.assertEqual(response.json(), {"id": self.habit1John.pk, "deleted": True})
+        self.assertFalse(Habit.objects.filter(id=self.habit1John.pk).exists())
+        self.assertTrue(Habit.objects.filter(id=self.habit1Jane.pk).exists())
+
 
 class HabitCheckoffViewTest(BaseTestSetup):
 
     def test_habit_checkoff_view(self):
         
-        self.assertEqual(CheckOff.objects.count(), 41) 
+        # the 41 checkoffs of the fixture, but the 3 of a week already checked off
+        self.assertEqual(CheckOff.objects.count(), 38) 
         
         self.client.login(username="John", password="password1")
         habit_to_checkoff_id = Habit.objects.filter(user=self.user1).first().id
         response = self.client.post(reverse("checkoff-habit", kwargs={"pk": habit_to_checkoff_id}))
         
         self.assertEqual(response.status_code, 302) 
-        self.assertEqual(CheckOff.objects.count(), 42)
+        self.assertEqual(CheckOff.objects.count(), 39)
+
+    def test_habit_checkoff_view_checks_off_once_per_period(self):
+        self.client.login(username="John", password="password1")
+        for _ in range(3):
+            response = self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit2John.pk}))
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.habit2John.checkoffs.count(), 3)
+
+    def test_habit_checkoff_view_only_checks_off_own_habits(self):
+        self.client.login(username="John", password="password1")
+        response = self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit2Jane.pk}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.habit2Jane.checkoffs.count(), 2)
+
+    def post_checkoff_from_the_page(self, habit):
+        return self.client.post(reverse("checkoff-habit", kwargs={"pk": habit.pk}), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+
+    def test_habit_checkoff_view_from_the_page_returns_the_card(self):
+        self.client.login(username="John", password="password1")
+        for _ in range(2):
+            response = self.post_checkoff_from_the_page(self.habit3John)
+            self.assertEqual(response.status_code, 200)
+            self.assertTemplateUsed(response, "partials/habit-cards.html")
+            self.assertContains(response, 'id="habit-card-%s"' % self.habit3John.pk, count=1)
+            self.assertContains(response, "checked-off")
+            self.assertNotContains(response, reverse("checkoff-habit", kwargs={"pk": self.habit3John.pk}))
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+        # no message is left for the next page
+        self.assertFalse(list(self.client.get(reverse("home")).context["messages"]))
+
+    def test_habit_checkoff_view_from_the_page_query_count_is_constant(self):
+        self.client.login(username="John", password="password1")
+        with CaptureQueriesContext(connection) as queries:
+            self.post_checkoff_from_the_page(self.habit2John)
+        for value in range(20):
+            Habit.objects.create(description="John Habit %s" % (value + 4), user=self.user1, occurrence=self.dalyOccurrence)
+        with self.assertNumQueries(len(queries)):
+            self.post_checkoff_from_the_page(self.habit3John)
+
+    def test_checkoff_period(self):
+        self.assertEqual(CheckOff.objects.get(habit=self.habit1Jane, date_added=date(2024, 9, 16)).period, get_period_ordinal(date(2024, 9, 22), 7))
+        with self.assertRaises(IntegrityError):
+            CheckOff.objects.create(habit=self.habit1Jane, date_added=date(2024, 9, 22))
+
+class CheckOffPeriodMigrationTest(TransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(target)
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicate_checkoffs_are_logged_and_deleted(self):
+        apps = self.migrate([("habitusxapp", "0002_streakstate")])
+        user = apps.get_model("auth", "User").objects.create(username="Jane")
+        occurrence = apps.get_model("habitusxapp", "OccurrenceRate").objects.create(description="Weekly", daily_rate=7)
+        habit = apps.get_model("habitusxapp", "Habit").objects.create(description="Jane Habit 1", user=user, occurrence=occurrence)
+        HistoricalCheckOff = apps.get_model("habitusxapp", "CheckOff")
+        # the checkoffs of the habit in the fixture of BaseTestSetup: the 15th is a sunday
+        ids = [HistoricalCheckOff.objects.create(habit=habit, date_added=datetime(2024, 9, value, tzinfo=dt_timezone.utc)).pk for value in [15, 16, 20, 21, 22]]
+
+        with self.assertLogs("habitusxapp.migrations", "WARNING") as logs:
+            apps = self.migrate([("habitusxapp", "0003_checkoff_period")])
+
+        checkoffs = apps.get_model("habitusxapp", "CheckOff").objects.order_by("date_added")
+        self.assertEqual(list(checkoffs.values_list("pk", "period")), [(ids[0], get_period_ordinal(date(2024, 9, 15), 7)), (ids[1], get_period_ordinal(date(2024, 9, 16), 7))])
+        self.assertEqual(len(logs.records), 4)
+        for pk, log in zip(ids[2:], logs.output):
+            self.assertIn("Deleting checkoff %s of habit %s" % (pk, habit.pk), log)
+            self.assertIn("by checkoff %s" % ids[1], log)
+        self.assertIn("Deleted 3 checkoffs", logs.output[-1])
+
+class BulkCheckoffViewTest(BaseTestSetup):
+
+    def post_bulk_checkoff(self, habit_ids):
+        return self.client.post(reverse("checkoff-habits"), {"habit_ids": habit_ids}, content_type="application/json")
+
+    def test_bulk_checkoff_view(self):
+        self.client.login(username="John", password="password1")
+        response = self.post_bulk_checkoff([self.habit1John.pk, self.habit2John.pk, self.habit1Jane.pk])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [
+            {"habit_id": self.habit1John.pk, "status": "checked-off"},
+            {"habit_id": self.habit2John.pk, "status": "checked-off"},
+            {"habit_id": self.habit1Jane.pk, "status": "not-found"},
+        ])
+        self.assertEqual(CheckOff.objects.count(), 40)
+        self.assertEqual(StreakState.objects.get(habit=self.habit1John).current_streak, 1)
+
+    def test_bulk_checkoff_view_skips_checked_habits(self):
+        self.client.login(username="John", password="password1")
+        self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit3John.pk}))
+        response = self.post_bulk_checkoff([self.habit3John.pk, self.habit1John.pk])
+
+        self.assertEqual([result["status"] for result in response.json()["results"]], ["already-checked-off", "checked-off"])
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+
+    def test_bulk_checkoff_view_skips_concurrent_checkoffs(self):
+        self.client.login(username="John", password="password1")
+
+        def check_off_concurrently(checkoffs):
+            # another request checks off the habit between the read of the checked habits and the insert
+            CheckOff.objects.create(habit=self.habit3John, date_added=timezone.now())
+            return insert_checkoffs(checkoffs)
+
+        with patch("habitusxapp.views.insert_checkoffs", side_effect=check_off_concurrently):
+            response = self.post_bulk_checkoff([self.habit3John.pk, self.habit1John.pk])
+
+        self.assertEqual([result["status"] for result in response.json()["results"]], ["already-checked-off", "checked-off"])
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+        self.assertEqual(DailyCheckOffCount.objects.get(user=self.user1, day=timezone.now().date()).checkoffs, 2)
+
+    def test_bulk_checkoff_view_query_count_is_constant(self):
+        self.client.login(username="John", password="password1")
+        habits = [Habit.objects.create(description="John Extra Habit %s" % value, user=self.user1, occurrence=self.dalyOccurrence) for value in range(10)]
+        with CaptureQueriesContext(connection) as few_habits:
+            self.post_bulk_checkoff([habit.pk for habit in habits[:2]])
+        with CaptureQueriesContext(connection) as many_habits:
+            self.post_bulk_checkoff([habit.pk for habit in habits[2:]])
+        self.assertEqual(len(few_habits), len(many_habits))
+
+    def test_bulk_checkoff_view_rejects_invalid_ids(self):
+        self.client.login(username="John", password="password1")
+        self.assertEqual(self.post_bulk_checkoff(["one"]).status_code, 400)
+
+
+class ConcurrentCheckoffTest(TransactionTestCase):
+    """
+    Checks off the same habits from several threads at once, each one with its own connection to the test database.
+    The in-memory test database fails with "database table is locked" instead of waiting for the lock like the
+    busy_timeout of the production settings, so the threads retry until their transaction goes through
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(username="John", password="password1")
+        occurrence = OccurrenceRate.objects.create(description="Daily", daily_rate=1)
+        self.habits = [Habit.objects.create(description="John Habit %s" % value, user=self.user, occurrence=occurrence) for value in range(5)]
+
+    def run_concurrently(self, functions):
+        barrier = threading.Barrier(len(functions))
+        results, errors = [], []
+
+        def run(function):
+            try:
+                barrier.wait()
+                for _ in range(1000):
+                    try:
+                        results.append(function())
+                        return
+                    except OperationalError as error:
+                        if "locked" not in str(error):
+                            raise
+                        time.sleep(0.001)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(function,)) for function in functions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), len(functions))
+        return results
+
+    def test_concurrent_bulk_inserts_insert_each_checkoff_once(self):
+        period = get_period_ordinal(timezone.now(), 1)
+
+        def check_off(habits):
+            def insert():
+                with transaction.atomic():
+                    return [checkoff.habit_id for checkoff in insert_checkoffs([CheckOff(habit=habit, period=period, date_added=timezone.now()) for habit in habits])]
+            return insert
+
+        # every thread checks off 3 of the 5 habits, which overlap with the ones of the other threads
+        inserted = self.run_concurrently([check_off([self.habits[(start + value) % 5] for value in range(3)]) for start in range(8)])
+        self.assertEqual(sorted(sum(inserted, [])), [habit.pk for habit in self.habits])
+        self.assertEqual(CheckOff.objects.count(), 5)
+
+    def test_concurrent_checkoff_requests_check_off_once(self):
+        habit = self.habits[0]
+        clients = []
+        for _ in range(8):
+            client = Client()
+            client.force_login(self.user)
+            clients.append(client)
+
+        def check_off(client):
+            return lambda: client.post(reverse("checkoff-habit", kwargs={"pk": habit.pk}), HTTP_X_REQUESTED_WITH="XMLHttpRequest").status_code
+
+        self.assertEqual(self.run_concurrently([check_off(client) for client in clients]), [200] * 8)
+        self.assertEqual(habit.checkoffs.count(), 1)
+        state = StreakState.objects.get(habit=habit)
+        self.assertEqual((state.current_streak, state.longest_streak), (1, 1))
+        self.assertEqual(DailyCheckOffCount.objects.get(user=self.user).checkoffs, 1)
+
+class ApiViewTest(BaseTestSetup):
+
+    def get_all_pages(self, url, limit):
+        items, cursor = [], None
+        while True:
+            response = self.client.get(url, {"limit": limit, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            items += response.json()["results"]
+            cursor = response.json()["next_cursor"]
+            if not cursor:
+                return items
+
+    def test_habits_api_paginates_with_cursor(self):
+        # habits created at the same instant must be paginated by id
+        for value in range(5):
+            Habit.objects.create(description="John Extra Habit %s" % value, user=self.user1, date_created=date(2024, 9, 16), occurrence=self.dalyOccurrence)
+        self.client.login(username="John", password="password1")
+        habits = self.get_all_pages(reverse("api-habits"), 2)
+        expected = Habit.objects.filter(user=self.user1).order_by("date_created", "pk")
+        self.assertEqual([habit["id"] for habit in habits], [habit.pk for habit in expected])
+        self.assertEqual(habits[0]["occurrence"]["daily_rate"], 1)
+        self.assertEqual(habits[0]["status"], "streak-broken")
+
+    def test_checkoffs_api_paginates_with_cursor(self):
+        self.client.login(username="John", password="password1")
+        checkoffs = self.get_all_pages(reverse("api-habit-checkoffs", kwargs={"pk": self.habit1John.pk}), 7)
+        self.assertEqual(len(checkoffs), 30)
+        self.assertEqual(checkoffs[0]["date_added"], "2024-09-30T00:00:00Z")
+        self.assertEqual(checkoffs[0]["period"], get_period_ordinal(date(2024, 9, 30), 1))
+        self.assertEqual(set(checkoffs[0]), {"id", "date_added", "period"})
+
+    def test_checkoffs_api_only_shows_own_habits(self):
+        self.client.login(username="John", password="password1")
+        response = self.client.get(reverse("api-habit-checkoffs", kwargs={"pk": self.habit1Jane.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_rejects_invalid_cursor(self):
+        self.client.login(username="John", password="password1")
+        self.assertEqual(self.client.get(reverse("api-habits"), {"cursor": "not-a-cursor"}).status_code, 400)
+
+    def test_api_requires_login(self):
+        self.assertEqual(self.client.get(reverse("api-habits")).status_code, 403)
+
+
+class AsyncViewTest(BaseTestSetup):
+
+    async def test_async_home_view_context(self):
+        await self.async_client.aforce_login(self.user2)
+        response = await self.async_client.get(reverse("async-home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([habit.description for habit in response.context["habits"]], ["Jane Habit 1", "Jane Habit 2"])
+
+    async def test_async_filtered_view_context(self):
+        await self.async_client.aforce_login(self.user1)
+        response = await self.async_client.get(reverse("async-filtered", kwargs={"occurrence": "any-occurrence", "checkedoffstatus": "streak-broken"}))
+        self.assertEqual([habit.description for habit in response.context["habits"]], ["John Habit 1", "John Habit 2", "John Habit 3"])
+
+    async def test_async_filtered_view_unknown_filter(self):
+        await self.async_client.aforce_login(self.user1)
+        response = await self.async_client.get(reverse("async-filtered", kwargs={"occurrence": "monthly", "checkedoffstatus": "any-status"}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_analytics_view_context(self):
+        await self.async_client.aforce_login(self.user1)
+        response = await self.async_client.get(reverse("async-analytics"))
+        self.assertTemplateUsed(response, "analytics.html")
+        self.assertEqual(response.context["habits_list"][0]["consecutive_count"], 30)
+        self.assertEqual(response.context["longest_streak_habits"][0]["habit"].description, "John Habit 1")
+
+        response = await self.async_client.get(reverse("async-analytics"), {"occurrence": "daily", "sort": "asc"})
+        self.assertEqual([habit["habit"].description for habit in response.context["habits_list"]], ["John Habit 3", "John Habit 1"])
+
+    async def test_async_views_require_login(self):
+        response = await self.async_client.get(reverse("async-home"))
+        self.assertEqual(response.status_code, 302)
+
 
 class AnalyticsViewTest(BaseTestSetup):
 
@@ -157,4 +662,957 @@ class AnalyticsViewTest(BaseTestSetup):
         self.assertEqual(longest_streak_habit_list[0]["consecutive_count"], 30)
         self.assertEqual(longest_streak_habit_list[0]["is_streak_active"], False)
 
-    # the analytics functionality that filters per occurrence is implemented with JavaScript in the template
\ No newline at end of file
+    def get_descriptions(self, **params):
+        response = self.client.get(reverse("analytics"), params)
+        return [enriched_habit["habit"].description for enriched_habit in response.context["habits_list"]]
+
+    def test_analytics_view_filters_per_occurrence(self):
+        self.client.login(username="John", password="password1")
+        self.assertEqual(self.get_descriptions(occurrence="daily"), ["John Habit 1", "John Habit 3"])
+        self.assertEqual(self.get_descriptions(occurrence="weekly"), ["John Habit 2"])
+        self.assertEqual(self.get_descriptions(occurrence="all"), ["John Habit 1", "John Habit 2", "John Habit 3"])
+        self.assertEqual(self.client.get(reverse("analytics"), {"occurrence": "monthly"}).status_code, 404)
+
+        response = self.client.get(reverse("analytics"), {"occurrence": "weekly"})
+        self.assertEqual([habit["habit"].description for habit in response.context["longest_streak_habits"]], ["John Habit 1"])
+
+    def test_analytics_view_sorts_in_the_database(self):
+        self.client.login(username="John", password="password1")
+        CheckOff.objects.create(habit=self.habit3John, date_added=date(2024, 9, 19))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_descriptions(sort="asc"), ["John Habit 2", "John Habit 3", "John Habit 1"])
+        self.assertTrue([query for query in queries if 'ORDER BY "habitusxapp_streakstate"."longest_streak" ASC' in query["sql"]])
+        self.assertEqual(self.get_descriptions(sort="desc"), ["John Habit 1", "John Habit 3", "John Habit 2"])
+        self.assertEqual(self.get_descriptions(sort="random"), ["John Habit 1", "John Habit 2", "John Habit 3"])
+
+    @patch("habitusxapp.views.ANALYTICS_PAGE_SIZE", 2)
+    def test_analytics_view_paginates(self):
+        self.client.login(username="John", password="password1")
+        self.assertEqual(self.get_descriptions(sort="desc"), ["John Habit 1", "John Habit 2"])
+        response = self.client.get(reverse("analytics"), {"sort": "desc", "page": 2})
+        self.assertEqual([habit["habit"].description for habit in response.context["habits_list"]], ["John Habit 3"])
+        self.assertEqual(response.context["page"], {"number": 2, "num_pages": 2, "start_index": 3, "previous_page_number": 1, "next_page_number": None})
+        self.assertContains(response, '<th scope="row">3</th>', html=True)
+        self.assertEqual(self.get_descriptions(page="last"), ["John Habit 1", "John Habit 2"])
+        self.assertEqual(self.get_descriptions(page=5), ["John Habit 3"])
+
+
+class StreakStateTest(BaseTestSetup):
+
+    def assertStreakState(self, habit, current_streak, longest_streak, is_active):
+        state = StreakState.objects.get(habit=habit)
+        self.assertEqual(state.current_streak, current_streak)
+        self.assertEqual(state.longest_streak, longest_streak)
+        self.assertEqual(state.is_active, is_active)
+
+    def test_streak_states_follow_checkoffs(self):
+        self.assertStreakState(self.habit1John, 30, 30, False)
+        self.assertStreakState(self.habit2John, 2, 2, False)
+        self.assertStreakState(self.habit3John, 2, 2, False)
+        self.assertStreakState(self.habit1Jane, 2, 2, False)
+        self.assertStreakState(self.habit2Jane, 1, 1, False)
+
+    def test_checkoff_view_updates_streak_state(self):
+        self.client.login(username="John", password="password1")
+        self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit1John.pk}))
+        self.assertStreakState(self.habit1John, 1, 30, True)
+
+    def test_new_habit_streak_state_is_pending(self):
+        habit = Habit.objects.create(description="John Habit 4", user=self.user1, occurrence=self.dalyOccurrence)
+        self.assertStreakState(habit, 0, 0, True)
+
+    def test_delete_habit_view_deletes_streak_state(self):
+        self.client.login(username="John", password="password1")
+        self.client.post(reverse("delete-habit", kwargs={"pk": self.habit1John.pk}))
+        self.assertFalse(StreakState.objects.filter(habit_id=self.habit1John.pk).exists())
+
+    def test_deleted_checkoffs_rebuild_streak_state(self):
+        CheckOff.objects.get(habit=self.habit1John, date_added=date(2024, 9, 30)).delete()
+        self.assertStreakState(self.habit1John, 29, 29, False)
+        self.assertEqual(StreakState.objects.get(habit=self.habit1John).last_period, get_period_ordinal(date(2024, 9, 29), 1))
+        self.habit1John.checkoffs.filter(date_added__day=10).delete()
+        self.assertStreakState(self.habit1John, 19, 19, False)
+        self.habit3John.checkoffs.all().delete()
+        self.assertStreakState(self.habit3John, 0, 0, False)
+
+    def test_backfill_command_rebuilds_streak_states(self):
+        StreakState.objects.all().delete()
+        call_command("backfill_streak_states", stdout=StringIO())
+        self.assertEqual(StreakState.objects.count(), 5)
+        self.assertStreakState(self.habit1John, 30, 30, False)
+        self.assertStreakState(self.habit1Jane, 2, 2, False)
+
+    def test_analytics_view_builds_missing_streak_states(self):
+        StreakState.objects.all().delete()
+        self.client.login(username="John", password="password1")
+        response = self.client.get(reverse("analytics"))
+        self.assertEqual(response.context["habits_list"][0]["consecutive_count"], 30)
+        self.assertEqual(StreakState.objects.filter(habit__user=self.user1).count(), 3)
+
+
+class LeaderboardTest(BaseTestSetup):
+
+    def assertLeaderboard(self, occurrence, habits):
+        entries = LeaderboardEntry.objects.filter(occurrence=occurrence).order_by("-longest_streak", "habit_id")
+        self.assertEqual([entry.habit_id for entry in entries], [habit.pk for habit in habits])
+
+    def test_leaderboards_follow_checkoffs(self):
+        self.assertLeaderboard(None, [self.habit1John, self.habit2John, self.habit3John, self.habit1Jane, self.habit2Jane])
+        self.assertLeaderboard(self.dalyOccurrence, [self.habit1John, self.habit3John, self.habit2Jane])
+        self.assertLeaderboard(self.weeklyOccurrence, [self.habit2John, self.habit1Jane])
+
+    @override_settings(HABITUSX_LEADERBOARD_SIZE=2)
+    def test_leaderboards_are_bounded(self):
+        rebuild_leaderboards()
+        self.assertLeaderboard(None, [self.habit1John, self.habit2John])
+        self.assertLeaderboard(self.dalyOccurrence, [self.habit1John, self.habit3John])
+
+        CheckOff.objects.create(habit=self.habit2Jane, date_added=date(2024, 9, 26))
+        CheckOff.objects.create(habit=self.habit2Jane, date_added=date(2024, 9, 27))
+        self.assertLeaderboard(None, [self.habit1John, self.habit2Jane])
+        self.assertLeaderboard(self.dalyOccurrence, [self.habit1John, self.habit2Jane])
+        self.assertLeaderboard(self.weeklyOccurrence, [self.habit2John, self.habit1Jane])
+        self.assertEqual(LeaderboardEntry.objects.get(occurrence=None, habit=self.habit2Jane).longest_streak, 3)
+
+    @override_settings(HABITUSX_LEADERBOARD_SIZE=2)
+    def test_leaderboards_follow_deleted_checkoffs(self):
+        rebuild_leaderboards()
+        self.habit1John.checkoffs.filter(date_added__day__gte=2).delete()
+        self.assertLeaderboard(None, [self.habit2John, self.habit3John])
+        self.assertLeaderboard(self.dalyOccurrence, [self.habit3John, self.habit1John])
+        self.habit2John.checkoffs.get(date_added__day=24).delete()
+        self.assertLeaderboard(self.weeklyOccurrence, [self.habit1Jane, self.habit2John])
+
+    @override_settings(HABITUSX_LEADERBOARD_SIZE=2)
+    def test_deleted_habits_are_replaced(self):
+        rebuild_leaderboards()
+        self.habit1John.delete()
+        self.assertLeaderboard(None, [self.habit2John, self.habit3John])
+        self.assertLeaderboard(self.dalyOccurrence, [self.habit3John, self.habit2Jane])
+
+    def test_shorter_rebuilt_streaks_rebuild_the_leaderboard(self):
+        self.habit1John.checkoffs.all().delete()
+        rebuild_streak_states(Habit.objects.filter(pk=self.habit1John.pk))
+        self.assertLeaderboard(None, [self.habit2John, self.habit3John, self.habit1Jane, self.habit2Jane])
+        self.assertLeaderboard(self.dalyOccurrence, [self.habit3John, self.habit2Jane])
+
+    def test_leaderboard_view(self):
+        self.client.login(username="John", password="password1")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("leaderboard", kwargs={"occurrence": "any-occurrence"}))
+        self.assertEqual([(entry.habit_id, entry.rank) for entry in response.context["entries"]], [
+            (self.habit1John.pk, 1), (self.habit2John.pk, 2), (self.habit3John.pk, 2), (self.habit1Jane.pk, 2), (self.habit2Jane.pk, 5),
+        ])
+        self.assertEqual(len([query for query in queries if "habitusxapp_leaderboardentry" in query["sql"]]), 1)
+        # the habits of the other users are anonymised until their owner opts in
+        self.assertContains(response, "John Habit 1")
+        self.assertNotContains(response, "Jane Habit 2")
+        self.assertNotContains(response, ">Jane<")
+        self.assertContains(response, "Anonymous", count=2)
+
+        self.client.login(username="Jane", password="password2")
+        self.client.post(reverse("leaderboard-visibility"), {"show_on_leaderboard": "on"})
+        self.assertTrue(Profile.objects.get(user=self.user2).show_on_leaderboard)
+        self.client.login(username="John", password="password1")
+        response = self.client.get(reverse("leaderboard", kwargs={"occurrence": "any-occurrence"}))
+        self.assertContains(response, "Jane Habit 2")
+        self.assertNotContains(response, "Anonymous")
+
+        response = self.client.get(reverse("leaderboard", kwargs={"occurrence": "weekly"}))
+        self.assertEqual([entry.habit_id for entry in response.context["entries"]], [self.habit2John.pk, self.habit1Jane.pk])
+        self.assertEqual(self.client.get(reverse("leaderboard", kwargs={"occurrence": "monthly"})).status_code, 404)
+
+    def test_rank_api(self):
+        self.client.login(username="John", password="password1")
+        response = self.client.get(reverse("api-habit-rank", kwargs={"pk": self.habit3John.pk}))
+        self.assertEqual(response.json(), {"id": self.habit3John.pk, "longest_streak": 2, "rank": 2, "occurrence_rank": 2})
+
+        habit = Habit.objects.create(description="John Habit 4", user=self.user1, occurrence=self.dalyOccurrence)
+        self.assertIsNone(self.client.get(reverse("api-habit-rank", kwargs={"pk": habit.pk})).json()["rank"])
+
+        # the habits of a leaderboard are ranked among its entries, the other ones with a count of the streak states
+        with override_settings(HABITUSX_LEADERBOARD_SIZE=2):
+            rebuild_leaderboards()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("api-habit-rank", kwargs={"pk": self.habit1John.pk}))
+            self.assertEqual((response.json()["rank"], response.json()["occurrence_rank"]), (1, 1))
+            self.assertFalse([query for query in queries if "COUNT(" in query["sql"] and "habitusxapp_streakstate" in query["sql"]])
+            response = self.client.get(reverse("api-habit-rank", kwargs={"pk": self.habit3John.pk}))
+            self.assertEqual((response.json()["rank"], response.json()["occurrence_rank"]), (2, 2))
+        self.assertEqual(self.client.get(reverse("api-habit-rank", kwargs={"pk": self.habit1Jane.pk})).status_code, 404)
+
+class RolloverStreaksTest(BaseTestSetup):
+
+    def setUp(self):
+        # the command requires a cache shared with the web processes
+        self.enterContext(override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": self.enterContext(tempfile.TemporaryDirectory())},
+        }))
+        super().setUp()
+        self.checked = Habit.objects.create(description="Jane checked daily habit", user=self.user2, date_created=timezone.now() - timedelta(days=3), occurrence=self.dalyOccurrence)
+        CheckOff.objects.create(habit=self.checked, date_added=timezone.now() - timedelta(days=1))
+        self.pending = Habit.objects.create(description="Jane new weekly habit", user=self.user2, occurrence=self.weeklyOccurrence)
+        # the state of every habit as it was before the streaks of the old habits were broken
+        StreakState.objects.update(is_active=True)
+
+    def rollover(self, **options):
+        out = StringIO()
+        call_command("rollover_streaks", workers=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_broken_streaks_are_marked(self):
+        self.assertIn("Checked 7 active streaks", self.rollover(chunk_size=2))
+        self.assertEqual(sorted(StreakState.objects.filter(is_active=True).values_list("habit_id", flat=True)), [self.checked.pk, self.pending.pk])
+        self.assertIn("Checked 2 active streaks", self.rollover())
+        self.assertIn("0 streaks were broken", self.rollover())
+
+    def test_rollover_requires_a_shared_cache(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            with self.assertRaises(CommandError):
+                self.rollover()
+        self.assertEqual(StreakState.objects.filter(is_active=True).count(), 7)
+
+    def test_rollover_invalidates_the_cached_cards(self):
+        self.client.login(username="Jane", password="password2")
+        self.assertContains(self.client.get(reverse("home")), "streak broken", count=0)
+        self.rollover()
+        self.assertContains(self.client.get(reverse("home")), "streak broken", count=2)
+
+    def test_new_habits_break_after_their_period(self):
+        Habit.objects.filter(pk=self.pending.pk).update(date_created=timezone.now() - timedelta(weeks=1))
+        self.rollover()
+        self.assertFalse(StreakState.objects.get(habit=self.pending).is_active)
+
+    def test_rollover_uses_the_time_zone_of_the_owner(self):
+        # 23:30 UTC on the 11th of November is already the 12th in Rome
+        now = datetime(2024, 11, 11, 23, 30, tzinfo=dt_timezone.utc)
+        Profile.objects.create(user=self.user2, time_zone="Europe/Rome")
+        StreakState.objects.filter(habit__in=[self.habit2Jane, self.habit3John]).update(last_period=get_period_ordinal(date(2024, 11, 10), 1))
+        mark_broken_streaks(self.habit1John.pk, self.pending.pk + 1, now)
+        self.assertFalse(StreakState.objects.get(habit=self.habit2Jane).is_active)
+        self.assertTrue(StreakState.objects.get(habit=self.habit3John).is_active)
+
+    def test_checkoffs_during_the_rollover_are_kept(self):
+        state = StreakState.objects.get(habit=self.habit1Jane)
+        state.last_period = get_period_ordinal(timezone.now(), 7)
+        state.save()
+        self.rollover()
+        self.assertTrue(StreakState.objects.get(habit=self.habit1Jane).is_active)
+
+    def test_filters_read_the_marked_streaks(self):
+        self.client.login(username="Jane", password="password2")
+        broken = reverse("filtered", kwargs={"occurrence": "any-occurrence", "checkedoffstatus": "streak-broken"})
+        unchecked = reverse("filtered", kwargs={"occurrence": "any-occurrence", "checkedoffstatus": "unchecked"})
+        self.assertEqual(len(self.client.get(broken).context["habits"]), 0)
+        self.assertEqual(len(self.client.get(unchecked).context["habits"]), 4)
+
+        self.rollover()
+        self.assertEqual([habit.pk for habit in self.client.get(broken).context["habits"]], [self.habit1Jane.pk, self.habit2Jane.pk])
+        self.assertEqual([habit.pk for habit in self.client.get(unchecked).context["habits"]], [self.checked.pk, self.pending.pk])
+
+class StreakQueryTest(BaseTestSetup):
+
+    def python_streaks(self, habit):
+        daily_rate = habit.occurrence.daily_rate
+        checkoffs = habit.checkoffs.order_by('date_added')
+        return compute_streaks(get_period_ordinal(checkoff.date_added, daily_rate) for checkoff in checkoffs)
+
+    def test_query_streaks_matches_python_streaks(self):
+        for user in [self.user1, self.user2]:
+            habits = Habit.objects.filter(user=user)
+            streaks = query_streaks(habits)
+            self.assertEqual(len(streaks), habits.count())
+            for habit in habits:
+                longest_streak, current_streak, last_period, last_checkoff_date = streaks[habit.pk]
+                self.assertEqual((longest_streak, current_streak, last_period), self.python_streaks(habit))
+                self.assertEqual(last_checkoff_date, habit.checkoffs.order_by('-date_added').first().date_added)
+
+    def test_query_streaks_uses_a_single_query(self):
+        with self.assertNumQueries(1):
+            query_streaks(Habit.objects.filter(user=self.user1))
+
+    def test_query_streaks_finds_latest_and_longest_runs(self):
+        habit = Habit.objects.create(description="John Habit 4", user=self.user1, date_created=date(2024, 9, 1), occurrence=self.dalyOccurrence)
+        for day in [1, 2, 3, 4, 10, 11, 20, 21]:
+            CheckOff.objects.create(habit=habit, date_added=date(2024, 9, day))
+        longest_streak, current_streak, last_period, last_checkoff_date = query_streaks(Habit.objects.filter(pk=habit.pk))[habit.pk]
+        self.assertEqual((longest_streak, current_streak), (4, 2))
+        self.assertEqual(last_period, get_period_ordinal(date(2024, 9, 21), 1))
+
+
+@skipIf(np is None, "numpy is not installed")
+class CheckOffBitmapTest(BaseTestSetup):
+
+    def test_history_streaks_match_compute_streaks(self):
+        generator = random.Random(1)
+        for daily_rate in [1, 7]:
+            for _ in range(50):
+                periods = sorted(generator.sample(range(2800, 3600), generator.randint(0, 300)))
+                bitmaps = {}
+                for period in periods:
+                    bitmaps.setdefault(get_period_year(period, daily_rate), []).append(period)
+                bitmaps = [(year, pack_periods(year_periods, year, daily_rate)) for year, year_periods in bitmaps.items()]
+                base, history = build_history(bitmaps, [], daily_rate)
+                self.assertEqual(get_history_periods(base, history), periods)
+                self.assertEqual(compute_history_streaks(base, history), compute_streaks(periods))
+
+    def test_completion_rate(self):
+        base, history = build_history([], [10, 11, 13], 1)
+        self.assertEqual(compute_completion_rate(base, history, 10, 13), 0.75)
+        self.assertEqual(compute_completion_rate(base, history, 8, 11), 0.5)
+        self.assertEqual(compute_completion_rate(base, history, 12, 12), 0.0)
+
+    def test_compact_checkoffs(self):
+        states = {state.habit_id: (state.longest_streak, state.current_streak, state.last_period) for state in StreakState.objects.all()}
+        recent = CheckOff.objects.create(habit=self.habit3John, date_added=timezone.now())
+
+        call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+
+        self.assertEqual(list(CheckOff.objects.all()), [recent])
+        self.assertEqual(CheckOffBitmap.objects.filter(year=2024).count(), 5)
+        self.assertEqual(len(CheckOffBitmap.objects.get(habit=self.habit1John).bits), 46)
+        states[self.habit3John.pk] = (2, 1, recent.period)
+        for state in rebuild_streak_states(Habit.objects.all()):
+            self.assertEqual((state.longest_streak, state.current_streak, state.last_period), states[state.habit_id])
+
+        # compacting again merges into the existing bitmaps
+        CheckOff.objects.create(habit=self.habit1John, date_added=date(2024, 10, 1))
+        call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+        self.assertEqual(rebuild_streak_states(Habit.objects.filter(pk=self.habit1John.pk))[0].longest_streak, 31)
+
+    def test_compact_checkoffs_keeps_the_local_periods_after_the_cutoff(self):
+        Profile.objects.create(user=self.user2, time_zone="Pacific/Honolulu")
+        # 20:00 on the 30th of September in Honolulu, after the cutoff 14 days before now
+        checkoff = CheckOff.objects.create(habit=self.habit2Jane, date_added=datetime(2024, 10, 1, 6, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(checkoff.period, get_period_ordinal(date(2024, 9, 30), 1))
+        with patch("django.utils.timezone.now", return_value=datetime(2024, 10, 15, 5, 0, tzinfo=dt_timezone.utc)):
+            call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+        self.assertEqual(list(self.habit2Jane.checkoffs.all()), [checkoff])
+
+    def test_compact_checkoffs_keeps_recent_periods(self):
+        with self.assertRaises(CommandError):
+            call_command("compact_checkoffs", "--keep-days", "7", stdout=StringIO())
+
+
+class CompletionTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime(2024, 10, 2, 12, 0, tzinfo=dt_timezone.utc)
+
+    def assertDailyCounts(self, user):
+        counts = dict(DailyCheckOffCount.objects.filter(user=user).values_list("day", "checkoffs"))
+        self.assertEqual(counts, {day: checkoffs for (_, day), checkoffs in count_history_days(Habit.objects.filter(user=user)).items()})
+        return counts
+
+    def get_completion(self, pk=None, bucket="day"):
+        url = reverse("api-habit-completion", kwargs={"pk": pk}) if pk else reverse("api-completion")
+        with patch("django.utils.timezone.now", return_value=self.now):
+            return self.client.get(url, {"bucket": bucket})
+
+    def test_daily_counts_follow_checkoffs(self):
+        counts = self.assertDailyCounts(self.user1)
+        # weekly checkoffs are counted on the monday of their week
+        self.assertEqual((counts[date(2024, 9, 16)], counts[date(2024, 9, 17)], counts[date(2024, 9, 18)]), (2, 2, 2))
+        self.assertEqual(sum(counts.values()), 34)
+
+        self.client.login(username="John", password="password1")
+        self.client.post(reverse("checkoff-habits"), {"habit_ids": [self.habit2John.pk, self.habit3John.pk]})
+        self.assertEqual(sum(self.assertDailyCounts(self.user1).values()), 36)
+
+        CheckOff.objects.filter(habit=self.habit3John, date_added__lt=date(2024, 10, 1)).delete()
+        self.habit1John.checkoffs.first().delete()
+        self.assertEqual(sum(self.assertDailyCounts(self.user1).values()), 33)
+        self.assertNotIn(date(2024, 9, 1), self.assertDailyCounts(self.user1))
+
+        self.habit2John.delete()
+        self.assertEqual(sum(self.assertDailyCounts(self.user1).values()), 30)
+        self.user1.delete()
+        self.assertFalse(DailyCheckOffCount.objects.filter(user_id=self.user1.pk).exists())
+        self.assertDailyCounts(self.user2)
+
+    def test_cascades_delete_checkoffs_in_bulk(self):
+        for habit, user in [(self.habit1John, None), (None, self.user2)]:
+            with CaptureQueriesContext(connection) as queries:
+                (habit or user).delete()
+            # the checkoffs are deleted with one statement, without being loaded
+            self.assertFalse([query for query in queries if query["sql"].startswith('SELECT "habitusxapp_checkoff"."id"')])
+            self.assertTrue([query for query in queries if query["sql"].startswith('DELETE FROM "habitusxapp_checkoff"')])
+        self.assertEqual(sum(self.assertDailyCounts(self.user1).values()), 4)
+
+    def test_compacted_checkoffs_are_still_counted(self):
+        self.client.login(username="John", password="password1")
+        before = [self.get_completion(habit.pk, "week").json() for habit in Habit.objects.filter(user=self.user1)]
+        counts = self.assertDailyCounts(self.user1)
+
+        call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+        get_cache().clear()
+        self.assertFalse(CheckOff.objects.exists())
+        self.assertEqual(self.assertDailyCounts(self.user1), counts)
+        self.assertEqual([self.get_completion(habit.pk, "week").json() for habit in Habit.objects.filter(user=self.user1)], before)
+
+    def test_user_heatmap(self):
+        self.client.login(username="John", password="password1")
+        heatmap = self.get_completion().json()["heatmap"]
+        self.assertEqual(len(heatmap), 365)
+        self.assertEqual(heatmap[-1], {"date": "2024-10-02", "checkoffs": 0})
+        self.assertIn({"date": "2024-09-17", "checkoffs": 2}, heatmap)
+
+        heatmap = self.get_completion(bucket="week").json()["heatmap"]
+        self.assertEqual(heatmap[0]["date"], "2023-10-02")
+        self.assertIn({"date": "2024-09-16", "checkoffs": 10}, heatmap)
+
+        heatmap = self.get_completion(bucket="month").json()["heatmap"]
+        self.assertEqual([item["date"] for item in heatmap[:2]], ["2023-10-01", "2023-11-01"])
+        self.assertEqual(heatmap[-2:], [{"date": "2024-09-01", "checkoffs": 34}, {"date": "2024-10-01", "checkoffs": 0}])
+        self.assertEqual(self.get_completion(bucket="year").status_code, 400)
+
+    def test_habit_completion(self):
+        self.client.login(username="John", password="password1")
+        completion = self.get_completion(self.habit1John.pk, "month").json()
+        # the current period is not checked off yet, and the habit was created on september 15th
+        self.assertEqual(completion["rates"], {"7": 5 / 6, "30": 16 / 17, "365": 16 / 17})
+        self.assertEqual(completion["heatmap"][-2:], [
+            {"date": "2024-09-01", "checkoffs": 16, "periods": 16},
+            {"date": "2024-10-01", "checkoffs": 0, "periods": 2},
+        ])
+        self.assertEqual(self.get_completion(self.habit2John.pk).json()["rates"], {"7": 1.0, "30": 1.0, "365": 1.0})
+
+        habit = Habit.objects.create(description="John Habit 4", user=self.user1, date_created=self.now, occurrence=self.dalyOccurrence)
+        self.assertEqual(self.get_completion(habit.pk).json()["rates"], {"7": None, "30": None, "365": None})
+        self.assertEqual(self.get_completion(self.habit1Jane.pk).status_code, 404)
+
+    def test_completion_is_cached_until_the_next_checkoff(self):
+        self.client.login(username="John", password="password1")
+        self.get_completion(self.habit3John.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.get_completion(self.habit3John.pk)
+        self.assertFalse([query for query in queries if "habitusxapp_checkoff" in query["sql"]])
+
+        with patch("django.utils.timezone.now", return_value=self.now):
+            self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit3John.pk}))
+        self.assertEqual(self.get_completion(self.habit3John.pk).json()["heatmap"][-1], {"date": "2024-10-02", "checkoffs": 1, "periods": 1})
+        self.assertEqual(self.get_completion().json()["heatmap"][-1], {"date": "2024-10-02", "checkoffs": 1})
+
+
+class StreakReportCommandTest(BaseTestSetup):
+
+    def run_report(self, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.csv")
+            call_command("streak_report", path, *args, stdout=StringIO())
+            with open(path) as report:
+                return {int(row["habit_id"]): row for row in csv.DictReader(report)}
+
+    def test_streak_report_matches_query_streaks(self):
+        streaks = query_streaks(Habit.objects.all())
+        for chunk_size in ["1", "3", "1000"]:
+            report = self.run_report("--chunk-size", chunk_size)
+            self.assertEqual(len(report), 5)
+            for habit_id, (longest_streak, current_streak, last_period, last_checkoff_date) in streaks.items():
+                row = report[habit_id]
+                self.assertEqual(int(row["longest_streak"]), longest_streak)
+                self.assertEqual(int(row["current_streak"]), current_streak)
+                self.assertEqual(int(row["last_period"]), last_period)
+                self.assertEqual(row["is_streak_active"], "0")
+
+    def test_streak_report_with_compacted_checkoffs(self):
+        expected = self.run_report()
+        CheckOff.objects.filter(habit=self.habit2Jane).delete()
+        CheckOff.objects.create(habit=self.habit2Jane, date_added=timezone.now())
+        expected[self.habit2Jane.pk] = self.run_report()[self.habit2Jane.pk]
+        call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+        CheckOff.objects.create(habit=self.habit1John, date_added=timezone.now())
+        expected[self.habit1John.pk] = {**expected[self.habit1John.pk], "checkoffs": "31", "current_streak": "1", "is_streak_active": "1"}
+        report = self.run_report("--chunk-size", "2")
+        for habit_id, row in expected.items():
+            for column in ["checkoffs", "longest_streak", "current_streak", "is_streak_active"]:
+                self.assertEqual(report[habit_id][column], row[column])
+
+    def test_streak_report_includes_habits_never_checked_off(self):
+        habit = Habit.objects.create(description="Jane new daily habit", user=self.user2, occurrence=self.dalyOccurrence)
+        report = self.run_report()
+        self.assertEqual(len(report), 6)
+        self.assertEqual(
+            [report[habit.pk][column] for column in ["checkoffs", "longest_streak", "current_streak", "last_period", "is_streak_active"]],
+            ["0", "0", "0", "", "1"],
+        )
+
+    def test_streak_report_uses_the_time_zone_of_the_owner(self):
+        # 23:30 UTC on the 11th of November is already the 12th in Rome
+        now = datetime(2024, 11, 11, 23, 30, tzinfo=dt_timezone.utc)
+        Profile.objects.create(user=self.user2, time_zone="Europe/Rome")
+        john_habit = Habit.objects.create(description="John daily habit", user=self.user1, date_created=date(2024, 11, 1), occurrence=self.dalyOccurrence)
+        jane_habit = Habit.objects.create(description="Jane daily habit", user=self.user2, date_created=date(2024, 11, 1), occurrence=self.dalyOccurrence)
+        for habit in [john_habit, jane_habit]:
+            CheckOff.objects.create(habit=habit, date_added=datetime(2024, 11, 10, 12, tzinfo=dt_timezone.utc))
+        with patch("django.utils.timezone.now", return_value=now):
+            report = self.run_report()
+        self.assertEqual((report[john_habit.pk]["is_streak_active"], report[jane_habit.pk]["is_streak_active"]), ("1", "0"))
+
+    def test_streak_report_counts_checkoffs(self):
+        report = self.run_report()
+        self.assertEqual(int(report[self.habit1John.pk]["checkoffs"]), 30)
+        self.assertEqual(int(report[self.habit1Jane.pk]["checkoffs"]), 2)
+        self.assertEqual(int(report[self.habit1Jane.pk]["user_id"]), self.user2.pk)
+
+
+@override_settings(HABITUSX_CHECKOFF_BUFFER=True)
+class CheckOffBufferTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        # the queue is flushed by the requests and by the tests, not by the background thread
+        patcher = patch.object(checkoff_buffer, "start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(checkoff_buffer.pending.clear)
+        self.client.login(username="John", password="password1")
+
+    def post_checkoff(self, habit):
+        return self.client.post(reverse("checkoff-habit", kwargs={"pk": habit.pk}), HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+
+    def test_checkoffs_are_queued(self):
+        self.assertContains(self.post_checkoff(self.habit3John), "checked-off")
+        self.assertContains(self.post_checkoff(self.habit3John), "checked-off")
+        self.assertEqual(self.habit3John.checkoffs.count(), 2)
+        self.assertEqual(len(checkoff_buffer.pending), 1)
+        self.assertTrue(checkoff_buffer.has_pending(self.user1.pk))
+        self.assertFalse(checkoff_buffer.has_pending(self.user2.pk))
+
+        self.assertTrue(checkoff_buffer.flush())
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+        self.assertEqual(StreakState.objects.get(habit=self.habit3John).last_period, get_period_ordinal(timezone.now(), 1))
+        self.assertFalse(checkoff_buffer.has_pending())
+
+    def test_reads_of_the_user_flush_the_queue(self):
+        self.client.get(reverse("home"))
+        self.post_checkoff(self.habit3John)
+        self.client.login(username="Jane", password="password2")
+        self.client.get(reverse("home"))
+        self.assertTrue(checkoff_buffer.has_pending(self.user1.pk))
+
+        self.client.login(username="John", password="password1")
+        habits = self.client.get(reverse("home")).context["habits"]
+        self.assertEqual({habit.pk: habit.status for habit in habits}[self.habit3John.pk], "checked")
+        self.assertFalse(checkoff_buffer.has_pending())
+
+    def test_flush_drops_deleted_habits(self):
+        self.post_checkoff(self.habit3John)
+        Habit.objects.filter(pk=self.habit3John.pk).delete()
+        self.post_checkoff(self.habit2John)
+        self.assertTrue(checkoff_buffer.flush())
+        self.assertEqual(self.habit2John.checkoffs.count(), 3)
+
+    def test_flush_requeues_on_locked_database(self):
+        self.post_checkoff(self.habit3John)
+        with patch.object(CheckOff.objects, "bulk_create", side_effect=OperationalError("database is locked")), self.assertLogs("habitusxapp.buffer", "WARNING"):
+            self.assertFalse(checkoff_buffer.flush())
+        self.assertTrue(checkoff_buffer.has_pending(self.user1.pk))
+        self.assertTrue(checkoff_buffer.flush())
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+
+    def test_flush_requeues_on_any_error(self):
+        self.post_checkoff(self.habit3John)
+        with patch("habitusxapp.buffer.record_checkoffs", side_effect=RuntimeError("receiver failed")), self.assertLogs("habitusxapp.buffer", "ERROR"):
+            self.assertFalse(checkoff_buffer.flush())
+        self.assertTrue(checkoff_buffer.has_pending(self.user1.pk))
+        self.assertEqual(self.habit3John.checkoffs.count(), 2)
+        self.assertTrue(checkoff_buffer.flush())
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+
+    def test_flush_records_only_inserted_checkoffs(self):
+        self.post_checkoff(self.habit3John)
+        # another process checks off the habit before the queue is flushed
+        CheckOff.objects.create(habit=self.habit3John, date_added=timezone.now())
+        self.assertTrue(checkoff_buffer.flush())
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+        self.assertEqual(DailyCheckOffCount.objects.get(user=self.user1, day=timezone.now().date()).checkoffs, 1)
+
+    @override_settings(HABITUSX_CHECKOFF_BUFFER_LATENCY=0)
+    def test_thread_survives_a_failed_flush(self):
+        buffer = CheckOffBuffer()
+        flushed = threading.Event()
+
+        def flush():
+            if not flushed.is_set():
+                flushed.set()
+                raise RuntimeError("flush failed")
+            with buffer.condition:
+                buffer.pending.clear()
+                buffer.queued_at = None
+            return True
+
+        with patch.object(buffer, "flush", side_effect=flush), patch("habitusxapp.buffer.close_old_connections"), self.assertLogs("habitusxapp.buffer", "ERROR"):
+            buffer.get_or_add(self.habit3John, get_period_ordinal(timezone.now(), 1), timezone.now())
+            self.assertTrue(flushed.wait(5))
+            for _ in range(50):
+                if not buffer.has_pending():
+                    break
+                time.sleep(0.1)
+            self.assertFalse(buffer.has_pending())
+            self.assertTrue(buffer.thread.is_alive())
+            buffer.stop()
+
+    def test_stop_flushes_the_queue(self):
+        buffer = CheckOffBuffer()
+        with patch.object(buffer, "start"):
+            buffer.get_or_add(self.habit3John, get_period_ordinal(timezone.now(), 1), timezone.now())
+        buffer.stop()
+        self.assertEqual(self.habit3John.checkoffs.count(), 3)
+
+
+@override_settings(HABITUSX_READ_ONLY_DATABASE="analytics")
+class ReadOnlyDatabaseTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        self.router = ReadOnlyRouter()
+
+    def test_reads_are_routed_within_read_only_queries(self):
+        self.assertIsNone(self.router.db_for_read(Habit))
+        with read_only_queries():
+            self.assertEqual(self.router.db_for_read(Habit), "analytics")
+            self.assertEqual(self.router.db_for_write(Habit), "default")
+        self.assertIsNone(self.router.db_for_read(Habit))
+
+    def test_read_only_database_is_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("analytics", "habitusxapp"))
+        self.assertIsNone(self.router.allow_migrate("default", "habitusxapp"))
+
+    def test_objects_of_both_databases_can_be_related(self):
+        self.habit1John._state.db = "analytics"
+        self.assertTrue(self.router.allow_relation(self.habit1John, self.user1))
+        self.user1._state.db = "other"
+        self.assertIsNone(self.router.allow_relation(self.habit1John, self.user1))
+
+    def new_connection(self, alias="default"):
+        # the test settings only have the default database, whose settings are reused for the other aliases
+        wrapper = connections.create_connection("default")
+        wrapper.alias = alias
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def read_pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute("PRAGMA %s" % name)
+            return cursor.fetchone()[0]
+
+    @override_settings(HABITUSX_SQLITE_PRAGMAS={"busy_timeout": 1234, "temp_store": "MEMORY"})
+    def test_pragmas_are_applied_to_new_connections(self):
+        wrapper = self.new_connection()
+        self.assertEqual(self.read_pragma(wrapper, "busy_timeout"), 1234)
+        self.assertEqual(self.read_pragma(wrapper, "temp_store"), 2)
+        self.assertEqual(self.read_pragma(wrapper, "query_only"), 0)
+
+    def test_read_only_connection_cannot_write(self):
+        wrapper = self.new_connection("analytics")
+        self.assertEqual(self.read_pragma(wrapper, "query_only"), 1)
+        with self.assertRaises(OperationalError), wrapper.cursor() as cursor:
+            cursor.execute("CREATE TABLE read_only_test (id integer)")
+
+class ServerTimingTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+        self.client.login(username="John", password="password1")
+
+    def get_timings(self, response):
+        return dict(re.findall(r"(\w+);dur=([\d.]+)", response["Server-Timing"])), re.search(r'desc="(\d+) queries"', response["Server-Timing"])
+
+    def test_server_timing_header(self):
+        for name in ["home", "analytics", "async-home", "async-analytics"]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name))
+            durations, description = self.get_timings(response)
+            self.assertEqual(set(durations), {"total", "db", "template"})
+            self.assertEqual(int(description.group(1)), len(queries))
+            self.assertGreater(float(durations["total"]), 0)
+            self.assertGreater(float(durations["template"]), 0)
+
+    def test_metrics_view_requires_staff(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+    def test_metrics_view_serves_histograms(self):
+        self.client.get(reverse("home"))
+        self.client.get(reverse("home"))
+        self.user1.is_staff = True
+        self.user1.save()
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        content = response.content.decode()
+        self.assertIn("# TYPE habitusx_request_duration_seconds histogram", content)
+        self.assertIn('habitusx_request_duration_seconds_count{view="home"} 2', content)
+        self.assertIn('habitusx_db_queries_bucket{view="home",le="+Inf"} 2', content)
+        self.assertIn("habitusx_cache_misses_total", content)
+
+
+class SyntheticDataBenchmarkTest(BaseTestSetup):
+
+    def test_generate_synthetic_data(self):
+        call_command("generate_synthetic_data", "--users", "2", "--habits", "3", "--years", "0.1", "--seed", "1", "--batch-size", "7", stdout=StringIO())
+        habits = Habit.objects.filter(user__username__startswith="synthetic-")
+        self.assertEqual(User.objects.filter(username__startswith="synthetic-").count(), 2)
+        self.assertEqual(habits.count(), 6)
+        self.assertEqual(StreakState.objects.filter(habit__in=habits).count(), 6)
+        streaks = query_streaks(habits)
+        for state in StreakState.objects.filter(habit__in=habits):
+            self.assertEqual(state.longest_streak, streaks[state.habit_id][0] if state.habit_id in streaks else 0)
+        for checkoff in CheckOff.objects.filter(habit__in=habits).select_related("habit__occurrence"):
+            self.assertEqual(checkoff.period, get_period_ordinal(checkoff.date_added, checkoff.habit.occurrence.daily_rate))
+
+    def test_benchmark_views_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            call_command("benchmark_views", "John", "--requests", "2", "--save-baseline", path, stdout=StringIO())
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+            self.assertEqual(set(baseline), {pattern.name for pattern in urlpatterns})
+            self.assertEqual(baseline["home"]["status"], 200)
+            self.assertEqual(baseline["checkoff-habits"]["method"], "POST")
+            # the POST requests are rolled back
+            self.assertTrue(Habit.objects.filter(pk=self.habit1John.pk).exists())
+            self.assertEqual(CheckOff.objects.count(), 38)
+
+            for result in baseline.values():
+                result["queries"] = 0
+            with open(path, "w") as baseline_file:
+                json.dump(baseline, baseline_file)
+            with self.assertRaisesMessage(CommandError, "home"):
+                call_command("benchmark_views", "John", "--requests", "2", "--compare", path, stdout=StringIO())
+
+
+class HistoryExportImportTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        self.client.login(username="John", password="password1")
+
+    def export(self, format):
+        response = self.client.get(reverse("export-history", kwargs={"format": format}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def get_streaks(self, user):
+        return sorted(
+            (habit.description, habit.streak_state.longest_streak, habit.streak_state.last_period, habit.checkoffs.count())
+            for habit in Habit.objects.filter(user=user).select_related("streak_state")
+        )
+
+    def test_export_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export("csv"))))
+        self.assertEqual(len(rows), 3 + 34)
+        self.assertEqual([row["record"] for row in rows[:4]], ["habit", "habit", "habit", "checkoff"])
+        self.assertEqual(rows[0]["description"], "John Habit 1")
+        self.assertEqual(rows[1]["daily_rate"], "7")
+
+    def test_export_includes_compacted_checkoffs(self):
+        before = self.export("ndjson")
+        call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+        after = self.export("ndjson")
+        self.assertEqual(len(after.splitlines()), len(before.splitlines()))
+        self.assertEqual(json.loads(after.splitlines()[3]), {"record": "checkoff", "habit_id": self.habit1John.pk, "date": "2024-09-01T00:00:00+00:00"})
+
+    def test_compacted_round_trip_in_a_negative_offset_zone(self):
+        # the local midnight of New York is the evening of the day before in UTC
+        new_york = ZoneInfo("America/New_York")
+        Profile.objects.create(user=self.user1, time_zone="America/New_York")
+        Profile.objects.create(user=self.user2, time_zone="America/New_York")
+        habits = [
+            Habit.objects.create(description="John New York Habit %s" % occurrence.daily_rate, user=self.user1, occurrence=occurrence, date_created=datetime(2024, 8, 1, tzinfo=new_york))
+            for occurrence in [self.dalyOccurrence, self.weeklyOccurrence]
+        ]
+        # the 4th and the 11th of August 2024 were sundays
+        for habit, days in zip(habits, [[4, 5, 12], [4, 11, 25]]):
+            for day in days:
+                CheckOff.objects.create(habit=habit, date_added=datetime(2024, 8, day, 21, tzinfo=new_york))
+        periods = {habit.description: sorted(habit.checkoffs.values_list("period", flat=True)) for habit in habits}
+        call_command("compact_checkoffs", "--keep-days", "14", stdout=StringIO())
+
+        state = rebuild_streak_states(Habit.objects.filter(pk=habits[0].pk))[0]
+        self.assertEqual(state.last_checkoff_date, datetime(2024, 8, 12, tzinfo=new_york))
+        history = SimpleUploadedFile("history.ndjson", self.export("ndjson").encode())
+        self.client.login(username="Jane", password="password2")
+        self.client.post(reverse("import-history"), {"file": history})
+        for description, habit_periods in periods.items():
+            imported = Habit.objects.get(user=self.user2, description=description)
+            self.assertEqual(list(imported.checkoffs.order_by("period").values_list("period", flat=True)), habit_periods)
+
+    def test_export_unknown_format(self):
+        self.assertEqual(self.client.get(reverse("export-history", kwargs={"format": "xml"})).status_code, 404)
+
+    def test_import_view_round_trip(self):
+        history = SimpleUploadedFile("history.ndjson", self.export("ndjson").encode())
+        self.client.login(username="Jane", password="password2")
+        response = self.client.post(reverse("import-history"), {"file": history})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"habits": 3, "checkoffs": 34, "skipped": 0})
+        imported = [streaks for streaks in self.get_streaks(self.user2) if streaks[0].startswith("John")]
+        self.assertEqual(imported, self.get_streaks(self.user1))
+
+    def test_import_invalid_file_imports_nothing(self):
+        lines = self.export("csv").splitlines()
+        lines.append("checkoff,999,,,2024-09-01")
+        response = self.client.post(reverse("import-history"), {"file": SimpleUploadedFile("history.csv", "\n".join(lines).encode())})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("line 39: unknown habit_id 999", response.json()["error"])
+        self.assertEqual(Habit.objects.count(), 5)
+
+    def test_import_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "history.csv")
+            with open(path, "w") as history:
+                history.write(self.export("csv"))
+                history.write("checkoff,%s,,,2024-09-01T18:00:00\n" % self.habit1John.pk)
+            output = StringIO()
+            call_command("import_history", "Jane", path, "--batch-size", "10", stdout=output)
+        self.assertIn("10 records imported", output.getvalue())
+        self.assertIn("Imported 3 habits and 34 checkoffs, skipped 1", output.getvalue())
+        self.assertEqual(Habit.objects.filter(user=self.user2).count(), 5)
+
+
+class QueryPlanTest(BaseTestSetup):
+
+    def assertQueryPlansUseIndexes(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        app_queries = [query["sql"] for query in queries if query["sql"].startswith("SELECT") and "habitusxapp_" in query["sql"]]
+        self.assertTrue(app_queries)
+        for sql in app_queries:
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            for step in plan:
+                self.assertNotIn("USE TEMP B-TREE", step, "%s\n%s" % (sql, "\n".join(plan)))
+                self.assertFalse(step.startswith("SCAN habitusxapp_") and "INDEX" not in step, "%s\n%s" % (sql, "\n".join(plan)))
+
+    def test_home_view_query_plans(self):
+        self.client.login(username="John", password="password1")
+        self.assertQueryPlansUseIndexes(reverse("home"))
+
+    def test_filtered_view_query_plans(self):
+        self.client.login(username="John", password="password1")
+        for occurrence in ["daily", "weekly", "any-occurrence"]:
+            for status in ["checked", "unchecked", "streak-broken", "any-status"]:
+                self.assertQueryPlansUseIndexes(reverse("filtered", kwargs={"occurrence": occurrence, "checkedoffstatus": status}))
+
+    def test_api_views_query_plans(self):
+        self.client.login(username="John", password="password1")
+        self.habit1John.refresh_from_db()
+        self.assertQueryPlansUseIndexes(reverse("api-habits") + "?limit=1&cursor=" + encode_cursor(self.habit1John.date_created, self.habit1John.pk))
+        self.assertQueryPlansUseIndexes(reverse("api-habit-checkoffs", kwargs={"pk": self.habit1John.pk}) + "?limit=1&cursor=" + encode_cursor(timezone.now(), 1))
+
+    def test_analytics_view_query_plans(self):
+        self.client.login(username="John", password="password1")
+        self.assertQueryPlansUseIndexes(reverse("analytics"))
+
+    @patch("habitusxapp.admin.ESTIMATED_COUNT_THRESHOLD", 0)
+    def test_admin_query_plans(self):
+        self.client.force_login(User.objects.create_superuser(username="admin", password="password3"))
+        url = reverse("admin:habitusxapp_checkoff_changelist")
+        for query in ["", "?date_added__year=2024", "?date_added__year=2024&date_added__month=9", "?date_added__year=2024&date_added__month=9&date_added__day=17", "?habit__id__exact=%s" % self.habit1John.pk]:
+            self.assertQueryPlansUseIndexes(url + query)
+        self.assertQueryPlansUseIndexes(reverse("admin:habitusxapp_habit_changelist"))
+
+
+class AdminTest(BaseTestSetup):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser(username="admin", password="password3"))
+
+    def get_changelist(self, model, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("admin:habitusxapp_%s_changelist" % model._meta.model_name), params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, [query["sql"] for query in queries]
+
+    @patch("habitusxapp.admin.ESTIMATED_COUNT_THRESHOLD", 0)
+    def test_changelists_do_not_query_per_row_or_count_the_table(self):
+        self.habit1John.checkoffs.filter(date_added__day=10).delete()
+        response, queries = self.get_changelist(CheckOff)
+        # the habits and occurrences are joined, and the count is estimated from the ids
+        self.assertFalse([sql for sql in queries if 'FROM "habitusxapp_habit"' in sql or "COUNT(" in sql])
+        self.assertEqual(response.context["cl"].result_count, CheckOff.objects.count() + 1)
+        self.assertContains(response, "John Habit 1")
+
+        response, queries = self.get_changelist(CheckOff, {"habit__id__exact": self.habit3John.pk})
+        self.assertEqual(response.context["cl"].result_count, 2)
+        response, queries = self.get_changelist(Habit)
+        # the only user read is the one of the session
+        self.assertEqual(len([sql for sql in queries if 'FROM "auth_user"' in sql]), 1)
+        self.assertFalse([sql for sql in queries if 'FROM "habitusxapp_occurrencerate"' in sql])
+
+    def test_date_hierarchy_matches_distinct_dates(self):
+        CheckOff.objects.create(habit=self.habit2Jane, date_added=datetime(2023, 12, 31, 23, 30, tzinfo=dt_timezone.utc))
+        checkoffs = CheckOffAdmin(CheckOff, admin.site).get_queryset(None)
+        for time_zone in [dt_timezone.utc, ZoneInfo("Europe/Rome")]:
+            with timezone.override(time_zone):
+                for kind in ["year", "month", "day"]:
+                    self.assertEqual(list(checkoffs.datetimes("date_added", kind)), list(CheckOff.objects.datetimes("date_added", kind)))
+                    self.assertEqual(
+                        list(checkoffs.filter(habit=self.habit2Jane).datetimes("date_added", kind)),
+                        list(CheckOff.objects.filter(habit=self.habit2Jane).datetimes("date_added", kind)),
+                    )
+
+        response, _ = self.get_changelist(CheckOff, {"date_added__year": 2024})
+        self.assertContains(response, "September 2024")
+        self.assertEqual(response.context["cl"].result_count, CheckOff.objects.count() - 1)
+
+    def test_delete_action_updates_the_rollup_and_the_cache(self):
+        version = get_user_version(self.user2.pk)
+        response = self.client.post(reverse("admin:habitusxapp_checkoff_changelist"), {
+            "action": "delete_selected", "post": "yes", "_selected_action": list(self.habit2Jane.checkoffs.values_list("pk", flat=True)),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.habit2Jane.checkoffs.exists())
+        self.assertEqual(sorted(DailyCheckOffCount.objects.filter(user=self.user2).values_list("day", flat=True)), [date(2024, 9, 9), date(2024, 9, 16)])
+        self.assertNotEqual(get_user_version(self.user2.pk), version)
+
+    def test_foreign_key_widgets(self):
+        response = self.client.get(reverse("admin:habitusxapp_checkoff_add"))
+        self.assertContains(response, "vForeignKeyRawIdAdminField")
+        response = self.client.get(reverse("admin:habitusxapp_habit_add"))
+        self.assertContains(response, "admin-autocomplete")
+
+
+class CacheTest(BaseTestSetup):
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return len([query for query in queries if "habitusxapp_" in query["sql"]])
+
+    def test_views_are_cached_per_user(self):
+        self.client.login(username="John", password="password1")
+        for url in [reverse("home"), reverse("analytics"), reverse("filtered", kwargs={"occurrence": "daily", "checkedoffstatus": "any-status"})]:
+            self.assertGreater(self.count_queries(url), 0)
+            self.assertEqual(self.count_queries(url), 0)
+
+        self.client.login(username="Jane", password="password2")
+        self.assertGreater(self.count_queries(reverse("home")), 0)
+
+    def test_checkoff_invalidates_cache(self):
+        self.client.login(username="John", password="password1")
+        self.client.get(reverse("analytics"))
+        self.client.post(reverse("checkoff-habit", kwargs={"pk": self.habit1John.pk}))
+        response = self.client.get(reverse("analytics"))
+        self.assertEqual(response.context["habits_list"][0]["current_streak"], 1)
+
+    def test_habit_deletion_invalidates_cache(self):
+        self.client.login(username="John", password="password1")
+        self.client.get(reverse("home"))
+        self.client.post(reverse("delete-habit", kwargs={"pk": self.habit1John.pk}))
+        response = self.client.get(reverse("home"))
+        self.assertEqual(len(response.context["habits"]), 2)
+
+    def test_cache_stats(self):
+        self.client.login(username="John", password="password1")
+        self.client.get(reverse("home"))
+        self.client.get(reverse("home"))
+        self.assertEqual(get_cache_stats(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
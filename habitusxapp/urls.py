@@ -1,11 +1,27 @@
 from django.urls import path
-from .views import  HabitsListView, HabitCreateView, FilteredHabitListView, HabitDeleteView, CheckoffCreateView, analytics_function_based_list_view
+from .async_views import async_habits_list_view, async_filtered_habit_list_view, async_analytics_view
+from .views import  HabitsListView, HabitCreateView, TimeZoneUpdateView, FilteredHabitListView, HabitDeleteView, CheckoffCreateView, BulkCheckoffCreateView, HabitApiListView, CheckoffApiListView, HabitRankApiView, CompletionApiView, LeaderboardView, LeaderboardVisibilityView, HistoryExportView, HistoryImportView, analytics_function_based_list_view, metrics_view
 
 urlpatterns = [
     path('', HabitsListView.as_view(), name='home'),
     path('add-new-habit', HabitCreateView.as_view(), name='add-new-habit'),
+    path('time-zone', TimeZoneUpdateView.as_view(), name='time-zone'),
     path('filter/<occurrence>/<checkedoffstatus>/', FilteredHabitListView.as_view(), name='filtered'),
     path('delete-habit/<int:pk>/', HabitDeleteView.as_view(), name='delete-habit'),
     path('checkoff-habit/<int:pk>/', CheckoffCreateView.as_view(), name='checkoff-habit'),
+    path('checkoff-habits/', BulkCheckoffCreateView.as_view(), name='checkoff-habits'),
     path('analytics', analytics_function_based_list_view, name='analytics'),
+    path('leaderboard/<occurrence>/', LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard-visibility', LeaderboardVisibilityView.as_view(), name='leaderboard-visibility'),
+    path('async/', async_habits_list_view, name='async-home'),
+    path('async/filter/<occurrence>/<checkedoffstatus>/', async_filtered_habit_list_view, name='async-filtered'),
+    path('async/analytics', async_analytics_view, name='async-analytics'),
+    path('api/habits/', HabitApiListView.as_view(), name='api-habits'),
+    path('api/habits/<int:pk>/checkoffs/', CheckoffApiListView.as_view(), name='api-habit-checkoffs'),
+    path('api/habits/<int:pk>/rank/', HabitRankApiView.as_view(), name='api-habit-rank'),
+    path('api/habits/<int:pk>/completion/', CompletionApiView.as_view(), name='api-habit-completion'),
+    path('api/completion/', CompletionApiView.as_view(), name='api-completion'),
+    path('export/<format>/', HistoryExportView.as_view(), name='export-history'),
+    path('import/', HistoryImportView.as_view(), name='import-history'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -1,22 +1,104 @@
+import binascii
+import io
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from django.contrib import messages
 from django.utils import timezone
 from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect
-from datetime import timedelta, date, datetime, time
-from .models import Habit, CheckOff
+from django.urls import reverse
+from datetime import datetime
+from django.core.paginator import Paginator
+from django.db.models import F, Max, Q
+from .forms import TimeZoneForm
+from .middleware import TIME_ZONE_SESSION_KEY
+from .models import Habit, CheckOff, LeaderboardEntry, Profile, StreakState, HABIT_STATUSES
+from .periods import get_period_ordinal, is_period_active
+from .streaks import insert_checkoffs, rebuild_streak_states, record_checkoffs
+from .buffer import checkoff_buffer, is_buffer_enabled
+from .cache import get_or_compute, get_many_or_compute, get_user_version, bump_user_version
 from django.views import View
 from django.http import HttpResponseRedirect
-from django.views.generic import ListView, CreateView
+from django.views.generic import ListView, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseNotAllowed
-from django.db.models import Q, Max
-from django.shortcuts import render
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.db import transaction
+from django.template.loader import get_template
+from django.template.response import TemplateResponse
+from django.utils.safestring import mark_safe
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, StreamingHttpResponse
+from .history import FORMATS, iter_history_lines, import_history
+from .metrics import registry
+from .routers import read_only_queries
+from .leaderboards import get_leaderboard_rank
+from .completion import HEATMAP_BUCKETS, get_habit_completion, get_user_heatmap
+
+
+CARD_KEY = "habitusx:card:%s:%s:%s:%s:%s"
+# the cached cards are keyed on the current period, so they never need to outlive a week
+CARD_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+ANALYTICS_PAGE_SIZE = 20
+# the orderings of the analytics table by sort parameter: habits with the same streak stay in creation order
+ANALYTICS_ORDERINGS = {
+    None: ["date_created", "pk"],
+    "asc": ["streak_state__longest_streak", "date_created", "pk"],
+    "desc": ["-streak_state__longest_streak", "date_created", "pk"],
+}
+
+
+def get_habit_list_context(habits, boundaries):
+    """
+    Returns the context of the habit list template for habits annotated with their status. The part of each card
+    that does not depend on the request (description, creation date, occurrence and status, see
+    partials/habit-card-body.html) is cached as card_body, keyed on the habit, the cache version of its owner
+    (see cache.get_user_version), its latest checkoff, its current period and the active time zone: a card is
+    rendered again when a habit or a checkoff of the owner is written (e.g. the habit is edited), when a streak of
+    the owner is broken by rollover_streaks, or when a new period starts.
+    The cards of a page are read from the cache at once. The forms of the cards are rendered with the page,
+    since their CSRF token belongs to the request
+    """
+    time_zone = timezone.get_current_timezone_name()
+    template = get_template("partials/habit-card-body.html")
+    versions = {}
+    cards = {}
+    for habit in habits:
+        if habit.user_id not in versions:
+            versions[habit.user_id] = get_user_version(habit.user_id)
+        habit.current_period = get_period_ordinal(boundaries.day, habit.occurrence.daily_rate)
+        latest_checkoff = habit.latest_checkoff_date.isoformat() if habit.latest_checkoff_date else ""
+        cards[CARD_KEY % (habit.pk, versions[habit.user_id], latest_checkoff, habit.current_period, time_zone)] = habit
+    bodies = get_many_or_compute(cards, lambda habit: template.render({"habit": habit}), CARD_CACHE_TIMEOUT)
+    for key, habit in cards.items():
+        habit.card_body = mark_safe(bodies[key])
+    return {"habits": habits}
+
+
+def is_fragment_request(request):
+    """
+    Tells if a request was sent by the script of the habit list page, which updates the page in place with the response
+    instead of following a redirect (see habit-list.html)
+    """
+    return request.headers.get("X-Requested-With") == "XMLHttpRequest"
 
-def get_week_monday_from_day(day):
+
+def filter_habits(habits, occurrence, checked_off_status):
     """
-    A utility function that returns the monday of the week in which parameter day belongs to
+    Filters a queryset of habits annotated with their status by occurrence and checked-off status,
+    based on the values of the filter URL. Raises Http404 for unknown values.
+    The statuses are the ones displayed on the cards (see HabitQuerySet.with_status), so every habit matches exactly one status
     """
-    return day - timedelta(days=day.weekday())
+    if occurrence == "daily": habits = habits.filter(occurrence__daily_rate=1)
+    elif occurrence == "weekly": habits = habits.filter(occurrence__daily_rate=7)
+    elif occurrence == "any-occurrence": habits = habits.filter(occurrence__daily_rate__in=[1, 7])
+    else: raise Http404('Occurrence 404')
+
+    if checked_off_status in HABIT_STATUSES: habits = habits.filter(status=checked_off_status)
+    elif checked_off_status == "any-status": pass
+    else: raise Http404(checked_off_status)
+
+    return habits
 
 
 class HabitsListView(LoginRequiredMixin, ListView):
@@ -27,23 +109,15 @@ class HabitsListView(LoginRequiredMixin, ListView):
     model = Habit
     template_name = "habit-list.html"
     context_object_name = "habits"
-    ordering = ["-date_created"]
+    ordering = ["date_created"]
 
     def get_queryset(self):
-        return Habit.objects.filter(user=self.request.user)
+        habits = Habit.objects.filter(user=self.request.user).with_status(self.request.period_boundaries).order_by(*self.ordering)
+        return get_or_compute(self.request.user.pk, "habits", lambda: list(habits), boundaries=self.request.period_boundaries)
 
     def get_context_data(self, **kwargs):
             context = super().get_context_data(**kwargs)
-            today = timezone.now().date()
-            yesterday = today - timedelta(days=1)
-            last_monday = today - timedelta(days=today.weekday())
-            two_mondays_ago = today - timedelta(days=today.weekday() + 7)
-            context["yesterday"] = yesterday
-            context["last_monday"] = last_monday
-            context["two_mondays_ago"] = two_mondays_ago
-            for habit in context['habits']:
-                latest_checkoff = habit.checkoffs.order_by('-date_added').first()
-                habit.latest_checkoff = latest_checkoff 
+            context.update(get_habit_list_context(context["habits"], self.request.period_boundaries))
             return context
 
 
@@ -55,108 +129,31 @@ class FilteredHabitListView(LoginRequiredMixin, ListView):
     model = Habit
     template_name = "habit-list.html"
     context_object_name = "habits"
+    ordering = ["date_created"]
 
     def get_queryset(self):
         """
-        Returns a list of habits filtered by occurrence and checked-off status based on the value of get parameters
+        Returns a list of habits filtered by occurrence and checked-off status based on the value of get parameters.
+        The checked-off status is annotated once per habit (see HabitQuerySet.with_status), so every combination
+        of filters is a single query. The result is cached per user until a habit or checkoff of the user changes
         """
         
-        today = datetime.combine(timezone.now().date(), time.min)
-        tomorrow = today + timedelta(days=1)
-        yesterday = today - timedelta(days=1)
-        day_before_yesterday = yesterday - timedelta(days=1)
-
-        monday = today - timedelta(days=today.weekday())
-        two_mondays_ago = today - timedelta(days=today.weekday() + 7)
-
         checked_off_status = self.kwargs.get("checkedoffstatus")
         occurrence = self.kwargs.get("occurrence")
 
-        daily_habits = Habit.objects.filter(occurrence__daily_rate=1, user=self.request.user)
-        weekly_habits = Habit.objects.filter(occurrence__daily_rate=7, user=self.request.user)
-
-        if occurrence == "daily": 
-            habits_checked = daily_habits.filter(
-                Q(checkoffs__date_added__date__gte=today),
-            ).distinct()
-            habits_unchecked = daily_habits.filter(
-                (Q(date_created__date=today) & Q(checkoffs__isnull=True)) |
-                (Q(checkoffs__date_added__gte=yesterday) & ~Q(checkoffs__date_added__gte=today))
-            ).distinct()
-            habits_broken = daily_habits.annotate(
-                max_date_added=Max('checkoffs__date_added')
-            ).filter(
-                Q(max_date_added__lt=yesterday) | 
-                Q(max_date_added__isnull=True, date_created__lt=today)).distinct()
-            habits_any_status = daily_habits
-        elif occurrence == "weekly":
-            habits_checked = weekly_habits.filter(
-                checkoffs__date_added__range=(monday, tomorrow)
-            ).distinct()
-            habits_unchecked = weekly_habits.annotate(
-                max_date_added=Max('checkoffs__date_added')
-            ).filter(
-                ((Q(date_created__gte=monday) & Q(checkoffs__isnull=True))) |
-                (Q(max_date_added__gte=two_mondays_ago) & Q(max_date_added__lt=monday))
-            ).distinct()
-            habits_broken = weekly_habits.annotate(
-                max_date_added=Max('checkoffs__date_added')
-            ).filter(
-                Q(max_date_added__lt=two_mondays_ago) |
-                Q(max_date_added__isnull=True, date_created__range=(two_mondays_ago, monday))
-            ).distinct()
-            habits_any_status = weekly_habits
-        elif occurrence == "any-occurrence": 
-            habits_checked = daily_habits.filter(
-                Q(checkoffs__date_added__date__gte=today),
-            ).distinct() | weekly_habits.filter(
-                checkoffs__date_added__range=(monday, tomorrow)
-            ).distinct()
-            habits_unchecked = weekly_habits.annotate(
-                max_date_added=Max('checkoffs__date_added')
-            ).filter(
-                ((Q(date_created__gte=monday) & Q(checkoffs__isnull=True))) |
-                (Q(max_date_added__gte=two_mondays_ago) & Q(max_date_added__lt=monday))
-            ).distinct() | daily_habits.filter(
-                (Q(date_created__date=today) & Q(checkoffs__isnull=True)) |
-                (Q(checkoffs__date_added__gte=yesterday) & ~Q(checkoffs__date_added__gte=today))
-            ).distinct()
-            habits_broken = daily_habits.annotate(
-                max_date_added=Max('checkoffs__date_added')
-            ).filter(
-                Q(max_date_added__lt=yesterday) | 
-                Q(max_date_added__isnull=True, date_created__lt=today)).distinct() | weekly_habits.annotate(
-                max_date_added=Max('checkoffs__date_added')
-            ).filter(
-                Q(max_date_added__lt=two_mondays_ago) |
-                Q(max_date_added__isnull=True, date_created__range=(two_mondays_ago, monday))
-            ).distinct()
-            habits_any_status = daily_habits | weekly_habits
-        else: raise Http404('Occurrence 404')
-
-        if checked_off_status == "checked": return habits_checked
-        elif checked_off_status == "unchecked": return habits_unchecked
-        elif checked_off_status == "streak-broken": return habits_broken
-        elif checked_off_status == "any-status": return habits_any_status
-        else: raise Http404(checked_off_status)
+        boundaries = self.request.period_boundaries
+        habits = Habit.objects.filter(user=self.request.user).with_status(boundaries).order_by(*self.ordering)
+        habits = filter_habits(habits, occurrence, checked_off_status)
+        return get_or_compute(self.request.user.pk, "filtered-habits", lambda: list(habits), "%s:%s" % (occurrence, checked_off_status), boundaries)
 
     def get_context_data(self, **kwargs):
         """
-        Enriches the contexts with variables that are useful to display elements in the view, 
-        such as the values of yesyerday, last_monday, and two_mondays_ago
+        Enriches the contexts with variables that are useful to display elements in the view,
+        such as the cached part of the card of each habit (see get_habit_list_context)
         """
         
         context = super().get_context_data(**kwargs)
-        today = timezone.now().date()
-        last_monday = today - timedelta(days=today.weekday())
-        two_mondays_ago = today - timedelta(days=today.weekday() + 7)
-        yesterday = today - timedelta(days=1)
-        context["yesterday"] = yesterday
-        context["last_monday"] = last_monday
-        context["two_mondays_ago"] = two_mondays_ago
-        for habit in context['habits']:
-            latest_checkoff = habit.checkoffs.order_by('-date_added').first()
-            habit.latest_checkoff = latest_checkoff 
+        context.update(get_habit_list_context(context["habits"], self.request.period_boundaries))
         return context
 
 
@@ -180,51 +177,488 @@ class HabitCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
     
+class TimeZoneUpdateView(LoginRequiredMixin, UpdateView):
+    """
+    Updates the time zone of the user, in which the days and weeks of their habits start.
+    Checkoffs already recorded keep the period they were recorded in.
+    On success, it redirects to the home page and shows a success message to the user
+    """
+
+    form_class = TimeZoneForm
+    template_name = "time-zone.html"
+
+    def get_object(self, queryset=None):
+        return Profile.objects.get_or_create(user=self.request.user)[0]
+
+    def get_success_url(self):
+        return "/"
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        self.request.session[TIME_ZONE_SESSION_KEY] = self.object.time_zone
+        # the cached pages depend on the boundaries of the periods
+        bump_user_version(self.request.user.pk)
+        messages.success(self.request, 'Your time zone is now %s' % self.object.time_zone)
+        return response
+
+
 class HabitDeleteView(LoginRequiredMixin, View):
     """
     Deletes a habit if a habit with the requested primary key belonging to the user that requested the deletion is found.
-    On success, it redirects to the home page and shows a success message to the user
+    Its checkoffs and its StreakState are deleted along with it.
+    When requested by the habit list page, it returns a JSON object with the id of the habit and whether it was deleted,
+    so that the page removes the card in place. Otherwise, it redirects to the home page and shows a success message
+    to the user
     """
     
     def post(self, request, pk):
         habit = get_object_or_404(Habit, pk=pk)
+        deleted = habit.user_id == request.user.pk
         
-        if habit.user == request.user:
+        if deleted:
             habit.delete()
 
+        if is_fragment_request(request):
+            return JsonResponse({"id": pk, "deleted": deleted})
+
         messages.success(self.request, 'The habit was successfully deleted')
         return redirect('/') 
 
        
 class CheckoffCreateView(LoginRequiredMixin, View):
     """
-    Creates a CheckOff entity associated to the habit that matches the primary key passed in the POST request.
-    On success, it shows a success message to the user
-    On error, it redirects to the home page and shows an error message to the user
+    Creates a CheckOff entity associated to the habit of the user that matches the primary key passed in the POST request.
+    The StreakState of the habit is updated incrementally when the CheckOff is saved (see signals.py).
+    A habit that has already been checked off in the current period is not checked off again.
+    With the write-behind buffer enabled, the CheckOff is queued and inserted shortly after (see buffer.py).
+    When requested by the habit list page, it returns the updated card of the habit, which the page swaps in place:
+    the card is built from the checkoff without querying the other habits of the user.
+    Otherwise, it shows a success message to the user and redirects to the page the request came from.
+    A habit that does not exist or belongs to another user is not found (404)
     """
+
+    # the requests of this view do not flush the buffer (see middleware.CheckOffBufferMiddleware)
+    buffers_checkoffs = True
     
     def post(self, request, pk):
-        habit = get_object_or_404(Habit, pk=pk)
+        # the profile of the owner is used to update the streak state (see signals.py)
+        habit = get_object_or_404(Habit.objects.select_related('occurrence', 'user__profile'), pk=pk, user=request.user)
 
-        if not habit:
-            messages.error(self.request, 'There was an error in checking off the habit. PLease try again')
-            return redirect('/') 
-        
-        CheckOff.objects.create(
-            habit=habit,
-            date_added=timezone.now()
-        )
+        period = get_period_ordinal(request.period_boundaries.day, habit.occurrence.daily_rate)
+        if is_buffer_enabled():
+            checkoff, created = checkoff_buffer.get_or_add(habit, period, timezone.now())
+        else:
+            checkoff, created = CheckOff.objects.get_or_create(habit=habit, period=period, defaults={"date_added": timezone.now()})
+
+        if is_fragment_request(request):
+            # the checkoff of the current period is the latest one
+            habit.status = "checked"
+            habit.latest_checkoff_date = checkoff.date_added
+            return TemplateResponse(request, "partials/habit-cards.html", get_habit_list_context([habit], request.period_boundaries))
+
+        if not created:
+            messages.info(self.request, 'The habit was already checked off')
+            return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
 
         messages.success(self.request, 'The habit was checked off successfully')
         return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
 
    
+class BulkCheckoffCreateView(LoginRequiredMixin, View):
+    """
+    Checks off several habits of the user at once. The ids of the habits are passed in the POST request, either
+    as repeated habit_ids form fields or as a JSON body like {"habit_ids": [1, 2, 3]}.
+    Ownership and the checkoffs of the current period are validated with one query each, then all the checkoffs are
+    inserted with a single bulk insert in one transaction. Habits already checked off in the current period are skipped.
+    It returns a JSON object with the outcome for each requested habit: checked-off, already-checked-off or not-found
+    """
+
+    def post(self, request):
+        try:
+            if request.content_type == "application/json":
+                habit_ids = json.loads(request.body)["habit_ids"]
+            else:
+                habit_ids = request.POST.getlist("habit_ids")
+            habit_ids = list(dict.fromkeys(int(habit_id) for habit_id in habit_ids))
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "habit_ids must be a list of habit ids"}, status=400)
+
+        now = timezone.now()
+        today = request.period_boundaries.day
+        habits = {habit.pk: habit for habit in Habit.objects.filter(user=request.user, pk__in=habit_ids).select_related("occurrence")}
+        periods = {habit.pk: get_period_ordinal(today, habit.occurrence.daily_rate) for habit in habits.values()}
+        already_checked = set(
+            CheckOff.objects.filter(habit__in=habits, period__in=set(periods.values())).values_list("habit_id", "period")
+        )
+
+        checkoffs = [
+            CheckOff(habit=habit, date_added=now, period=periods[habit.pk])
+            for habit in habits.values() if (habit.pk, periods[habit.pk]) not in already_checked
+        ]
+        if checkoffs:
+            with transaction.atomic():
+                # a concurrent request may have checked off some of the habits since they were read
+                checkoffs = insert_checkoffs(checkoffs)
+                record_checkoffs(checkoffs, today)
+            # bulk inserts do not send the post_save signal
+            bump_user_version(request.user.pk)
+
+        checked_ids = {checkoff.habit_id for checkoff in checkoffs}
+        results = []
+        for habit_id in habit_ids:
+            if habit_id not in habits: status = "not-found"
+            elif habit_id in checked_ids: status = "checked-off"
+            else: status = "already-checked-off"
+            results.append({"habit_id": habit_id, "status": status})
+
+        return JsonResponse({"results": results})
+
+
+class HistoryExportView(LoginRequiredMixin, View):
+    """
+    Streams the whole history of the user (see history.py) as a CSV or NDJSON attachment. The rows are read
+    in chunks and sent as they are produced, so the memory used does not depend on the size of the history
+    """
+
+    content_types = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+    def get(self, request, format):
+        if format not in FORMATS:
+            raise Http404("Unknown export format")
+        response = StreamingHttpResponse(iter_history_lines(request.user, format), content_type=self.content_types[format])
+        response["Content-Disposition"] = 'attachment; filename="habitusx-history.%s"' % format
+        return response
+
+
+class HistoryImportView(LoginRequiredMixin, View):
+    """
+    Imports a history file uploaded as the file field of a multipart POST request (see history.import_history).
+    The format is given by the format field, or else by the extension of the file name.
+    It returns a JSON object with the number of imported habits and checkoffs, or the validation error with status 400
+    """
+
+    raise_exception = True
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return JsonResponse({"error": "A history file is required"}, status=400)
+        format = request.POST.get("format") or upload.name.rsplit(".", 1)[-1].lower()
+        if format not in FORMATS:
+            return JsonResponse({"error": "The format must be one of %s" % ", ".join(FORMATS)}, status=400)
+
+        try:
+            counts = import_history(request.user, io.TextIOWrapper(upload, encoding="utf-8", newline=""), format)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        return JsonResponse(counts)
+
+
+def encode_cursor(moment, pk):
+    """
+    Encodes the position of the last item of a page, used to fetch the following page
+    """
+    return urlsafe_b64encode(json.dumps([moment.isoformat(), pk]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor created by encode_cursor, raising ValueError if it is not valid
+    """
+    try:
+        moment, pk = json.loads(urlsafe_b64decode(cursor.encode()))
+        moment = datetime.fromisoformat(moment)
+    except (TypeError, binascii.Error, json.JSONDecodeError, UnicodeError) as error:
+        raise ValueError(cursor) from error
+    if timezone.is_naive(moment) or not isinstance(pk, int):
+        raise ValueError(cursor)
+    return moment, pk
+
+
+class KeysetPaginatedApiView(LoginRequiredMixin, View):
+    """
+    Base class of the read-only JSON API views, which list the instances of model. Items are paginated with a cursor
+    (keyset pagination) on the (ordering_field, id) pair instead of an offset, so that every page is read with an index
+    seek and fetching page 1000 costs the same as fetching page 1. ordering_field is a DateTimeField of model, and
+    every item is serialized as its id and the attributes named by fields.
+    The limit GET parameter sets the page size, and the cursor GET parameter the position returned by the previous page
+    """
+
+    raise_exception = True
+    model = None
+    fields = ()
+    ordering_field = None
+    descending = False
+    default_limit = 50
+    max_limit = 200
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def serialize(self, item):
+        return {"id": item.pk, **{name: getattr(item, name) for name in self.fields}}
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.GET.get("limit", self.default_limit)), self.max_limit)
+            cursor = decode_cursor(request.GET["cursor"]) if "cursor" in request.GET else None
+        except ValueError:
+            return JsonResponse({"error": "invalid limit or cursor"}, status=400)
+        if limit < 1:
+            return JsonResponse({"error": "invalid limit or cursor"}, status=400)
+
+        field = self.ordering_field
+        items = self.get_queryset()
+        if cursor:
+            moment, pk = cursor
+            # the first condition is a range on the index, the second one only breaks ties
+            if self.descending:
+                items = items.filter(**{field + "__lte": moment}).filter(Q(**{field + "__lt": moment}) | Q(pk__lt=pk))
+            else:
+                items = items.filter(**{field + "__gte": moment}).filter(Q(**{field + "__gt": moment}) | Q(pk__gt=pk))
+        prefix = "-" if self.descending else ""
+        items = list(items.order_by(prefix + field, prefix + "pk")[:limit + 1])
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(getattr(items[-1], field), items[-1].pk)
+
+        return JsonResponse({"results": [self.serialize(item) for item in items], "next_cursor": next_cursor})
+
+
+class HabitApiListView(KeysetPaginatedApiView):
+    """
+    Lists the habits of the user with their occurrence, latest checkoff and checked-off status, ordered by creation date
+    """
+
+    model = Habit
+    ordering_field = "date_created"
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user).with_status(self.request.period_boundaries)
+
+    def serialize(self, habit):
+        return {
+            "id": habit.pk,
+            "description": habit.description,
+            "date_created": habit.date_created,
+            "occurrence": {
+                "id": habit.occurrence.pk,
+                "description": habit.occurrence.description,
+                "daily_rate": habit.occurrence.daily_rate,
+            },
+            "latest_checkoff_date": habit.latest_checkoff_date,
+            "status": habit.status,
+        }
+
+
+class CheckoffApiListView(KeysetPaginatedApiView):
+    """
+    Lists the checkoffs of a habit of the user, most recent first
+    """
+
+    model = CheckOff
+    fields = ("date_added", "period")
+    ordering_field = "date_added"
+    descending = True
+
+    def get_queryset(self):
+        habit = get_object_or_404(Habit, pk=self.kwargs["pk"], user=self.request.user)
+        return super().get_queryset().filter(habit=habit)
+
+
+class HabitRankApiView(LoginRequiredMixin, View):
+    """
+    Returns the longest streak of a habit of the user and its rank in the leaderboard of all the occurrences and in the
+    one of its occurrence (see leaderboards.py). The rank is null if the habit has never been checked off
+    """
+
+    raise_exception = True
+
+    def get(self, request, pk):
+        state = get_object_or_404(StreakState.objects.select_related("habit"), habit_id=pk, habit__user=request.user)
+        return JsonResponse({
+            "id": pk,
+            "longest_streak": state.longest_streak,
+            "rank": get_leaderboard_rank(state),
+            "occurrence_rank": get_leaderboard_rank(state, state.habit.occurrence_id),
+        })
+
+
+class CompletionApiView(LoginRequiredMixin, View):
+    """
+    Returns the completion heatmap of the last year of all the habits of the user, or the heatmap and the completion
+    rates of one habit of the user (see completion.py). The bucket GET parameter groups the heatmap by day
+    (the default), week or month. The response is cached per habit and bucket, until the next write of the user
+    or their next day rollover
+    """
+
+    raise_exception = True
+
+    def get(self, request, pk=None):
+        bucket = request.GET.get("bucket", "day")
+        if bucket not in HEATMAP_BUCKETS:
+            return JsonResponse({"error": "bucket must be one of %s" % ", ".join(HEATMAP_BUCKETS)}, status=400)
+
+        today = request.period_boundaries.day
+        if pk is None:
+            compute = lambda: {"bucket": bucket, "heatmap": get_user_heatmap(request.user, today, bucket)}
+        else:
+            habit = get_object_or_404(Habit.objects.select_related("occurrence"), pk=pk, user=request.user)
+            compute = lambda: {"id": pk, "bucket": bucket, **get_habit_completion(habit, today, request.time_zone, bucket)}
+        return JsonResponse(get_or_compute(request.user.pk, "completion", compute, "%s:%s" % (pk or "", bucket), request.period_boundaries))
+
+
+class LeaderboardView(LoginRequiredMixin, ListView):
+    """
+    Displays the habits with the longest streaks across all users, for all the occurrences (any-occurrence) or for
+    daily or weekly habits only. The leaderboard is kept up to date as habits are checked off (see leaderboards.py),
+    so it is read with a single indexed query however many habits there are.
+    Habits with the same streak share the same rank. The habits of the other users are anonymised, unless their owner
+    has opted in (see Profile.show_on_leaderboard)
+    """
+
+    model = LeaderboardEntry
+    template_name = "leaderboard.html"
+    context_object_name = "entries"
+
+    def get_queryset(self):
+        occurrence = self.kwargs.get("occurrence")
+        entries = LeaderboardEntry.objects.select_related("habit__user__profile", "habit__occurrence").order_by("-longest_streak", "habit_id")
+        if occurrence == "daily": return entries.filter(occurrence__daily_rate=1)
+        elif occurrence == "weekly": return entries.filter(occurrence__daily_rate=7)
+        elif occurrence == "any-occurrence": return entries.filter(occurrence__isnull=True)
+        else: raise Http404('Occurrence 404')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        rank, previous_streak = 0, None
+        for position, entry in enumerate(context["entries"], 1):
+            if entry.longest_streak != previous_streak:
+                rank, previous_streak = position, entry.longest_streak
+            entry.rank = rank
+            profile = getattr(entry.habit.user, "profile", None)
+            entry.is_public = entry.habit.user_id == self.request.user.pk or (profile is not None and profile.show_on_leaderboard)
+        context["occurrence"] = self.kwargs.get("occurrence")
+        profile = Profile.objects.filter(user=self.request.user).first()
+        context["show_on_leaderboard"] = profile is not None and profile.show_on_leaderboard
+        return context
+
+
+class LeaderboardVisibilityView(LoginRequiredMixin, View):
+    """
+    Lets the user opt in to (or out of) showing their username and the descriptions of their habits to the other users
+    on the leaderboards, then redirects to the leaderboard the request comes from
+    """
+
+    def post(self, request):
+        profile = Profile.objects.get_or_create(user=request.user)[0]
+        profile.show_on_leaderboard = request.POST.get("show_on_leaderboard") == "on"
+        profile.save(update_fields=["show_on_leaderboard"])
+        return HttpResponseRedirect(request.META.get("HTTP_REFERER", reverse("leaderboard", kwargs={"occurrence": "any-occurrence"})))
+
+
+def build_analytics_habits_list(habits, today):
+    """
+    Enriches habits (with their occurrence and StreakState already loaded) with the values of their StreakState.
+    today is the current local date of the user
+    """
+    habits_list = []
+
+    for habit in habits:
+        state = habit.streak_state
+        habits_list.append({
+            "habit": habit,
+            "last_date": state.last_checkoff_date,
+            "consecutive_count": state.longest_streak,
+            "current_streak": state.current_streak,
+            "is_streak_active": is_period_active(state.last_period, habit.occurrence.daily_rate, today),
+        })
+
+    return habits_list
+
+
+def get_analytics_habits(user, occurrence, sort_order):
+    """
+    Returns the habits of a user shown in the analytics table, with their occurrence and StreakState, filtered by
+    occurrence (all, daily or weekly) and ordered by longest streak (asc or desc, otherwise by creation date)
+    in the database
+    """
+    habits = Habit.objects.filter(user=user).select_related('occurrence', 'streak_state')
+    if occurrence == "daily": habits = habits.filter(occurrence__daily_rate=1)
+    elif occurrence == "weekly": habits = habits.filter(occurrence__daily_rate=7)
+    return habits.order_by(*ANALYTICS_ORDERINGS[sort_order])
+
+
+def get_analytics_page(user, today, occurrence, sort_order, page_number):
+    """
+    Returns the context of the analytics table for one page of the habits of a user (see get_analytics_habits),
+    enriched with the values of their persisted StreakState, and the habits of the user with the longest streak.
+    Only the habits of the page and the ones with the longest streak are read, from the read-only database
+    if there is one (see routers.py). The pagination is returned as a dictionary, so that the context can be cached
+    """
+    with read_only_queries():
+        habits_without_state = list(Habit.objects.filter(user=user, streak_state__isnull=True).values_list('pk', flat=True))
+    # habits created before the streak state table existed get their state built on the fly
+    if habits_without_state:
+        rebuild_streak_states(Habit.objects.filter(pk__in=habits_without_state), today)
+
+    with read_only_queries():
+        page = Paginator(get_analytics_habits(user, occurrence, sort_order), ANALYTICS_PAGE_SIZE).get_page(page_number)
+        habits = list(page.object_list)
+        states = StreakState.objects.filter(habit__user=user)
+        highest_count = states.aggregate(highest_count=Max('longest_streak'))['highest_count']
+        longest_streak_habits = []
+        if highest_count is not None:
+            # the streak is compared as an expression (+ 0), which SQLite cannot look up in the index of the longest
+            # streaks of all the users (see models.StreakState), so it reads the habits of the user instead
+            longest_streak_habits = list(
+                get_analytics_habits(user, "all", None)
+                .alias(unindexed_longest_streak=F('streak_state__longest_streak') + 0)
+                .filter(unindexed_longest_streak=highest_count)
+            )
+
+    return {
+        "habits_list": build_analytics_habits_list(habits, today),
+        "longest_streak_habits": build_analytics_habits_list(longest_streak_habits, today),
+        "page": {
+            "number": page.number,
+            "num_pages": page.paginator.num_pages,
+            "start_index": page.start_index(),
+            "previous_page_number": page.previous_page_number() if page.has_previous() else None,
+            "next_page_number": page.next_page_number() if page.has_next() else None,
+        },
+    }
+
+
+def get_analytics_parameters(request):
+    """
+    Returns the occurrence, sort and page parameters of an analytics request. Raises Http404 for unknown occurrences,
+    while unknown sort orders and invalid pages fall back to the creation order and to the first page
+    """
+    occurrence = request.GET.get('occurrence', 'all')
+    if occurrence not in ["all", "daily", "weekly"]:
+        raise Http404('Occurrence 404')
+    sort_order = request.GET.get('sort') if request.GET.get('sort') in ANALYTICS_ORDERINGS else None
+    try:
+        page_number = int(request.GET.get('page', 1))
+    except ValueError:
+        page_number = 1
+    return occurrence, sort_order, page_number
+
+
 def analytics_function_based_list_view(request):
     """
-    It returns a collection of habits which are enriched with the following information:
+    It returns a page of the habits of the user which are enriched with the following information:
         - The last date in which they were checked off
         - The maximum number of consecutive checkoffs (streak), according to the specific habit's occurrence (daily or weekly)
-        - If their maximum streak of checkoffs is currently active or has been broken
+        - The length of the latest streak, and if it is currently active or has been broken
+
+    The habits are filtered by the occurrence GET parameter (all, daily or weekly), sorted by streak length with the
+    sort parameter (asc or desc) and paginated with the page parameter, in the database: the values are read from
+    the persisted StreakState of each habit, so the cost of the view depends neither on the length of the checkoff
+    history nor on the number of habits. Each page is cached per user (see cache.py)
 
     In addition, the context provided to the view by this function also includes a collection of habits with the
     longest streak among all tracked habits
@@ -233,78 +667,25 @@ def analytics_function_based_list_view(request):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET']) 
     
-    sort_order = request.GET.get('sort')
-    
-    today = timezone.now().date()
-    yesterday = today - timedelta(days=1)
-
-    habits = Habit.objects.filter(user=request.user).order_by('date_created')
-    habits_list = []
-
-    for habit in habits:
-        checkoffs = CheckOff.objects.filter(habit=habit).order_by('date_added')
-        
-        consecutive_count = 0
-        is_streak_active = False
-        
-        if checkoffs.exists() and habit.occurrence.daily_rate == 1:
-            consecutive_count = 1 
-            last_date = checkoffs.first().date_added  
-            
-            for checkoff in checkoffs[1:]:
-                if checkoff.date_added.date() == last_date.date() + timedelta(days=1):
-                    consecutive_count += 1
-                    last_date = checkoff.date_added
-                else:
-                    break
-                
-            most_recent_date = checkoffs.last().date_added
-            
-            if most_recent_date.date() == yesterday or most_recent_date.date() == today:
-                is_streak_active = True
-
-        elif checkoffs.exists() and habit.occurrence.daily_rate == 7:    
-            consecutive_count = 1
-            current_week_monday = get_week_monday_from_day(date.today())
-            last_week_monday = current_week_monday - timedelta(weeks=1)
-            last_week_monday_checkoff = get_week_monday_from_day(checkoffs.first().date_added)
-
-            for checkoff in checkoffs[1:]:
-                current_week_monday_checkoff = get_week_monday_from_day(checkoff.date_added)
-                if current_week_monday_checkoff.date() == last_week_monday_checkoff.date() + timedelta(weeks=1):
-                    consecutive_count += 1
-                    last_week_monday_checkoff = current_week_monday_checkoff
-                else:
-                    break
-
-            most_recent_date = checkoffs.last().date_added
-            most_recent_monday = get_week_monday_from_day(most_recent_date)
-
-            if most_recent_monday.date() == current_week_monday or most_recent_monday.date() == last_week_monday:
-                is_streak_active = True
-        
-        habits_list.append({
-            "habit": habit,
-            "last_date": last_date,
-            "consecutive_count": consecutive_count,
-            "is_streak_active": is_streak_active, 
-        })
+    occurrence, sort_order, page_number = get_analytics_parameters(request)
+    boundaries = request.period_boundaries
 
-    if sort_order == "asc":
-        habits_list = sorted(habits_list, key=lambda x: x["consecutive_count"])
-    elif sort_order == "desc":
-        habits_list = sorted(habits_list, key=lambda x: x["consecutive_count"], reverse=True)
+    context = get_or_compute(
+        request.user.pk, "analytics",
+        lambda: get_analytics_page(request.user, boundaries.day, occurrence, sort_order, page_number),
+        "%s:%s:%s" % (occurrence, sort_order, page_number), boundaries,
+    )
+    context = {**context, "occurrence": occurrence, "sort": sort_order}
 
-    longest_streak_habits = []
-    if not habits_list:
-        longest_streak_habits = []
-    else: 
-        highest_count = max(habit["consecutive_count"] for habit in habits_list)
-        longest_streak_habits = [habit for habit in habits_list if habit["consecutive_count"] == highest_count]
+    # a TemplateResponse, so that ServerTimingMiddleware can time the rendering
+    return TemplateResponse(request, 'analytics.html', context)
 
-    context = {
-        "habits_list": habits_list,
-        "longest_streak_habits": longest_streak_habits
-    }
 
-    return render(request, 'analytics.html', context)
\ No newline at end of file
+def metrics_view(request):
+    """
+    Serves the request metrics recorded by ServerTimingMiddleware (see metrics.py) in the Prometheus text format.
+    Only staff users can read them
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
\ No newline at end of file